@@ -0,0 +1,15 @@
+"""app URL Configuration under ASGI
+
+Async views for the read-heavy recipe endpoints and for the password
+hashing user endpoints take precedence; every other URL is served by the
+regular patterns in app.urls.
+"""
+
+from django.urls import path, include
+
+from app import urls
+
+urlpatterns = [
+    path('api/recipe/', include('recipe.async_urls')),
+    path('api/user/', include('user.async_urls')),
+] + urls.urlpatterns
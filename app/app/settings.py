@@ -47,6 +47,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ServerTimingMiddleware',
+    'core.middleware.AdmissionControlMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,16 +83,50 @@ WSGI_APPLICATION = 'app.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
+# Connections are checked out of a per-process pool (core.db.pool) and
+# returned at the end of every request, so CONN_MAX_AGE stays at 0.
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'core.db.backends.postgresql_pool',
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'POOL': {
+            'MIN_SIZE': int(os.environ.get('DB_POOL_MIN_SIZE', 0)),
+            'MAX_SIZE': int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+            'TIMEOUT': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'MAX_LIFETIME': float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+            'MAX_IDLE': float(os.environ.get('DB_POOL_MAX_IDLE', 600)),
+            'CHECK_INTERVAL': float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30)),
+        },
     }
 }
 
+# Read replicas
+# DB_REPLICA_HOSTS is a comma separated list of hot standbys of the primary.
+# The recipe, tag and ingredient viewsets read from them; a client that
+# wrote is kept on the primary for REPLICA_PIN_SECONDS, marked in the
+# REPLICA_PIN_CACHE cache, which must be shared by every worker.
+
+DATABASE_REPLICAS = []
+
+for i, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    alias = 'replica_%d' % i
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.db.routers.PrimaryReplicaRouter']
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+REPLICA_PIN_CACHE = 'default'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -109,6 +146,37 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing
+# PASSWORD_HASHER_PROFILE picks the hasher for new passwords: 'scrypt',
+# 'argon2' (needs argon2-cffi) or Django's default 'pbkdf2'. The others
+# stay listed so existing hashes verify, and are rehashed with the chosen
+# one when their user next logs in. The parameters cost about 50 ms and
+# 16-19 MiB per hash; PBKDF2 takes twice as long for less resistance.
+
+PASSWORD_HASHER_PROFILE = os.environ.get('PASSWORD_HASHER_PROFILE', 'scrypt')
+
+PASSWORD_HASHER_PROFILES = {
+    'scrypt': 'core.hashers.ScryptPasswordHasher',
+    'argon2': 'core.hashers.TunedArgon2PasswordHasher',
+    'pbkdf2': 'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+}
+
+PASSWORD_HASHERS = [PASSWORD_HASHER_PROFILES[PASSWORD_HASHER_PROFILE]] + [
+    hasher for profile, hasher in PASSWORD_HASHER_PROFILES.items()
+    if profile != PASSWORD_HASHER_PROFILE
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+PASSWORD_SCRYPT = {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1}
+
+# memory_cost in KiB
+PASSWORD_ARGON2 = {'time_cost': 2, 'memory_cost': 19456, 'parallelism': 1}
+
+# Under ASGI, logins and sign-ups hash on a pool of this many threads per
+# process, leaving the database threads to other requests
+PASSWORD_HASHING_THREADS = int(os.environ.get(
+    'PASSWORD_HASHING_THREADS', os.cpu_count() or 1
+))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
@@ -139,4 +207,225 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
-}
\ No newline at end of file
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.UserWindowThrottle',
+        'core.throttling.IPWindowThrottle',
+    ],
+    # N requests per client in each period-long window
+    'DEFAULT_THROTTLE_RATES': {
+        'user': os.environ.get('THROTTLE_USER_RATE', '600/min'),
+        'ip': os.environ.get('THROTTLE_IP_RATE', '1200/min'),
+    },
+    # Proxies in front of the app: clients are identified by the address
+    # this many hops back in X-Forwarded-For, or by REMOTE_ADDR when 0,
+    # as any earlier entries are set by the client
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', 0)),
+}
+
+# Cache
+# Throttle buckets and replica pins are kept in the default cache. Set
+# MEMCACHED_LOCATION (host:port, comma separated for several) to share
+# them between workers and containers; otherwise each process has its
+# own, and read replicas can't be used.
+
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'].split(','),
+            'OPTIONS': {'no_delay': True, 'connect_timeout': 0.5, 'timeout': 0.5},
+        }
+    }
+
+# Recipe cards
+# Keep each recipe's list representation in Recipe.card and serve the
+# recipe list from it. After turning this on, or after editing recipes
+# outside the API, run `manage.py check_recipe_cards --repair`.
+
+RECIPE_CARD_SNAPSHOTS = os.environ.get('RECIPE_CARD_SNAPSHOTS', '0') == '1'
+
+# Outbox
+# Recipe, tag and ingredient changes are recorded as OutboxEvents and
+# POSTed as JSON by `manage.py deliver_outbox` to every URL here, signed
+# with an HMAC-SHA256 of the body when OUTBOX_WEBHOOK_SECRET is set.
+
+OUTBOX_WEBHOOK_URLS = [
+    url for url in os.environ.get('OUTBOX_WEBHOOK_URLS', '').split(',') if url
+]
+
+OUTBOX_WEBHOOK_SECRET = os.environ.get('OUTBOX_WEBHOOK_SECRET', '')
+
+OUTBOX_WEBHOOK_TIMEOUT = float(os.environ.get('OUTBOX_WEBHOOK_TIMEOUT', 5))
+
+OUTBOX_BATCH_SIZE = 100
+
+# Failed batches are retried after up to 2**(attempts - 1) seconds, capped
+OUTBOX_BACKOFF_BASE = 1.0
+
+OUTBOX_MAX_BACKOFF = 600.0
+
+OUTBOX_MAX_ATTEMPTS = 20
+
+# Delivered events are kept this long, for replaying to receivers
+OUTBOX_RETENTION_DAYS = 7
+
+# Background jobs
+# `manage.py run_worker` runs up to JOBS_CONCURRENCY jobs at once, leasing
+# each for JOBS_LEASE_SECONDS (renewed while it runs). Failed jobs are
+# retried after up to JOBS_BACKOFF_BASE * 2**(attempts - 1) seconds.
+
+JOBS_CONCURRENCY = int(os.environ.get('JOBS_CONCURRENCY', 4))
+
+JOBS_POLL_INTERVAL = 1.0
+
+JOBS_LEASE_SECONDS = 60
+
+JOBS_MAX_ATTEMPTS = 3
+
+JOBS_BACKOFF_BASE = 5.0
+
+JOBS_MAX_BACKOFF = 3600.0
+
+# Finished jobs are kept this long, for their status to be looked up
+JOBS_RETENTION_DAYS = 7
+
+# Seconds between runs of the jobs workers queue on their own
+JOBS_PERIODIC = {
+    'recipe.collect_orphans': 24 * 3600,
+}
+
+# Most recipes one POST to /api/recipe/recipes/import/ can queue
+RECIPE_IMPORT_MAX_RECIPES = 1000
+
+# Orphan collection
+# `manage.py collect_orphans` and the recipe.collect_orphans job delete
+# unused tags and ingredients, ORPHANS_BATCH_SIZE rows at a time with a
+# pause between deletes, skipping rows locked for longer than the lock
+# timeout and waiting while replicas lag more than ORPHANS_MAX_REPLICA_LAG
+# seconds.
+
+ORPHANS_BATCH_SIZE = 1000
+
+ORPHANS_PAUSE = 0.1
+
+ORPHANS_MAX_REPLICA_LAG = 5.0
+
+ORPHANS_LOCK_TIMEOUT_MS = 1000
+
+# Change event stream
+# Under ASGI, /api/events/ streams the user's outbox events as server-sent
+# events. Each process LISTENs on EVENTS_CHANNEL with one connection shared
+# by its streams; a stream more than EVENTS_QUEUE_SIZE events behind is
+# ended, and a reconnecting client is replayed at most EVENTS_REPLAY_LIMIT
+# missed events before being told to reload instead.
+
+EVENTS_CHANNEL = 'outbox_events'
+
+EVENTS_QUEUE_SIZE = 100
+
+EVENTS_REPLAY_LIMIT = 1000
+
+EVENTS_KEEPALIVE_SECONDS = float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15))
+
+# How long clients wait before reconnecting
+EVENTS_RETRY_MS = 3000
+
+# Batch requests
+# Most sub-requests one POST to /api/batch/ may hold.
+
+BATCH_MAX_REQUESTS = 20
+
+# Query timeouts
+# Views with StatementTimeoutMixin set these on their connections
+# (milliseconds, 0 for no limit); DB_VIEW_TIMEOUTS overrides them by view
+# class name. Timed out queries answer 504, lock waits 503.
+
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 5000))
+
+DB_LOCK_TIMEOUT_MS = int(os.environ.get('DB_LOCK_TIMEOUT_MS', 1000))
+
+DB_VIEW_TIMEOUTS = {
+    # Listing everything of a user with many recipes is the slowest read
+    'RecipeViewSet': {'statement_timeout': 3000},
+}
+
+# Metrics
+# Forked workers dump their metrics into this directory so /metrics can
+# aggregate them; leave unset for a single process. run_worker and
+# deliver_outbox serve their own /metrics on WORKER_METRICS_PORT, if set.
+
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0))
+
+WORKER_METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', 0))
+
+# Request phase timing
+# Phase durations are returned in a Server-Timing header; a sample of
+# requests is also logged to the core.timing logger as JSON.
+
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', '1') == '1'
+
+SERVER_TIMING_LOG_SAMPLE_RATE = float(
+    os.environ.get('SERVER_TIMING_LOG_SAMPLE_RATE', 0.0)
+)
+
+# Slow query log
+# Queries from these URL namespaces slower than the threshold are logged to
+# core.slow_queries; a sample of SELECTs gets EXPLAIN (ANALYZE, BUFFERS) run
+# on a background thread. Set SLOW_QUERY_THRESHOLD_MS to an empty string to
+# turn the log off.
+
+SLOW_QUERY_THRESHOLD_MS = (
+    float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+    if os.environ.get('SLOW_QUERY_THRESHOLD_MS', '200') else None
+)
+
+SLOW_QUERY_NAMESPACES = ['recipe', 'user']
+
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(
+    os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1)
+)
+
+# Seconds before the same statement is explained again
+SLOW_QUERY_EXPLAIN_INTERVAL = 300
+
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = 5000
+
+# ASGI
+# Under ASGI requests resolve against ASGI_URLCONF, which serves the
+# recipe reads from async views; their database work runs on a pool of
+# ASYNC_DB_THREADS threads per process.
+
+ASGI_URLCONF = 'app.asgi_urls'
+
+ASYNC_DB_THREADS = int(os.environ.get('ASYNC_DB_THREADS', 8))
+
+# Import time budget
+# `manage.py import_budget` fails when importing the app on startup takes
+# longer than this, or one of our modules alone takes longer than the
+# module budget.
+
+IMPORT_TIME_BUDGET_MS = 1000
+
+IMPORT_TIME_MODULE_BUDGET_MS = 20
+
+# Health checks
+# /readyz reuses its database and cache check results for this long, so
+# frequent probes from many load balancers cost one check per interval.
+
+READINESS_CACHE_SECONDS = float(os.environ.get('READINESS_CACHE_SECONDS', 2))
+
+# Admission control
+# Each process serves at most MAX_CONCURRENT_REQUESTS requests at once
+# (0 for no limit). Others wait up to ADMISSION_QUEUE_TIMEOUT seconds for a
+# slot, then get a 503 with Retry-After instead of queueing indefinitely.
+
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('MAX_CONCURRENT_REQUESTS', 64))
+
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.5))
+
+ADMISSION_RETRY_AFTER = 1
+
+# Probes and scrapes must get through to report the overload
+ADMISSION_EXEMPT_PATHS = ['/healthz', '/readyz', '/metrics']
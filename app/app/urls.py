@@ -14,14 +14,22 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from django.contrib import admin
 from django.urls import path, include
+from core.batch import BatchView
+from core.jobs import JobViewSet
+from core.views import healthz, lazy_view, metrics_view, readyz
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/schema/', SpectacularAPIView.as_view(), name='api-schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='api-schema'), name='api-docs'),
+    path('api/schema/', lazy_view('drf_spectacular.views.SpectacularAPIView'), name='api-schema'),
+    path('api/docs/', lazy_view('drf_spectacular.views.SpectacularSwaggerView', url_name='api-schema'), name='api-docs'),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
+    path('api/batch/', BatchView.as_view(), name='batch'),
+    path('api/jobs/', JobViewSet.as_view({'get': 'list'}), name='job-list'),
+    path('api/jobs/<int:pk>/', JobViewSet.as_view({'get': 'retrieve'}), name='job-detail'),
+    path('metrics', metrics_view, name='metrics'),
+    path('healthz', healthz, name='healthz'),
+    path('readyz', readyz, name='readyz'),
 ]
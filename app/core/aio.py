@@ -0,0 +1,122 @@
+"""
+Helpers for async views.
+
+Django 3.2 has no async ORM, and sync_to_async(thread_sensitive=True)
+funnels every call through one shared thread. run_sync() runs database
+work on a small dedicated pool of ASYNC_DB_THREADS threads instead, in a
+copy of the caller's context so request instrumentation and timing keep
+working, and closes the thread's connection after each call (returning it
+to the connection pool) the way request_finished does for sync views.
+run_hashing() does the same on a separate pool of PASSWORD_HASHING_THREADS
+threads, so CPU-bound password hashing queues behind itself rather than
+behind, or in front of, database reads.
+"""
+
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.conf import settings
+from django.db import close_old_connections
+from rest_framework.authentication import (
+    TokenAuthentication, get_authorization_header,
+)
+from rest_framework.exceptions import AuthenticationFailed
+
+from core import metrics
+
+WAIT_TIME = metrics.Histogram(
+    'async_db_wait_seconds',
+    'Time async views waited for a database thread',
+)
+HASHING_WAIT_TIME = metrics.Histogram(
+    'password_hashing_wait_seconds',
+    'Time async views waited for a password hashing thread',
+)
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def _pool(name, size):
+    try:
+        return _executors[name]
+    except KeyError:
+        with _lock:
+            if name not in _executors:
+                _executors[name] = ThreadPoolExecutor(
+                    max_workers=size, thread_name_prefix=name,
+                )
+            return _executors[name]
+
+
+def executor():
+    """Return the process' database thread pool"""
+    return _pool('async-db', settings.ASYNC_DB_THREADS)
+
+
+def hashing_executor():
+    """Return the process' password hashing thread pool"""
+    return _pool('hashing', settings.PASSWORD_HASHING_THREADS)
+
+
+def _reset():
+    _executors.clear()
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def _call(histogram, submitted, func, args, kwargs):
+    histogram.observe(perf_counter() - submitted)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def _run(pool, histogram, func, args, kwargs):
+    context = contextvars.copy_context()
+    call = functools.partial(
+        context.run, _call, histogram, perf_counter(), func, args, kwargs
+    )
+    return await asyncio.get_running_loop().run_in_executor(pool, call)
+
+
+async def run_sync(func, *args, **kwargs):
+    """Run func on the database thread pool and return its result"""
+    return await _run(executor(), WAIT_TIME, func, args, kwargs)
+
+
+async def run_hashing(func, *args, **kwargs):
+    """Run func, which hashes passwords, on the hashing thread pool"""
+    return await _run(
+        hashing_executor(), HASHING_WAIT_TIME, func, args, kwargs
+    )
+
+
+class AsyncTokenAuthentication(TokenAuthentication):
+    """Token authentication usable from async views"""
+
+    async def authenticate_async(self, request):
+        """Return (user, token) for a Django request, or None"""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed(
+                'Invalid token header. Credentials string should not '
+                'contain spaces.'
+            )
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed(
+                'Invalid token header. Token string should not contain '
+                'invalid characters.'
+            )
+        return await run_sync(self.authenticate_credentials, key)
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from core import checks  # noqa: F401
+        from core.db import instrumentation, timeouts
+
+        connection_created.connect(
+            instrumentation.install,
+            dispatch_uid='core.db.instrumentation.install',
+        )
+        connection_created.connect(
+            timeouts.install, dispatch_uid='core.db.timeouts.install',
+        )
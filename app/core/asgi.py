@@ -0,0 +1,33 @@
+"""
+ASGI handler serving requests with ASGI_URLCONF, and the event stream
+"""
+
+import django
+from django.conf import settings
+from django.core.handlers import asgi
+
+EVENTS_PATH = '/api/events/'
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """Resolve requests against ASGI_URLCONF, which adds async views"""
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+            # Imported once the app registry is ready. Django 3.2 can't
+            # stream a response asynchronously, so this is plain ASGI.
+            from core import events
+
+            return await events.stream(scope, receive, send)
+        return await super().__call__(scope, receive, send)
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = settings.ASGI_URLCONF
+        return request, error_response
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return ASGIHandler()
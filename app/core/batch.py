@@ -0,0 +1,157 @@
+"""
+Batch endpoint running several API requests in one round trip.
+
+POST /api/batch/ with {"requests": [{"method", "path", "body"}, ...]}
+answers {"responses": [{"status", "headers", "body"}, ...]} in the same
+order. Each sub-request is resolved against ROOT_URLCONF and dispatched
+to its view in this process, as the user the batch authenticated as.
+
+With "snapshot": true the sub-requests, which must then all be reads, run
+in one REPEATABLE READ READ ONLY transaction on the primary, so they see
+the database at the same instant.
+"""
+
+import json
+from io import BytesIO
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection, transaction
+from django.urls import Resolver404, resolve
+from rest_framework import serializers
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.db import routers
+
+BATCH_PATH = '/api/batch/'
+
+# Set per sub-request rather than copied from the batch request
+DROPPED_META = ('CONTENT_TYPE', 'CONTENT_LENGTH', 'QUERY_STRING')
+
+
+class SubRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(
+        ['GET', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET'
+    )
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False)
+
+    def validate_path(self, value):
+        path = urlsplit(value).path
+        if not path.startswith('/api/') or path.startswith(BATCH_PATH):
+            raise serializers.ValidationError(
+                'Only API paths other than the batch endpoint are allowed.'
+            )
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = SubRequestSerializer(many=True, allow_empty=False)
+    snapshot = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(
+                'At most %d requests per batch.'
+                % settings.BATCH_MAX_REQUESTS
+            )
+        return value
+
+    def validate(self, attrs):
+        if attrs['snapshot'] and any(
+            sub['method'] not in SAFE_METHODS for sub in attrs['requests']
+        ):
+            raise serializers.ValidationError(
+                'A snapshot batch can only hold GET requests.'
+            )
+        return attrs
+
+
+def sub_request(request, method, path, body=None):
+    """Return a Django request for path, authenticated as request's user"""
+    url = urlsplit(path)
+    content = b'' if body is None else json.dumps(body).encode()
+    environ = {
+        key: value for key, value in request.META.items()
+        if key not in DROPPED_META
+    }
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': url.path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(content)),
+        'wsgi.input': BytesIO(content),
+    })
+    sub = WSGIRequest(environ)
+    # DRF's Request uses these instead of authenticating again
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    return sub
+
+
+def dispatch(request, method, path, body=None):
+    """Run one sub-request, returning its status, headers and body"""
+    sub = sub_request(request, method, path, body)
+    try:
+        match = resolve(sub.path_info, urlconf=settings.ROOT_URLCONF)
+    except Resolver404:
+        return {
+            'status': 404, 'headers': {}, 'body': {'detail': 'Not found.'},
+        }
+    response = match.func(sub, *match.args, **match.kwargs)
+    if hasattr(response, 'render') and not response.is_rendered:
+        response.render()
+
+    content = response.content.decode(response.charset) or None
+    if content and response.get('Content-Type', '').startswith(
+        'application/json'
+    ):
+        content = json.loads(content)
+    return {
+        'status': response.status_code,
+        'headers': dict(response.items()),
+        'body': content,
+    }
+
+
+class BatchView(APIView):
+    """Run several API requests, authenticating once"""
+
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    serializer_class = BatchSerializer
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        subs = serializer.validated_data['requests']
+
+        if not serializer.validated_data['snapshot']:
+            return Response({'responses': [
+                dispatch(request, sub['method'], sub['path'], sub.get('body'))
+                for sub in subs
+            ]})
+
+        responses = []
+        with routers.primary_only(), transaction.atomic():
+            # Only the outermost transaction can pick its isolation level
+            if not connection.savepoint_ids:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, '
+                        'READ ONLY'
+                    )
+            for sub in subs:
+                # A failed sub-request rolls back to here, keeping the
+                # snapshot for the others
+                with transaction.atomic():
+                    responses.append(
+                        dispatch(request, sub['method'], sub['path'])
+                    )
+        return Response({'responses': responses})
@@ -0,0 +1,32 @@
+"""
+System checks of the core app's settings
+"""
+
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Cache backends whose entries only the process setting them can see
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+
+@register()
+def check_replica_pin_cache(app_configs, **kwargs):
+    """Refuse read replicas without a shared cache for primary pins: a
+    token client's read handled by another worker would miss its pin and
+    could miss its own write on a lagging replica"""
+    if not settings.DATABASE_REPLICAS:
+        return []
+    backend = settings.CACHES.get(
+        settings.REPLICA_PIN_CACHE, {}
+    ).get('BACKEND')
+    if backend is None or backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            'REPLICA_PIN_CACHE %r is not a cache shared between processes.'
+            % settings.REPLICA_PIN_CACHE,
+            hint='Set MEMCACHED_LOCATION, or unset DB_REPLICA_HOSTS.',
+            id='core.E001',
+        )]
+    return []
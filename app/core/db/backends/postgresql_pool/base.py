@@ -0,0 +1,51 @@
+"""
+PostgreSQL backend that checks connections out of a process-wide pool.
+
+Configure it with an optional POOL dict in the database settings:
+MIN_SIZE, MAX_SIZE, TIMEOUT (seconds to wait for a free connection),
+MAX_LIFETIME, MAX_IDLE and CHECK_INTERVAL (idle seconds after which a
+connection is pinged before reuse).
+"""
+
+from django.db.backends.base.base import NO_DB_ALIAS
+from django.db.backends.postgresql import base
+
+from core.db import pool
+from core.db.backends.postgresql_pool.creation import DatabaseCreation
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    _pool = None
+
+    def _get_pool(self, conn_params):
+        key = tuple(sorted((k, str(v)) for k, v in conn_params.items()))
+        return pool.get_pool(
+            self.alias,
+            key,
+            lambda: super(DatabaseWrapper, self).get_new_connection(
+                conn_params
+            ),
+            self.settings_dict.get('POOL') or {},
+        )
+
+    def get_new_connection(self, conn_params):
+        # Connections used to create and drop databases aren't pooled
+        if self.alias == NO_DB_ALIAS:
+            self._pool = None
+            return super().get_new_connection(conn_params)
+
+        self._pool = self._get_pool(conn_params)
+        connection = self._pool.getconn()
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = options.get(
+            'isolation_level', connection.isolation_level
+        )
+        return connection
+
+    def _close(self):
+        if self.connection is not None and self._pool is not None:
+            with self.wrap_database_errors:
+                return self._pool.putconn(self.connection)
+        return super()._close()
@@ -0,0 +1,11 @@
+from django.db.backends.postgresql import creation
+
+from core.db import pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Pooled connections to the test database would block DROP DATABASE
+        pool.close_all()
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,56 @@
+"""
+Helpers for running EXPLAIN and inspecting PostgreSQL plans
+"""
+
+import json
+
+# Node types that read a relation through an index
+INDEX_SCANS = {
+    'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan', 'Bitmap Index Scan',
+}
+
+
+def explain(cursor, sql, params=None, options='FORMAT JSON'):
+    """Return the JSON plan document for sql"""
+    cursor.execute('EXPLAIN (%s) %s' % (options, sql), params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan
+
+
+def nodes(plan):
+    """Yield every node of a plan document or plan node, depth first"""
+    if isinstance(plan, list):
+        plan = plan[0]
+    if 'Plan' in plan:
+        plan = plan['Plan']
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from nodes(child)
+
+
+def relation(node):
+    """Return the table a scan node reads, following index scans to it"""
+    return node.get('Relation Name')
+
+
+def full_scans(plan, relations=None):
+    """Return scan nodes that read every row of a relation.
+
+    That is sequential scans, and index scans without an index condition,
+    which walk the whole index (e.g. to produce an ordering) and filter.
+    """
+    found = []
+    for node in nodes(plan):
+        name = relation(node)
+        if name is None or (relations and name not in relations):
+            continue
+        node_type = node['Node Type']
+        if node_type == 'Seq Scan':
+            found.append(node)
+        elif node_type in INDEX_SCANS and not (
+            'Index Cond' in node or 'Recheck Cond' in node
+        ):
+            found.append(node)
+    return found
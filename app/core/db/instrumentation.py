@@ -0,0 +1,72 @@
+"""
+Per-request database instrumentation.
+
+observe_queries is installed as an execute wrapper on every connection
+when it is opened and attributes each query to the RequestStats of the
+request currently being served, whichever thread or database alias runs it.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from django.conf import settings
+
+from core.db import slow_queries
+
+_current = ContextVar('core_db_request_stats', default=None)
+
+
+class RequestStats:
+    """Database work done while serving one request"""
+
+    __slots__ = ('queries', 'db_time', 'view')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.view = None
+
+
+def current():
+    """Return the RequestStats being collected, if any"""
+    return _current.get()
+
+
+@contextmanager
+def track():
+    """Collect RequestStats for the queries run inside the block"""
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def observe_queries(execute, sql, params, many, context):
+    """Execute wrapper counting and timing queries"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = perf_counter() - start
+        stats.queries += 1
+        stats.db_time += duration
+
+        threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+        if threshold is not None and duration * 1000 >= threshold:
+            slow_queries.record(
+                context['connection'], sql, params, many, duration,
+                stats.view,
+            )
+
+
+def install(sender, connection, **kwargs):
+    """connection_created receiver adding the wrapper to new connections"""
+    if observe_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(observe_queries)
@@ -0,0 +1,302 @@
+"""
+Online migration of the recipe tables to PostgreSQL hash partitioning.
+
+core_recipe is partitioned by user_id, which every RecipeViewSet query
+filters on, and the core_recipe_tags/core_recipe_ingredients through tables
+by recipe_id, which every relation lookup filters on. The migration runs in
+steps so it can be spread over a maintenance window:
+
+prepare   create <table>_part with its partitions and indexes, and a
+          trigger mirroring every write on <table> into it
+backfill  copy existing rows over in small keyset-ordered batches
+swap      in one short transaction, rename <table> to
+          <table>_unpartitioned and <table>_part to <table>
+check     EXPLAIN the viewset queries and verify each reads one partition
+
+Partitioned tables need the partition key in every unique constraint, so
+the primary keys become (key, id), with a plain index on id for the
+updates and deletes Django issues by pk alone, and the through tables
+lose their foreign key to core_recipe; Django already cascades deletes
+itself. The old tables are kept, without foreign keys, until dropped by
+hand.
+"""
+
+import time
+
+from django.db import connection, transaction
+
+from core.db import explain
+
+
+class PartitionedTable:
+    """How one table is partitioned"""
+
+    def __init__(self, table, key, indexes, unique=()):
+        self.table = table
+        self.key = key
+        # {canonical name: columns} of indexes to recreate on the new table
+        self.indexes = indexes
+        self.unique = unique
+
+    @property
+    def shadow(self):
+        return self.table + '_part'
+
+    @property
+    def old(self):
+        return self.table + '_unpartitioned'
+
+    @property
+    def function(self):
+        return self.shadow + '_sync'
+
+    def partition(self, remainder):
+        return '%s_p%d' % (self.table, remainder)
+
+
+TABLES = [
+    PartitionedTable(
+        'core_recipe', 'user_id',
+        indexes={
+            'core_recipe_user_id_idx': 'user_id, id DESC',
+            'core_recipe_id_idx': 'id',
+        },
+    ),
+    PartitionedTable(
+        'core_recipe_tags', 'recipe_id',
+        indexes={
+            'core_recipe_tags_tag_recipe_idx': 'tag_id, recipe_id',
+            'core_recipe_tags_id_idx': 'id',
+        },
+        unique=['recipe_id, tag_id'],
+    ),
+    PartitionedTable(
+        'core_recipe_ingredients', 'recipe_id',
+        indexes={
+            'core_recipe_ingredients_ingredient_recipe_idx':
+                'ingredient_id, recipe_id',
+            'core_recipe_ingredients_id_idx': 'id',
+        },
+        unique=['recipe_id, ingredient_id'],
+    ),
+]
+
+
+def _columns(cursor, table):
+    return [
+        column.name
+        for column in connection.introspection.get_table_description(
+            cursor, table
+        )
+    ]
+
+
+def _foreign_keys(cursor, table):
+    """Return {constraint name: (column, (table, column) referenced)}"""
+    return {
+        name: (info['columns'][0], info['foreign_key'])
+        for name, info in connection.introspection.get_constraints(
+            cursor, table
+        ).items()
+        if info['foreign_key']
+    }
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass',
+        [table],
+    )
+    return cursor.fetchone() is not None
+
+
+def partitions(cursor, table):
+    cursor.execute(
+        'SELECT inhrelid::regclass::text FROM pg_inherits '
+        'WHERE inhparent = %s::regclass',
+        [table],
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def prepare(spec, count, log=print):
+    """Create the partitioned shadow table and the sync trigger"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        t = spec
+        log('Creating %s with %d partitions' % (t.shadow, count))
+        cursor.execute(
+            'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS INCLUDING '
+            'CONSTRAINTS) PARTITION BY HASH (%s)' % (t.shadow, t.table, t.key)
+        )
+        for remainder in range(count):
+            cursor.execute(
+                'CREATE TABLE %s PARTITION OF %s FOR VALUES WITH '
+                '(MODULUS %d, REMAINDER %d)'
+                % (t.partition(remainder), t.shadow, count, remainder)
+            )
+        cursor.execute(
+            'ALTER TABLE %s ADD PRIMARY KEY (%s, id)' % (t.shadow, t.key)
+        )
+        for columns in t.unique:
+            cursor.execute(
+                'ALTER TABLE %s ADD UNIQUE (%s)' % (t.shadow, columns)
+            )
+        # Temporary names; the canonical ones are taken over on swap
+        for name, columns in t.indexes.items():
+            cursor.execute(
+                'CREATE INDEX %s_p ON %s (%s)' % (name, t.shadow, columns)
+            )
+        for column, (ref_table, ref_column) in sorted(
+            _foreign_keys(cursor, t.table).values()
+        ):
+            if ref_table in (s.table for s in TABLES):
+                continue
+            cursor.execute(
+                'ALTER TABLE %s ADD FOREIGN KEY (%s) REFERENCES %s (%s) '
+                'DEFERRABLE INITIALLY DEFERRED'
+                % (t.shadow, column, ref_table, ref_column)
+            )
+
+        columns = _columns(cursor, t.table)
+        updates = ', '.join(
+            '%s = EXCLUDED.%s' % (c, c) for c in columns
+            if c not in ('id', t.key)
+        )
+        cursor.execute('''
+            CREATE FUNCTION %(function)s() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    DELETE FROM %(shadow)s
+                    WHERE %(key)s = OLD.%(key)s AND id = OLD.id;
+                END IF;
+                IF TG_OP = 'DELETE' THEN
+                    RETURN OLD;
+                END IF;
+                INSERT INTO %(shadow)s SELECT (NEW).*
+                ON CONFLICT (%(key)s, id) DO UPDATE SET %(updates)s;
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        ''' % {
+            'function': t.function, 'shadow': t.shadow, 'key': t.key,
+            'updates': updates,
+        })
+        cursor.execute(
+            'CREATE TRIGGER %s AFTER INSERT OR UPDATE OR DELETE ON %s '
+            'FOR EACH ROW EXECUTE FUNCTION %s()'
+            % (t.function, t.table, t.function)
+        )
+
+
+def backfill(spec, batch_size=1000, sleep=0.0, log=print):
+    """Copy rows not yet mirrored, one short transaction per batch.
+
+    Rows are locked FOR SHARE while copied, so concurrent updates and
+    deletes wait for the batch and are then mirrored by the trigger.
+    """
+    last_id = 0
+    copied = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('''
+                WITH batch AS (
+                    SELECT * FROM %s WHERE id > %%s ORDER BY id LIMIT %%s
+                    FOR SHARE
+                ), copied AS (
+                    INSERT INTO %s SELECT * FROM batch
+                    ON CONFLICT DO NOTHING
+                )
+                SELECT count(*), max(id) FROM batch
+            ''' % (spec.table, spec.shadow), [last_id, batch_size])
+            rows, max_id = cursor.fetchone()
+        if not rows:
+            break
+        copied += rows
+        last_id = max_id
+        log('%s: copied %d rows (up to id %d)' % (spec.table, copied, last_id))
+        if sleep:
+            time.sleep(sleep)
+    return copied
+
+
+def _count(cursor, table):
+    cursor.execute('SELECT count(*) FROM %s' % table)
+    return cursor.fetchone()[0]
+
+
+def verify(spec):
+    """Return (rows in table, rows in shadow)"""
+    with connection.cursor() as cursor:
+        return _count(cursor, spec.table), _count(cursor, spec.shadow)
+
+
+def swap(specs, lock_timeout='5s', log=print):
+    """Put the partitioned tables in place in one transaction"""
+    with transaction.atomic(), connection.cursor() as cursor:
+        # Deferred foreign key checks pending in this transaction would
+        # block the ALTER TABLEs below
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute("SET LOCAL lock_timeout = %s", [lock_timeout])
+        for t in specs:
+            cursor.execute('LOCK TABLE %s IN ACCESS EXCLUSIVE MODE' % t.table)
+
+        for t in specs:
+            source, shadow = _count(cursor, t.table), _count(cursor, t.shadow)
+            if source != shadow:
+                raise RuntimeError(
+                    '%s has %d rows but %s has %d; run backfill first'
+                    % (t.table, source, t.shadow, shadow)
+                )
+
+        for t in specs:
+            log('Swapping %s' % t.table)
+            cursor.execute('DROP TRIGGER %s ON %s' % (t.function, t.table))
+            cursor.execute('DROP FUNCTION %s()' % t.function)
+            for name in _foreign_keys(cursor, t.table):
+                cursor.execute(
+                    'ALTER TABLE %s DROP CONSTRAINT %s' % (t.table, name)
+                )
+            cursor.execute('ALTER TABLE %s RENAME TO %s' % (t.table, t.old))
+            cursor.execute('ALTER TABLE %s RENAME TO %s' % (t.shadow, t.table))
+            for name in t.indexes:
+                cursor.execute(
+                    'ALTER INDEX IF EXISTS %s RENAME TO %s_old' % (name, name)
+                )
+                cursor.execute(
+                    'ALTER INDEX %s_p RENAME TO %s' % (name, name)
+                )
+            # The id sequence must not be dropped with the old table
+            cursor.execute(
+                "SELECT pg_get_serial_sequence(%s, 'id')", [t.old]
+            )
+            sequence = cursor.fetchone()[0]
+            if sequence:
+                cursor.execute(
+                    'ALTER SEQUENCE %s OWNED BY %s.id' % (sequence, t.table)
+                )
+
+
+def pruning_queries(user_id, recipe_id):
+    """Yield (table, queryset) pairs shaped like the viewset queries"""
+    from core.models import Recipe, Tag, Ingredient
+
+    yield 'core_recipe', Recipe.objects.filter(user_id=user_id).order_by('-id')
+    yield 'core_recipe', Recipe.objects.filter(user_id=user_id, pk=recipe_id)
+    yield 'core_recipe_tags', Tag.objects.filter(recipe__id=recipe_id)
+    yield 'core_recipe_ingredients', \
+        Ingredient.objects.filter(recipe__id=recipe_id)
+
+
+def check_pruning(user_id=1, recipe_id=1):
+    """Return [(table, sql, partitions read)] for the viewset queries"""
+    results = []
+    with connection.cursor() as cursor:
+        for table, queryset in pruning_queries(user_id, recipe_id):
+            parts = partitions(cursor, table)
+            sql, params = queryset.query.sql_with_params()
+            plan = explain.explain(cursor, sql, params)
+            read = sorted({
+                explain.relation(node) for node in explain.nodes(plan)
+            } & parts)
+            results.append((table, sql, read))
+    return results
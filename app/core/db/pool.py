@@ -0,0 +1,268 @@
+"""
+Thread-safe pool of raw DB-API connections.
+
+Used by the postgresql_pool backend: Django's per-thread connection
+wrappers check a connection out when they connect and hand it back when
+they close, so closing at the end of every request costs nothing and
+threaded WSGI workers and ASGI sync threads share one set of sockets.
+"""
+
+import collections
+import os
+import threading
+from time import monotonic
+
+import psycopg2
+from psycopg2 import extensions
+
+from core import metrics
+
+POOL_WAIT = metrics.Histogram(
+    'db_pool_wait_seconds',
+    'Time spent waiting to check out a pooled connection',
+    ['alias'],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30),
+)
+POOL_CONNECTIONS = metrics.Gauge(
+    'db_pool_connections',
+    'Pooled connections by state',
+    ['alias', 'state'],
+)
+POOL_TIMEOUTS = metrics.Counter(
+    'db_pool_timeouts_total',
+    'Checkouts that gave up waiting for a connection',
+    ['alias'],
+)
+POOL_DISCARDED = metrics.Counter(
+    'db_pool_discarded_total',
+    'Connections closed by the pool',
+    ['alias', 'reason'],
+)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection became available within the pool timeout"""
+
+
+class ConnectionPool:
+    """Bounded pool with health checks and a maximum connection lifetime"""
+
+    def __init__(self, connect, alias='default', min_size=0, max_size=10,
+                 timeout=10.0, max_lifetime=1800.0, max_idle=600.0,
+                 check_interval=30.0):
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self._connect = connect
+        # Idle connections as (connection, returned at); the most recently
+        # returned is reused first so surplus connections age out
+        self._idle = collections.deque()
+        self._created = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self._wait = POOL_WAIT.labels(alias)
+        self._timeouts = POOL_TIMEOUTS.labels(alias)
+        POOL_CONNECTIONS.labels(alias, 'idle').set_function(
+            lambda: len(self._idle)
+        )
+        POOL_CONNECTIONS.labels(alias, 'in_use').set_function(
+            lambda: self._size - len(self._idle)
+        )
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _open(self):
+        connection = self._connect()
+        self._created[connection] = monotonic()
+        return connection
+
+    def _discard(self, connection, reason):
+        POOL_DISCARDED.labels(self.alias, reason).inc()
+        self._created.pop(connection, None)
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _expired(self, connection, now):
+        created = self._created.get(connection, now)
+        return self.max_lifetime and now - created >= self.max_lifetime
+
+    @staticmethod
+    def _healthy(connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def prefill(self):
+        """Open connections until min_size are pooled"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                connection = self._open()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((connection, monotonic()))
+                self._cond.notify()
+
+    def getconn(self):
+        """Check out a connection, waiting up to timeout for one"""
+        start = monotonic()
+        deadline = start + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise psycopg2.OperationalError('Pool is closed')
+                    if self._idle:
+                        connection, returned = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        connection = None
+                        break
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self._timeouts.inc()
+                        raise PoolTimeout(
+                            'No connection available in pool %r after %.1fs'
+                            % (self.alias, self.timeout)
+                        )
+                    self._cond.wait(remaining)
+
+            if connection is None:
+                try:
+                    connection = self._open()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                break
+
+            now = monotonic()
+            if self._expired(connection, now):
+                self._discard(connection, 'lifetime')
+                continue
+            if self.max_idle and now - returned >= self.max_idle:
+                self._discard(connection, 'idle')
+                continue
+            if now - returned >= self.check_interval and \
+                    not self._healthy(connection):
+                self._discard(connection, 'unhealthy')
+                continue
+            break
+
+        self._wait.observe(monotonic() - start)
+        return connection
+
+    def putconn(self, connection):
+        """Return a connection, rolling back anything left open"""
+        if connection.closed:
+            self._discard(connection, 'closed')
+            return
+        if self._closed or self._expired(connection, monotonic()):
+            self._discard(connection, 'lifetime')
+            return
+        status = connection.info.transaction_status
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                self._discard(connection, 'broken')
+                return
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                self._discard(connection, 'broken')
+                return
+        with self._cond:
+            self._idle.append((connection, monotonic()))
+            self._cond.notify()
+
+    def close(self):
+        """Close idle connections; checked out ones close when returned"""
+        with self._cond:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+        for connection in idle:
+            self._discard(connection, 'closed')
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Connections inherited over fork share their socket with the parent and
+# must never be closed, not even by garbage collection, in the child
+_inherited = []
+
+
+def get_pool(alias, key, connect, options):
+    """Return the pool for alias and connection parameters in this process"""
+    try:
+        return _pools[alias, key]
+    except KeyError:
+        pass
+    with _pools_lock:
+        pool = _pools.get((alias, key))
+        if pool is None:
+            pool = ConnectionPool(
+                connect,
+                alias=alias,
+                min_size=options.get('MIN_SIZE', 0),
+                max_size=options.get('MAX_SIZE', 10),
+                timeout=options.get('TIMEOUT', 10.0),
+                max_lifetime=options.get('MAX_LIFETIME', 1800.0),
+                max_idle=options.get('MAX_IDLE', 600.0),
+                check_interval=options.get('CHECK_INTERVAL', 30.0),
+            )
+            _pools[alias, key] = pool
+    return pool
+
+
+def all_pools():
+    return list(_pools.values())
+
+
+def close_all():
+    """Close every pool of this process"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def _after_fork_in_child():
+    _inherited.extend(_pools.values())
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,132 @@
+"""
+Database routing between the primary and read replicas.
+
+Reads only go to a replica inside replica_reads(), which ReplicaReadsMixin
+opens around safe requests to views that opt in. After a user writes,
+their reads stay on the primary for REPLICA_PIN_SECONDS, tracked both in
+a cookie and in a marker in the REPLICA_PIN_CACHE cache (for token
+clients that drop cookies), so they never read their own writes from a
+lagging replica. The marker must be seen by every worker, so replicas
+need a shared cache; core.checks refuses a process-local one.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.permissions import SAFE_METHODS
+
+_use_replica = ContextVar('core_db_use_replica', default=False)
+_primary_only = ContextVar('core_db_primary_only', default=False)
+
+PIN_COOKIE = 'primary_pin'
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Let reads inside the block go to a replica (or force the primary)"""
+    token = _use_replica.set(enabled)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def primary():
+    """Send every read inside the block to the primary"""
+    return replica_reads(False)
+
+
+@contextmanager
+def primary_only():
+    """Send every read inside the block to the primary, even from views
+    that opt in to replica reads"""
+    token = _primary_only.set(True)
+    try:
+        yield
+    finally:
+        _primary_only.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Route reads to DATABASE_REPLICAS when allowed, everything else to
+    default"""
+
+    def choose_replica(self):
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and not _primary_only.get() and \
+                settings.DATABASE_REPLICAS:
+            return self.choose_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def _pin_key(user):
+    return 'primary-pin:%s' % user.pk
+
+
+def is_pinned(request):
+    """Return whether the client wrote recently enough to need the
+    primary"""
+    try:
+        if float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return caches[settings.REPLICA_PIN_CACHE].get(
+            _pin_key(user)
+        ) is not None
+    return False
+
+
+def pin(request, response):
+    """Keep the client on the primary for REPLICA_PIN_SECONDS"""
+    seconds = settings.REPLICA_PIN_SECONDS
+    response.set_cookie(
+        PIN_COOKIE, str(time.time() + seconds), max_age=seconds,
+        httponly=True, samesite='Lax',
+    )
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        caches[settings.REPLICA_PIN_CACHE].set(_pin_key(user), 1, seconds)
+
+
+class ReplicaReadsMixin:
+    """Serve safe requests to a DRF view from a replica unless pinned"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        # Authentication has run, so the user's pin marker can be checked
+        if request.method in SAFE_METHODS and not is_pinned(request):
+            self._replica_token = _use_replica.set(True)
+
+    def dispatch(self, request, *args, **kwargs):
+        self._replica_token = None
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        finally:
+            if self._replica_token is not None:
+                _use_replica.reset(self._replica_token)
+                self._replica_token = None
+        # A refused write (4xx) or failed one (5xx) changed nothing to read
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            pin(self.request, response)
+        return response
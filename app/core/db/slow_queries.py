@@ -0,0 +1,182 @@
+"""
+Slow query log with out-of-band EXPLAIN capture.
+
+observe_queries hands every query slower than SLOW_QUERY_THRESHOLD_MS that
+was issued by a view in SLOW_QUERY_NAMESPACES to record(). The request
+only pays for a queue put: a background thread fingerprints the SQL, runs
+EXPLAIN (ANALYZE, BUFFERS) for a sample of SELECTs on its own connection
+inside a rolled back transaction, and logs the result as JSON to the
+core.slow_queries logger.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from core import metrics
+from core.db.explain import explain
+
+logger = logging.getLogger('core.slow_queries')
+
+SLOW_QUERIES = metrics.Counter(
+    'db_slow_queries_total',
+    'Queries slower than SLOW_QUERY_THRESHOLD_MS',
+    ['view'],
+)
+EXPLAINS_DROPPED = metrics.Counter(
+    'db_slow_query_explains_dropped_total',
+    'Slow queries not logged because the queue was full',
+)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s')
+_IN_LIST = re.compile(r'\bIN \((?:\s*\?\s*,)*\s*\?\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+_LOCKING = re.compile(r'\bFOR (?:NO KEY )?(?:UPDATE|SHARE)\b', re.IGNORECASE)
+
+
+def normalize(sql):
+    """Replace literals and parameters so equivalent queries compare equal"""
+    sql = _STRING.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    """Return (normalized SQL, short hash identifying it)"""
+    normalized = normalize(sql)
+    digest = hashlib.sha1(normalized.encode()).hexdigest()[:16]
+    return normalized, digest
+
+
+def explainable(sql):
+    """Only plain SELECTs are safe to run a second time under ANALYZE"""
+    return (
+        sql.lstrip()[:6].upper() == 'SELECT'
+        and _LOCKING.search(sql) is None
+    )
+
+
+class SlowQueryLog:
+    """Bounded queue drained by a daemon thread"""
+
+    def __init__(self):
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._explained = {}
+
+    def _ensure_worker(self):
+        # The thread does not survive a fork, so start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(
+                maxsize=getattr(settings, 'SLOW_QUERY_QUEUE_SIZE', 100)
+            )
+            self._explained = {}
+            threading.Thread(
+                target=self._run, name='slow-query-log', daemon=True,
+            ).start()
+            self._pid = os.getpid()
+
+    def submit(self, alias, sql, params, duration, view):
+        """Queue a slow query; never blocks the caller"""
+        self._ensure_worker()
+        SLOW_QUERIES.labels(view).inc()
+        try:
+            self._queue.put_nowait((alias, sql, params, duration, view))
+        except queue.Full:
+            EXPLAINS_DROPPED.inc()
+
+    def join(self):
+        """Wait until every queued query has been processed"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self.process(*item)
+            except Exception:
+                logger.exception('Failed to record slow query')
+            finally:
+                self._queue.task_done()
+
+    def _should_explain(self, digest, sql):
+        if not explainable(sql):
+            return False
+        rate = getattr(settings, 'SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.1)
+        if random.random() >= rate:
+            return False
+        # Don't keep explaining the same statement
+        interval = getattr(settings, 'SLOW_QUERY_EXPLAIN_INTERVAL', 300)
+        now = time.monotonic()
+        last = self._explained.get(digest)
+        if last is not None and now - last < interval:
+            return False
+        self._explained[digest] = now
+        return True
+
+    def process(self, alias, sql, params, duration, view):
+        """Fingerprint, optionally explain and log one slow query"""
+        normalized, digest = fingerprint(sql)
+        plan = None
+        if self._should_explain(digest, sql):
+            plan = self.explain_analyze(alias, sql, params)
+
+        logger.warning(json.dumps({
+            'fingerprint': digest,
+            'view': view,
+            'database': alias,
+            'duration_ms': round(duration * 1000, 3),
+            'sql': normalized,
+            'plan': plan,
+        }))
+
+    @staticmethod
+    def explain_analyze(alias, sql, params):
+        """Run EXPLAIN ANALYZE on a connection owned by this thread"""
+        connection = connections[alias]
+        timeout = getattr(settings, 'SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 5000)
+        try:
+            with transaction.atomic(using=alias):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SET LOCAL statement_timeout = %s', [int(timeout)]
+                    )
+                    plan = explain(
+                        cursor, sql, params, 'ANALYZE, BUFFERS, FORMAT JSON'
+                    )
+                transaction.set_rollback(True, using=alias)
+        finally:
+            connection.close()
+        return plan
+
+
+log = SlowQueryLog()
+
+
+def record(connection, sql, params, many, duration, view):
+    """Hand a query over to the slow query log if it qualifies"""
+    namespaces = getattr(settings, 'SLOW_QUERY_NAMESPACES', ())
+    if view is None or view.split(':', 1)[0] not in namespaces:
+        return
+    log.submit(
+        connection.alias, sql, None if many else params, duration, view
+    )
@@ -0,0 +1,149 @@
+"""
+Per-view statement and lock timeouts.
+
+Inside limits(), the first query on each connection is preceded by SET
+statement_timeout and lock_timeout, and those connections are set back to
+the server defaults when the block exits, so one slow request can't hold
+a backend for longer than its view allows. A cancelled query surfaces as
+QueryTimeout (504) and a lock wait that ran out as LockTimeout (503).
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DatabaseError
+from psycopg2 import errors
+from rest_framework.exceptions import APIException
+
+from core import metrics
+
+_current = ContextVar('core_db_timeouts', default=None)
+
+TIMEOUTS = metrics.Counter(
+    'db_timeouts_total',
+    'Requests failed by a statement or lock timeout',
+    ['view', 'kind'],
+)
+
+
+class QueryTimeout(APIException):
+    status_code = 504
+    default_detail = 'The request took too long to complete.'
+    default_code = 'query_timeout'
+
+
+class LockTimeout(APIException):
+    status_code = 503
+    default_detail = 'The data is busy, retry shortly.'
+    default_code = 'lock_timeout'
+    # Seconds for Retry-After
+    wait = 1
+
+
+class Limits:
+    """Timeouts in milliseconds for the queries of one block (0 for none)"""
+
+    def __init__(self, statement_timeout, lock_timeout):
+        self.statement_timeout = statement_timeout
+        self.lock_timeout = lock_timeout
+        self.connections = []
+
+    def apply(self, connection, cursor):
+        if connection in self.connections:
+            return
+        cursor.execute(
+            'SET statement_timeout = %d; SET lock_timeout = %d'
+            % (self.statement_timeout, self.lock_timeout)
+        )
+        self.connections.append(connection)
+
+    def reset(self):
+        for connection in self.connections:
+            if connection.connection is None:
+                continue
+            try:
+                with connection.connection.cursor() as cursor:
+                    cursor.execute(
+                        'SET statement_timeout TO DEFAULT; '
+                        'SET lock_timeout TO DEFAULT'
+                    )
+            except connection.Database.Error:
+                # Don't hand on a connection with unknown timeouts
+                if not connection.in_atomic_block:
+                    connection.close()
+        self.connections = []
+
+
+@contextmanager
+def limits(statement_timeout=None, lock_timeout=None):
+    """Apply the timeouts to the queries run inside the block, defaulting
+    to DB_STATEMENT_TIMEOUT_MS and DB_LOCK_TIMEOUT_MS"""
+    scope = Limits(
+        settings.DB_STATEMENT_TIMEOUT_MS
+        if statement_timeout is None else statement_timeout,
+        settings.DB_LOCK_TIMEOUT_MS if lock_timeout is None else lock_timeout,
+    )
+    token = _current.set(scope)
+    try:
+        yield scope
+    finally:
+        _current.reset(token)
+        scope.reset()
+
+
+def translate(exc, view):
+    """Return the API error for a timeout, or exc for anything else"""
+    cause = exc.__cause__ if isinstance(exc, DatabaseError) else None
+    if isinstance(cause, errors.QueryCanceled):
+        TIMEOUTS.labels(view, 'statement').inc()
+        return QueryTimeout()
+    if isinstance(cause, errors.LockNotAvailable):
+        TIMEOUTS.labels(view, 'lock').inc()
+        return LockTimeout()
+    return exc
+
+
+def apply_limits(execute, sql, params, many, context):
+    """Execute wrapper setting the current timeouts on the connection"""
+    scope = _current.get()
+    if scope is not None:
+        # The raw cursor, so other wrappers don't see the SET
+        scope.apply(context['connection'], context['cursor'].cursor)
+    return execute(sql, params, many, context)
+
+
+def install(sender, connection, **kwargs):
+    """connection_created receiver adding the wrapper to new connections"""
+    if apply_limits not in connection.execute_wrappers:
+        connection.execute_wrappers.append(apply_limits)
+
+
+class StatementTimeoutMixin:
+    """Bound the database time of a DRF view.
+
+    statement_timeout and lock_timeout (milliseconds) default to the
+    settings, and DB_VIEW_TIMEOUTS overrides them by view class name.
+    """
+
+    statement_timeout = None
+    lock_timeout = None
+
+    def get_timeouts(self):
+        overrides = settings.DB_VIEW_TIMEOUTS.get(type(self).__name__, {})
+        return (
+            overrides.get('statement_timeout', self.statement_timeout),
+            overrides.get('lock_timeout', self.lock_timeout),
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        with limits(*self.get_timeouts()):
+            return super().dispatch(request, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        exc = translate(exc, type(self).__name__)
+        response = super().handle_exception(exc)
+        if getattr(exc, 'wait', None) is not None and \
+                'Retry-After' not in response:
+            response['Retry-After'] = str(exc.wait)
+        return response
@@ -0,0 +1,290 @@
+"""
+Server-sent event stream of the user's recipe, tag and ingredient changes.
+
+GET /api/events/ under ASGI holds the response open and writes an event
+for each outbox event of the authenticated user as it commits:
+
+    id: <outbox event id>
+    event: recipe.updated
+    data: {"id": <recipe id>}
+
+Each process has one Listener, a PostgreSQL connection LISTENing on
+EVENTS_CHANNEL whose socket the event loop watches, and fans the
+notifications out to the queues of that user's streams; an idle stream
+costs a queue and no queries. A client reconnecting with Last-Event-ID is
+first sent the events after that id from the outbox. outbox.publish()
+makes a user's ids follow commit order, so a stream skips the live events
+up to the last id it replayed. Streams that fall behind by
+EVENTS_QUEUE_SIZE events, or lose the listener connection, are ended so
+their clients reconnect and catch up that way.
+
+The stream is served before Django's handler, so the admission control
+middleware doesn't count long-lived streams against
+MAX_CONCURRENT_REQUESTS.
+"""
+
+import asyncio
+import io
+import json
+import logging
+import os
+from collections import defaultdict
+
+import psycopg2
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connections
+from psycopg2 import sql
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+
+from core import aio, metrics, outbox
+from core.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+authentication = aio.AsyncTokenAuthentication()
+renderer = JSONRenderer()
+
+STREAMS = metrics.Gauge('event_streams_open', 'Open event streams')
+SENT = metrics.Counter('event_stream_events_total', 'Events streamed')
+DROPPED = metrics.Counter(
+    'event_streams_dropped_total',
+    'Streams ended for falling behind or losing the listener',
+)
+
+
+class Listener:
+    """One LISTEN connection fanning notifications out to queues"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queues = defaultdict(set)
+        self.connection = None
+        self.lock = asyncio.Lock()
+
+    async def subscribe(self, user_id):
+        """Return a queue receiving the user's notifications, connecting
+        first if need be"""
+        async with self.lock:
+            if self.connection is None:
+                self.connection = await self.loop.run_in_executor(
+                    None, self.connect
+                )
+                self.loop.add_reader(self.connection.fileno(), self.read)
+        queue = asyncio.Queue(settings.EVENTS_QUEUE_SIZE)
+        self.queues[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self.queues.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.queues[user_id]
+
+    def connect(self):
+        connection = psycopg2.connect(
+            **connections['default'].get_connection_params()
+        )
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL('LISTEN {}').format(
+                sql.Identifier(settings.EVENTS_CHANNEL)
+            ))
+        return connection
+
+    def read(self):
+        """Dispatch the notifications waiting on the connection"""
+        try:
+            self.connection.poll()
+        except psycopg2.Error as e:
+            logger.warning('Lost the event listener connection: %s', e)
+            self.close()
+            return
+        for notify in self.connection.notifies:
+            event = json.loads(notify.payload)
+            for queue in list(self.queues.get(event['user'], ())):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    self.unsubscribe(event['user'], queue)
+                    end(queue)
+        self.connection.notifies.clear()
+
+    def close(self):
+        """Close the connection, ending every stream"""
+        if self.connection is None:
+            return
+        if not self.loop.is_closed():
+            self.loop.remove_reader(self.connection.fileno())
+        self.connection.close()
+        self.connection = None
+        for queues in self.queues.values():
+            for queue in queues:
+                end(queue)
+        self.queues.clear()
+
+
+def end(queue):
+    """Make the stream reading queue finish, discarding what it holds"""
+    DROPPED.inc()
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(None)
+
+
+_listener = None
+
+
+def listener():
+    """Return the process' listener for the running event loop"""
+    global _listener
+    loop = asyncio.get_running_loop()
+    if _listener is None or _listener.loop is not loop:
+        if _listener is not None:
+            _listener.close()
+        _listener = Listener(loop)
+    return _listener
+
+
+def _reset():
+    global _listener
+    # The parent's connection and loop aren't usable in the child
+    _listener = None
+
+
+os.register_at_fork(after_in_child=_reset)
+
+
+def missed(user_id, last_event_id):
+    """Return summaries of the user's events after last_event_id, or None
+    when there are more than EVENTS_REPLAY_LIMIT"""
+    events = list(OutboxEvent.objects.filter(
+        user_id=user_id, pk__gt=last_event_id,
+    ).order_by('pk')[:settings.EVENTS_REPLAY_LIMIT + 1])
+    if len(events) > settings.EVENTS_REPLAY_LIMIT:
+        return None
+    return [outbox.summary(event) for event in events]
+
+
+def message(event):
+    return ('id: %d\nevent: %s\ndata: %s\n\n' % (
+        event['event'], event['topic'], json.dumps({'id': event['id']}),
+    )).encode()
+
+
+async def error(send, exc):
+    headers = [(b'content-type', renderer.media_type.encode())]
+    if isinstance(exc, exceptions.NotAuthenticated):
+        headers.append((
+            b'www-authenticate',
+            authentication.authenticate_header(None).encode(),
+        ))
+    await send({
+        'type': 'http.response.start',
+        'status': exc.status_code,
+        'headers': headers,
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': renderer.render({'detail': exc.detail}),
+    })
+
+
+async def disconnected(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def stream(scope, receive, send):
+    """ASGI application streaming the user's events"""
+    request = ASGIRequest(scope, io.BytesIO())
+    try:
+        if request.method != 'GET':
+            raise exceptions.MethodNotAllowed(request.method)
+        credentials = await authentication.authenticate_async(request)
+        if credentials is None:
+            raise exceptions.NotAuthenticated()
+    except exceptions.APIException as exc:
+        return await error(send, exc)
+    user = credentials[0]
+    try:
+        last = int(request.META['HTTP_LAST_EVENT_ID'])
+    except (KeyError, ValueError):
+        last = None
+
+    events = listener()
+    # Subscribed before replaying, so nothing falls in between
+    queue = await events.subscribe(user.pk)
+    gone = asyncio.ensure_future(disconnected(receive))
+    STREAMS.inc()
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Stops nginx buffering the stream
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'retry: %d\n\n' % settings.EVENTS_RETRY_MS,
+            'more_body': True,
+        })
+        if last is not None:
+            backlog = await aio.run_sync(missed, user.pk, last)
+            if backlog is None:
+                # Too far behind: the client reloads instead
+                backlog = []
+                await send({
+                    'type': 'http.response.body',
+                    'body': b'event: reset\ndata: {}\n\n',
+                    'more_body': True,
+                })
+            for event in backlog:
+                await send({
+                    'type': 'http.response.body',
+                    'body': message(event),
+                    'more_body': True,
+                })
+                SENT.inc()
+                last = event['event']
+
+        while True:
+            get = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                {get, gone}, timeout=settings.EVENTS_KEEPALIVE_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if get not in done:
+                get.cancel()
+                if gone in done:
+                    return
+                # A comment keeps proxies from timing the stream out
+                await send({
+                    'type': 'http.response.body',
+                    'body': b': keepalive\n\n',
+                    'more_body': True,
+                })
+                continue
+            event = get.result()
+            if event is None:
+                break
+            # Also replayed, if committed while subscribing
+            if last is not None and event['event'] <= last:
+                continue
+            await send({
+                'type': 'http.response.body',
+                'body': message(event),
+                'more_body': True,
+            })
+            SENT.inc()
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        STREAMS.dec()
+        gone.cancel()
+        events.unsubscribe(user.pk, queue)
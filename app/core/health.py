@@ -0,0 +1,90 @@
+"""
+Dependency checks behind /readyz.
+
+Results are kept per process for READINESS_CACHE_SECONDS and refreshed
+by one thread at a time; others keep answering from the previous
+results meanwhile, so a storm of probes costs at most one database and
+one cache round trip per interval.
+"""
+
+import os
+import threading
+from time import monotonic, perf_counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+
+def check_database(alias):
+    with connections[alias].cursor() as cursor:
+        cursor.execute('SELECT 1')
+
+
+def check_cache():
+    key = 'readyz:%d' % os.getpid()
+    cache.set(key, 1, 10)
+    if cache.get(key) != 1:
+        raise RuntimeError('cache did not return the value just set')
+
+
+def checks():
+    """Return {name: callable} of the dependencies to check"""
+    probes = {
+        alias if alias != 'default' else 'database':
+            lambda alias=alias: check_database(alias)
+        for alias in ['default'] + list(settings.DATABASE_REPLICAS)
+    }
+    probes['cache'] = check_cache
+    return probes
+
+
+def run_checks():
+    """Run every check, returning {name: {'ok', 'ms'[, 'error']}}"""
+    results = {}
+    for name, check in checks().items():
+        start = perf_counter()
+        result = {}
+        try:
+            check()
+            result['ok'] = True
+        except Exception as e:
+            result['ok'] = False
+            result['error'] = '%s: %s' % (type(e).__name__, e)
+        result['ms'] = round((perf_counter() - start) * 1000, 3)
+        results[name] = result
+    return results
+
+
+class Readiness:
+    """Cached, single-flight check results"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = None
+        self._checked_at = 0.0
+
+    def _fresh(self):
+        ttl = settings.READINESS_CACHE_SECONDS
+        return self._results is not None and \
+            monotonic() - self._checked_at < ttl
+
+    def results(self):
+        if self._fresh():
+            return self._results
+        # Only wait for the refresh if there is nothing to answer with
+        if not self._lock.acquire(blocking=self._results is None):
+            return self._results
+        try:
+            if not self._fresh():
+                self._results = run_checks()
+                self._checked_at = monotonic()
+            return self._results
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        self._results = None
+
+
+readiness = Readiness()
@@ -0,0 +1,234 @@
+"""
+Background jobs queued in PostgreSQL.
+
+Functions registered with @job in an app's jobs module run in
+`manage.py run_worker` processes. enqueue() inserts a Job in the current
+transaction, so a job only runs if the work queueing it commits. Workers
+claim due jobs with SELECT ... FOR UPDATE SKIP LOCKED, so they neither
+wait on nor double-claim each other's jobs, and hold each for a lease of
+JOBS_LEASE_SECONDS that they renew while it runs; the job of a worker that
+died is requeued once its lease runs out. Jobs raising an exception are
+retried with exponential backoff, up to their max_attempts, so they must
+be safe to run again. Workers also queue the jobs in JOBS_PERIODIC that
+haven't been queued within their interval.
+"""
+
+import json
+import logging
+import random
+from datetime import timedelta
+from time import perf_counter
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+from rest_framework import serializers, viewsets
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.permissions import IsAuthenticated
+
+from core import metrics
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_xact_lock(PERIODIC_LOCK) stops workers queueing a periodic
+# job twice
+PERIODIC_LOCK = 3_737_003
+
+COMPLETED = metrics.Counter(
+    'jobs_completed_total', 'Job runs finished, by job and outcome',
+    ['name', 'outcome'],
+)
+DURATION = metrics.Histogram(
+    'job_duration_seconds', 'Time jobs took to run', ['name'],
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+WAIT_TIME = metrics.Histogram(
+    'job_queue_wait_seconds', 'Time from a job being due to it starting',
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+
+_registry = {}
+_discovered = False
+
+
+def job(name, queue='default', max_attempts=None):
+    """Register the decorated function to run as the job name, called
+    with the job's args as keyword arguments"""
+    def register(func):
+        func.job_name = name
+        func.queue = queue
+        func.max_attempts = max_attempts
+        _registry[name] = func
+        return func
+    return register
+
+
+def registered():
+    """Return {name: function}, importing every app's jobs module first"""
+    global _discovered
+    if not _discovered:
+        autodiscover_modules('jobs')
+        _discovered = True
+    return _registry
+
+
+def enqueue(name, args=None, user=None, run_after=None):
+    """Queue a run of the job name in the current transaction"""
+    try:
+        func = registered()[name]
+    except KeyError:
+        raise ValueError('No job named %r' % name)
+    return Job.objects.create(
+        name=name, queue=func.queue, user=user,
+        args=json.loads(json.dumps(args or {}, cls=DjangoJSONEncoder)),
+        max_attempts=func.max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        run_after=run_after or timezone.now(),
+    )
+
+
+def enqueue_periodic():
+    """Queue each job in JOBS_PERIODIC last queued longer ago than its
+    interval; return the jobs queued"""
+    now = timezone.now()
+    queued = []
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [PERIODIC_LOCK])
+        for name, seconds in settings.JOBS_PERIODIC.items():
+            if not Job.objects.filter(
+                name=name, created_at__gt=now - timedelta(seconds=seconds),
+            ).exists():
+                queued.append(enqueue(name))
+    return queued
+
+
+def claim(worker, queues, limit):
+    """Lease up to limit due jobs from queues to worker"""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(Job.objects.select_for_update(skip_locked=True).filter(
+            status=Job.QUEUED, queue__in=queues, run_after__lte=now,
+        ).order_by('run_after', 'id')[:limit])
+        if not jobs:
+            return []
+        locked_until = now + timedelta(seconds=settings.JOBS_LEASE_SECONDS)
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=Job.RUNNING, attempts=F('attempts') + 1, locked_by=worker,
+            locked_until=locked_until, started_at=now,
+        )
+    for job in jobs:
+        WAIT_TIME.observe((now - job.run_after).total_seconds())
+        job.status, job.attempts = Job.RUNNING, job.attempts + 1
+        job.locked_by, job.locked_until = worker, locked_until
+    return jobs
+
+
+def renew(worker, job_ids):
+    """Extend the leases of the worker's running jobs"""
+    return Job.objects.filter(
+        pk__in=job_ids, status=Job.RUNNING, locked_by=worker
+    ).update(locked_until=timezone.now() + timedelta(
+        seconds=settings.JOBS_LEASE_SECONDS
+    ))
+
+
+def requeue_expired():
+    """Requeue running jobs whose lease ran out, or give up on them when
+    out of attempts; return how many were requeued"""
+    now = timezone.now()
+    expired = Job.objects.filter(status=Job.RUNNING, locked_until__lt=now)
+    expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=now, locked_until=None,
+        last_error='The worker running the job went away.',
+    )
+    return expired.update(
+        status=Job.QUEUED, run_after=now, locked_until=None,
+        last_error='The worker running the job went away.',
+    )
+
+
+def backoff(attempts):
+    """Seconds to wait before the next attempt, with full jitter"""
+    return random.uniform(0, min(
+        settings.JOBS_MAX_BACKOFF,
+        settings.JOBS_BACKOFF_BASE * 2 ** (attempts - 1),
+    ))
+
+
+def run(job):
+    """Run a claimed job and record how it went"""
+    func = registered().get(job.name)
+    start = perf_counter()
+    try:
+        if func is None:
+            raise LookupError('No job named %r' % job.name)
+        result = func(**job.args)
+    except Exception as e:
+        logger.exception('Job %s failed', job)
+        outcome = fail(job, e, retry=func is not None)
+    else:
+        outcome = Job.SUCCEEDED
+        finish(job, status=Job.SUCCEEDED, result=json.loads(
+            json.dumps(result, cls=DjangoJSONEncoder)
+        ))
+    DURATION.labels(job.name).observe(perf_counter() - start)
+    COMPLETED.labels(job.name, outcome).inc()
+    return outcome
+
+
+def fail(job, error, retry=True):
+    """Schedule the job for a retry, or give up on it; return the
+    outcome"""
+    error = ('%s: %s' % (type(error).__name__, error))[:1000]
+    if retry and job.attempts < job.max_attempts:
+        finish(
+            job, status=Job.QUEUED, last_error=error, finished_at=None,
+            run_after=timezone.now() + timedelta(
+                seconds=backoff(job.attempts)
+            ),
+        )
+        return 'retried'
+    finish(job, status=Job.FAILED, last_error=error)
+    return Job.FAILED
+
+
+def finish(job, **changes):
+    changes.setdefault('finished_at', timezone.now())
+    # Unless the lease ran out and the job went to another worker
+    Job.objects.filter(
+        pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by
+    ).update(locked_until=None, **changes)
+
+
+def prune(days):
+    """Delete jobs finished more than days ago"""
+    return Job.objects.filter(
+        status__in=[Job.SUCCEEDED, Job.FAILED],
+        finished_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()[0]
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'name', 'status', 'attempts', 'max_attempts', 'result',
+            'last_error', 'created_at', 'started_at', 'finished_at',
+        ]
+        read_only_fields = fields
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Status of the user's background jobs"""
+
+    serializer_class = JobSerializer
+    queryset = Job.objects.all()
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user).order_by('-id')
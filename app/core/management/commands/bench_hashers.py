@@ -0,0 +1,90 @@
+"""
+Django command to benchmark login throughput of the password hashers
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+PASSWORD = 'correct horse battery staple'
+
+
+class Command(BaseCommand):
+    """Verify a password with each hasher profile from several threads at
+    once and report the logins per second a process can sustain. Hashers
+    that release the GIL scale with threads up to the CPUs available."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'profiles', nargs='*',
+            default=list(settings.PASSWORD_HASHER_PROFILES),
+            help='Profiles from PASSWORD_HASHER_PROFILES to compare.',
+        )
+        parser.add_argument(
+            '--threads', type=int, nargs='+',
+            default=sorted({1, os.cpu_count() or 1}),
+            help='Thread counts to measure throughput with.',
+        )
+        parser.add_argument(
+            '--seconds', type=float, default=2.0,
+            help='How long to verify passwords for at each thread count.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        unknown = set(options['profiles']) - set(
+            settings.PASSWORD_HASHER_PROFILES
+        )
+        if unknown:
+            raise CommandError('Unknown profiles: %s' % ', '.join(unknown))
+
+        self.stdout.write('%-8s %8s  %s' % ('profile', 'ms/hash', ' '.join(
+            '%12s' % ('%d thr/s' % threads) for threads in options['threads']
+        )))
+        for profile in options['profiles']:
+            hasher = import_string(
+                settings.PASSWORD_HASHER_PROFILES[profile]
+            )()
+            try:
+                start = perf_counter()
+                encoded = hasher.encode(PASSWORD, hasher.salt())
+                cost = perf_counter() - start
+            except ValueError as e:
+                # The optional library isn't installed
+                self.stdout.write('%-8s %s' % (profile, e))
+                continue
+            rates = [
+                self.throughput(hasher, encoded, threads, options['seconds'])
+                for threads in options['threads']
+            ]
+            self.stdout.write('%-8s %8.1f  %s' % (
+                profile, cost * 1000,
+                ' '.join('%12.1f' % rate for rate in rates),
+            ))
+
+    def throughput(self, hasher, encoded, threads, seconds):
+        """Return verifications per second over all threads"""
+        done = []
+        stop = threading.Event()
+
+        def verify():
+            count = 0
+            while not stop.is_set():
+                if not hasher.verify(PASSWORD, encoded):
+                    raise CommandError('%s failed to verify' % hasher)
+                count += 1
+            done.append(count)
+
+        start = perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            futures = [pool.submit(verify) for _ in range(threads)]
+            stop.wait(seconds)
+            stop.set()
+            for future in futures:
+                future.result()
+        return sum(done) / (perf_counter() - start)
@@ -0,0 +1,150 @@
+"""
+Django command to get a container ready to serve as quickly as possible
+"""
+
+import hashlib
+import importlib.util
+import os
+import random
+import time
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+
+# pg_advisory_lock key serializing migrations between booting containers
+MIGRATE_LOCK = 3_737_001
+
+
+def disk_migrations():
+    """Return {(app label, migration name)} of the migration files on disk,
+    without importing them"""
+    names = set()
+    for app_config in apps.get_app_configs():
+        module_name, _ = MigrationLoader.migrations_module(app_config.label)
+        if module_name is None:
+            continue
+        try:
+            spec = importlib.util.find_spec(module_name)
+        except ModuleNotFoundError:
+            continue
+        if spec is None or not spec.submodule_search_locations:
+            continue
+        for directory in spec.submodule_search_locations:
+            for filename in os.listdir(directory):
+                name, ext = os.path.splitext(filename)
+                if ext == '.py' and not name.startswith(('_', '~')):
+                    names.add((app_config.label, name))
+    return names
+
+
+def graph_hash(migrations):
+    return hashlib.sha256(
+        '\n'.join(sorted('%s.%s' % m for m in migrations)).encode()
+    ).hexdigest()[:12]
+
+
+class Command(BaseCommand):
+    """Wait for the database, migrate only if needed, report timings."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--timeout', type=float, default=60.0,
+            help='Seconds to wait for the database before giving up.',
+        )
+        parser.add_argument('--initial-delay', type=float, default=0.05)
+        parser.add_argument('--max-delay', type=float, default=2.0)
+        parser.add_argument('--database', default='default')
+        parser.add_argument(
+            '--serve', action='store_true',
+            help='Run the serve command in this process once ready.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        connection = connections[options['database']]
+        self.verbosity = options['verbosity']
+        timings = {}
+
+        start = time.perf_counter()
+        attempts = self.wait_for_db(connection, options)
+        timings['db'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        pending = self.pending(connection)
+        timings['check'] = time.perf_counter() - start
+
+        if pending:
+            start = time.perf_counter()
+            self.migrate(connection, options['database'])
+            timings['migrate'] = time.perf_counter() - start
+
+        self.stdout.write('Boot: %s (total %.0f ms, %d connect attempts)' % (
+            ', '.join(
+                '%s %.0f ms' % (name, seconds * 1000)
+                for name, seconds in timings.items()
+            ),
+            sum(timings.values()) * 1000,
+            attempts,
+        ))
+        if options['serve']:
+            call_command('serve')
+
+    def probe(self, connection, timeout):
+        """Open and close one raw connection"""
+        params = connection.get_connection_params()
+        params['connect_timeout'] = max(1, int(timeout))
+        connection.Database.connect(**params).close()
+
+    def wait_for_db(self, connection, options):
+        """Probe with exponential backoff and full jitter; return the
+        number of attempts"""
+        deadline = time.monotonic() + options['timeout']
+        delay = options['initial_delay']
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            try:
+                self.probe(connection, remaining)
+                return attempt
+            except connection.Database.OperationalError as e:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise CommandError(
+                        'Database unavailable after %d attempts: %s'
+                        % (attempt, e)
+                    )
+            time.sleep(min(random.uniform(0, delay), remaining))
+            delay = min(delay * 2, options['max_delay'])
+
+    def pending(self, connection):
+        """Return whether some migration on disk has not been applied"""
+        on_disk = disk_migrations()
+        applied = set(MigrationRecorder(connection).applied_migrations())
+        disk_hash = graph_hash(on_disk)
+        applied_hash = graph_hash(on_disk & applied)
+        self.stdout.write('Migrations: disk %s, applied %s' % (
+            disk_hash, applied_hash
+        ))
+        return disk_hash != applied_hash
+
+    def migrate(self, connection, database):
+        """Migrate, one container at a time"""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [MIGRATE_LOCK])
+        try:
+            # Another container may have migrated while this one waited
+            if self.pending(connection):
+                call_command(
+                    'migrate', database=database, interactive=False,
+                    verbosity=self.verbosity,
+                )
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_unlock(%s)', [MIGRATE_LOCK]
+                )
@@ -0,0 +1,66 @@
+"""
+Django command to find and repair stale recipe card snapshots
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Recipe
+from recipe import cards
+
+
+class Command(BaseCommand):
+    """Compare every recipe's card with a freshly serialized one, in
+    batches of recipes in primary key order, and rebuild those that
+    differ with --repair."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair', action='store_true',
+            help='Rebuild missing and stale cards.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--user', type=int, help='Only this user id.')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        recipes = Recipe.objects.order_by('pk')
+        if options['user'] is not None:
+            recipes = recipes.filter(user_id=options['user'])
+        checked = missing = stale = 0
+        last = 0
+        while True:
+            batch = list(cards.with_relations(
+                recipes.filter(pk__gt=last)[:options['batch_size']]
+            ))
+            if not batch:
+                break
+            last = batch[-1].pk
+            expected = cards.build(batch)
+            drifted = []
+            for recipe in batch:
+                if recipe.card is None:
+                    missing += 1
+                elif recipe.card != expected[recipe.pk]:
+                    stale += 1
+                    if options['verbosity'] > 1:
+                        self.stdout.write('Recipe %d: %s != %s' % (
+                            recipe.pk, recipe.card, dict(expected[recipe.pk])
+                        ))
+                else:
+                    continue
+                drifted.append(recipe.pk)
+            checked += len(batch)
+            if options['repair']:
+                cards.rebuild(drifted)
+
+        self.stdout.write('Checked %d recipes: %d missing, %d stale cards.' % (
+            checked, missing, stale
+        ))
+        if not missing and not stale:
+            self.stdout.write(self.style.SUCCESS('All cards are current.'))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(
+                'Rebuilt %d cards.' % (missing + stale)
+            ))
+        else:
+            raise CommandError('Run with --repair to rebuild them.')
@@ -0,0 +1,59 @@
+"""
+Django command to delete tags and ingredients no recipe uses
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe import orphans
+
+
+class Command(BaseCommand):
+    """Find unused tags and ingredients with an anti-join against the
+    recipe links and delete them in short transactions over primary key
+    windows, pausing between them and while replicas lag."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'relations', nargs='*', default=list(orphans.RELATIONS),
+            help='Any of %s; all by default.' % ', '.join(orphans.RELATIONS),
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.ORPHANS_BATCH_SIZE,
+            help='Rows looked at per delete.',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=settings.ORPHANS_PAUSE,
+            help='Seconds to sleep after each delete.',
+        )
+        parser.add_argument(
+            '--max-lag', type=float, default=settings.ORPHANS_MAX_REPLICA_LAG,
+            help='Seconds of replica lag to wait for before deleting more.',
+        )
+        parser.add_argument(
+            '--lock-timeout', type=int,
+            default=settings.ORPHANS_LOCK_TIMEOUT_MS,
+            help='Milliseconds to wait for row locks before skipping rows.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Count unused rows without deleting them.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        unknown = set(options['relations']) - set(orphans.RELATIONS)
+        if unknown:
+            raise CommandError('Unknown relations: %s' % ', '.join(unknown))
+        for relation in options['relations']:
+            found, skipped = orphans.collect(
+                relation, options['batch_size'], options['pause'],
+                options['max_lag'], options['lock_timeout'],
+                options['dry_run'],
+            )
+            message = '%s %d unused %s' % (
+                'Found' if options['dry_run'] else 'Deleted', found, relation,
+            )
+            if skipped:
+                message += ', skipped %d busy batches' % skipped
+            self.stdout.write(self.style.SUCCESS(message + '.'))
@@ -0,0 +1,80 @@
+"""
+Django command to deliver outbox events to the configured webhooks
+"""
+
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from core import metrics, outbox
+
+# Seconds between deletions of old delivered events
+PRUNE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    """Deliver pending events in per-user batches until stopped, sleeping
+    while there are none due."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no events are due instead of waiting for more.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE,
+            help='Most events of one user per request.',
+        )
+        parser.add_argument(
+            '--max-users', type=int, default=100,
+            help='Most users to deliver for per round.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=1.0,
+            help='Seconds to sleep when no events are due.',
+        )
+        parser.add_argument(
+            '--metrics-port', type=int, default=settings.WORKER_METRICS_PORT,
+            help='Port to serve /metrics on, or 0 not to.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if not settings.OUTBOX_WEBHOOK_URLS:
+            raise CommandError('OUTBOX_WEBHOOK_URLS is empty.')
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        if options['metrics_port']:
+            metrics.start_http_server(options['metrics_port'])
+        pruned_at = 0.0
+        total = 0
+
+        while not self.stopping:
+            delivered = outbox.deliver(
+                options['batch_size'], options['max_users']
+            )
+            total += delivered
+            if delivered:
+                self.stdout.write('Delivered %d events' % delivered)
+            if time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                outbox.prune(settings.OUTBOX_RETENTION_DAYS)
+                pruned_at = time.monotonic()
+            metrics.REGISTRY.maybe_flush()
+            if not delivered:
+                if options['once']:
+                    break
+                # Hand the connection back to the pool while idle
+                close_old_connections()
+                time.sleep(options['interval'])
+
+        metrics.REGISTRY.flush()
+        self.stdout.write(self.style.SUCCESS(
+            'Delivered %d events in total.' % total
+        ))
+
+    def stop(self, signum, frame):
+        """Finish the current round, then exit"""
+        self.stopping = True
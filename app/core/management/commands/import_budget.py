@@ -0,0 +1,112 @@
+"""
+Django command to report import times and enforce a startup budget
+"""
+
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PACKAGES = ('app', 'core', 'user', 'recipe')
+
+# -X importtime only reports imports made through the import statement, and
+# Django loads apps, models and middleware with importlib.import_module
+SCRIPT = '''
+import importlib, sys
+def import_module(name, package=None):
+    if name.startswith('.'):
+        name = importlib.util.resolve_name(name, package)
+    __import__(name)
+    return sys.modules[name]
+importlib.import_module = import_module
+for name in sys.argv[1:]:
+    __import__(name)
+'''
+
+
+def parse(stderr):
+    """Return [(module, self us, cumulative us, depth)] from -X importtime"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(own), int(cumulative), depth))
+    return imports
+
+
+class Command(BaseCommand):
+    """Import the app in a fresh interpreter and report the cost per
+    module, failing if startup or any one of our modules is over budget."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'modules', nargs='*',
+            default=['app.wsgi', 'app.urls', 'app.asgi_urls'],
+            help='Modules imported on startup.',
+        )
+        parser.add_argument(
+            '--budget-ms', type=float,
+            default=settings.IMPORT_TIME_BUDGET_MS,
+            help='Most time all startup imports may take.',
+        )
+        parser.add_argument(
+            '--module-budget-ms', type=float,
+            default=settings.IMPORT_TIME_MODULE_BUDGET_MS,
+            help='Most time one of our modules may take, excluding the '
+                 'modules it imports.',
+        )
+        parser.add_argument('--top', type=int, default=15)
+
+    def measure(self, modules):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', SCRIPT] + modules,
+            cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError('Importing failed:\n' + result.stderr)
+        return parse(result.stderr)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        imports = self.measure(options['modules'])
+        total = sum(
+            cumulative for name, _, cumulative, depth in imports
+            if depth == 0 and name.split('.')[0] in PACKAGES
+        ) / 1000
+        ours = sorted(
+            (i for i in imports if i[0].split('.')[0] in PACKAGES),
+            key=lambda i: -i[2],
+        )
+        heaviest = sorted(
+            (i for i in imports if i[0].split('.')[0] not in PACKAGES),
+            key=lambda i: -i[1],
+        )
+
+        self.stdout.write('%10s %10s  %s' % ('self ms', 'total ms', 'module'))
+        for name, own, cumulative, _ in ours:
+            self.stdout.write('%10.1f %10.1f  %s' % (
+                own / 1000, cumulative / 1000, name
+            ))
+        self.stdout.write('\nSlowest other modules:')
+        for name, own, cumulative, _ in heaviest[:options['top']]:
+            self.stdout.write('%10.1f %10.1f  %s' % (
+                own / 1000, cumulative / 1000, name
+            ))
+        self.stdout.write('\nStartup imports: %.1f ms (budget %.1f ms)' % (
+            total, options['budget_ms']
+        ))
+
+        over = [
+            name for name, own, _, _ in ours
+            if own / 1000 > options['module_budget_ms']
+        ]
+        if over:
+            raise CommandError('Over the %.1f ms module budget: %s' % (
+                options['module_budget_ms'], ', '.join(over)
+            ))
+        if total > options['budget_ms']:
+            raise CommandError('Startup imports are over budget.')
+        self.stdout.write(self.style.SUCCESS('Within budget.'))
@@ -0,0 +1,197 @@
+"""
+Django command to create users in bulk from CSV or NDJSON
+"""
+
+import csv
+import itertools
+import json
+import math
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_email
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+
+def hash_passwords(passwords):
+    """Hash in a worker process"""
+    return [make_password(password) for password in passwords]
+
+
+def read_rows(stream, fmt):
+    """Yield a dict per user from CSV with a header row, or NDJSON"""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise CommandError('Line %d is not JSON: %s' % (number, e))
+
+
+def chunked(items, size):
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    """Create users from a file of email, name and password, hashing the
+    passwords on every core and inserting them in batches."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, '-' for stdin.")
+        parser.add_argument(
+            '--format', choices=['csv', 'ndjson'],
+            help='Defaults to ndjson for .ndjson/.jsonl files, else csv.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Processes hashing passwords; 0 hashes in this process.',
+        )
+        parser.add_argument(
+            '--tokens', metavar='PATH',
+            help='Issue an API token to each new user and write '
+                 'email,token lines to PATH.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        fmt = options['format'] or (
+            'ndjson' if options['path'].endswith(('.ndjson', '.jsonl'))
+            else 'csv'
+        )
+        tokens_file = self.tokens = None
+        if options['tokens']:
+            tokens_file = open(options['tokens'], 'w', newline='')
+            self.tokens = csv.writer(tokens_file)
+        self.created = self.skipped = 0
+        self.seen = set()
+        self.start = perf_counter()
+
+        stream = sys.stdin if options['path'] == '-' else open(
+            options['path'], newline='', encoding='utf-8'
+        )
+        try:
+            batches = filter(None, map(self.new_users, chunked(
+                self.clean(read_rows(stream, fmt)), options['batch_size']
+            )))
+            if options['workers']:
+                self.import_parallel(batches, options['workers'])
+            else:
+                for batch in batches:
+                    self.insert(batch, hash_passwords(
+                        [password for _, _, password in batch]
+                    ))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if tokens_file:
+                tokens_file.close()
+
+        elapsed = perf_counter() - self.start
+        self.stdout.write(self.style.SUCCESS(
+            'Created %d users in %.1fs (%.0f users/s), skipped %d.' % (
+                self.created, elapsed, self.created / (elapsed or 1),
+                self.skipped,
+            )
+        ))
+
+    def clean(self, rows):
+        """Yield (email, name, password) with normalized emails, skipping
+        invalid and repeated ones"""
+        User = get_user_model()
+        for row in rows:
+            email = User.objects.normalize_email(
+                (row.get('email') or '').strip()
+            )
+            try:
+                validate_email(email)
+            except ValidationError:
+                self.warn('invalid email %r' % email)
+                continue
+            if email in self.seen:
+                self.warn('%s appears more than once' % email)
+                continue
+            self.seen.add(email)
+            yield (
+                email,
+                (row.get('name') or '').strip(),
+                # No password leaves the account unusable until it is reset
+                row.get('password') or None,
+            )
+
+    def new_users(self, batch):
+        """Drop users that already exist, before paying for their hashes,
+        so an interrupted import can simply be run again"""
+        existing = set(get_user_model().objects.filter(
+            email__in=[email for email, _, _ in batch]
+        ).values_list('email', flat=True))
+        for email in sorted(existing):
+            self.warn('%s already exists' % email)
+        return [user for user in batch if user[0] not in existing]
+
+    def import_parallel(self, batches, workers):
+        """Hash batches ahead on the pool while inserting finished ones"""
+        pending = deque()
+        with ProcessPoolExecutor(
+            workers, initializer=django.setup
+        ) as pool:
+            for batch in batches:
+                size = math.ceil(len(batch) / workers)
+                pending.append((batch, [
+                    pool.submit(hash_passwords, chunk) for chunk in chunked(
+                        [password for _, _, password in batch], size
+                    )
+                ]))
+                # Enough queued to keep every worker busy while inserting
+                if len(pending) > 2:
+                    self.insert_hashed(*pending.popleft())
+            while pending:
+                self.insert_hashed(*pending.popleft())
+
+    def insert_hashed(self, batch, futures):
+        self.insert(batch, [
+            encoded for future in futures for encoded in future.result()
+        ])
+
+    def insert(self, batch, passwords):
+        User = get_user_model()
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(email=email, name=name, password=password)
+                for (email, name, _), password in zip(batch, passwords)
+            ])
+            if self.tokens:
+                tokens = Token.objects.bulk_create([
+                    Token(user=user, key=Token.generate_key())
+                    for user in users
+                ])
+                self.tokens.writerows(
+                    (token.user.email, token.key) for token in tokens
+                )
+        self.created += len(users)
+        elapsed = perf_counter() - self.start
+        self.stdout.write('%d users created (%.0f users/s)' % (
+            self.created, self.created / (elapsed or 1)
+        ))
+
+    def warn(self, message):
+        self.skipped += 1
+        self.stderr.write('Skipped: %s' % message)
@@ -0,0 +1,140 @@
+"""
+Django command to load test a running server with slow clients
+"""
+
+import asyncio
+import random
+import statistics
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(values, p):
+    """Return the p-th percentile of sorted values"""
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+class Command(BaseCommand):
+    """Send GETs that trickle their request headers, like clients on slow
+    networks, and report throughput and tail latency. Run it against
+    gunicorn (app.wsgi) and uvicorn (app.asgi) to compare the two."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument('--token', help='API token to authenticate as.')
+        parser.add_argument(
+            '--concurrency', type=int, default=50,
+            help='Most requests in flight at once.',
+        )
+        parser.add_argument(
+            '--rate', type=float, default=0.0,
+            help='Start requests at this many per second instead of as fast '
+                 'as --concurrency allows.',
+        )
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument(
+            '--slow', type=float, default=0.0,
+            help='Seconds slow clients pause halfway through their request.',
+        )
+        parser.add_argument(
+            '--slow-fraction', type=float, default=1.0,
+            help='Share of clients that are slow. Sync workers stall fast '
+                 'clients queued behind slow ones.',
+        )
+        parser.add_argument('--timeout', type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        url = urlsplit(options['url'])
+        if url.scheme != 'http' or not url.hostname:
+            raise CommandError('Only http:// URLs are supported.')
+        target = url.path or '/'
+        if url.query:
+            target += '?' + url.query
+        headers = [
+            'GET %s HTTP/1.1' % target,
+            'Host: %s' % url.netloc,
+            'Connection: close',
+        ]
+        if options['token']:
+            headers.append('Authorization: Token %s' % options['token'])
+        request = ('\r\n'.join(headers) + '\r\n\r\n').encode()
+
+        latencies, statuses, elapsed = asyncio.run(self.run(
+            url.hostname, url.port or 80, request, options
+        ))
+        self.report(latencies, statuses, elapsed)
+
+    async def run(self, host, port, request, options):
+        latencies = []
+        statuses = {}
+        half = len(request) // 2
+        rate = options['rate']
+        in_flight = asyncio.Semaphore(options['concurrency'])
+        chance = random.Random(0)
+        slow = [
+            options['slow'] if chance.random() < options['slow_fraction']
+            else 0
+            for _ in range(options['requests'])
+        ]
+
+        async def one(pause):
+            reader, writer = await asyncio.open_connection(host, port)
+            try:
+                writer.write(request[:half])
+                await writer.drain()
+                if pause:
+                    await asyncio.sleep(pause)
+                writer.write(request[half:])
+                await writer.drain()
+                status_line = await reader.readline()
+                await reader.read()
+            finally:
+                writer.close()
+            return status_line.split(b' ')[1].decode()
+
+        async def scheduled(i):
+            if rate:
+                await asyncio.sleep(i / rate)
+            # Timed from the scheduled start, so queueing behind a stalled
+            # server counts against it
+            start = perf_counter()
+            async with in_flight:
+                try:
+                    status = await asyncio.wait_for(
+                        one(slow[i]), options['timeout']
+                    )
+                    latencies.append(perf_counter() - start)
+                except (OSError, IndexError, asyncio.TimeoutError) as e:
+                    status = type(e).__name__
+            statuses[status] = statuses.get(status, 0) + 1
+
+        start = perf_counter()
+        await asyncio.gather(*(
+            scheduled(i) for i in range(options['requests'])
+        ))
+        return sorted(latencies), statuses, perf_counter() - start
+
+    def report(self, latencies, statuses, elapsed):
+        completed = sum(statuses.values())
+        self.stdout.write('Requests: %d in %.2fs (%.1f/s)' % (
+            completed, elapsed, completed / elapsed
+        ))
+        self.stdout.write('Statuses: %s' % ', '.join(
+            '%s=%d' % item for item in sorted(statuses.items())
+        ))
+        if not latencies:
+            return
+        self.stdout.write(
+            'Latency ms: mean %.1f, p50 %.1f, p95 %.1f, p99 %.1f, max %.1f'
+            % tuple(value * 1000 for value in (
+                statistics.mean(latencies),
+                percentile(latencies, 50),
+                percentile(latencies, 95),
+                percentile(latencies, 99),
+                latencies[-1],
+            ))
+        )
@@ -0,0 +1,99 @@
+"""
+Django command to move the recipe tables to hash partitioning online
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.db import partitioning
+
+STEPS = ['prepare', 'backfill', 'swap', 'check']
+
+
+class Command(BaseCommand):
+    """Partition core_recipe by user and its through tables by recipe."""
+
+    help = partitioning.__doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'step', nargs='?', choices=STEPS + ['all'], default='all',
+        )
+        parser.add_argument('--partitions', type=int, default=16)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--sleep', type=float, default=0.1,
+            help='Seconds to pause between backfill batches.',
+        )
+        parser.add_argument('--lock-timeout', default='5s')
+        parser.add_argument(
+            '--user', type=int, default=1,
+            help='User id to EXPLAIN the pruning checks with.',
+        )
+        parser.add_argument(
+            '--recipe', type=int, default=1,
+            help='Recipe id to EXPLAIN the pruning checks with.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning requires PostgreSQL.')
+        step = options['step']
+        steps = STEPS if step == 'all' else [step]
+
+        with connection.cursor() as cursor:
+            done = partitioning.is_partitioned(
+                cursor, partitioning.TABLES[0].table
+            )
+        if done and steps != ['check']:
+            raise CommandError('The recipe tables are already partitioned.')
+
+        if 'prepare' in steps:
+            for spec in partitioning.TABLES:
+                partitioning.prepare(
+                    spec, options['partitions'], log=self.stdout.write
+                )
+        if 'backfill' in steps:
+            for spec in partitioning.TABLES:
+                partitioning.backfill(
+                    spec, options['batch_size'], options['sleep'],
+                    log=self.stdout.write,
+                )
+                source, shadow = partitioning.verify(spec)
+                self.stdout.write(
+                    '%s: %d rows, %s: %d rows'
+                    % (spec.table, source, spec.shadow, shadow)
+                )
+        if 'swap' in steps:
+            try:
+                partitioning.swap(
+                    partitioning.TABLES, options['lock_timeout'],
+                    log=self.stdout.write,
+                )
+            except RuntimeError as e:
+                raise CommandError(str(e))
+        if 'check' in steps:
+            self.check_pruning(options['user'], options['recipe'])
+
+        self.stdout.write(self.style.SUCCESS('Done.'))
+
+    def check_pruning(self, user_id, recipe_id):
+        """Fail unless every viewset query reads a single partition"""
+        with connection.cursor() as cursor:
+            for spec in partitioning.TABLES:
+                if not partitioning.is_partitioned(cursor, spec.table):
+                    raise CommandError('%s is not partitioned.' % spec.table)
+        failed = []
+        for table, sql, read in partitioning.check_pruning(
+            user_id, recipe_id
+        ):
+            self.stdout.write('%s: %s\n  partitions: %s' % (
+                table, sql, ', '.join(read) or '-'
+            ))
+            if len(read) > 1:
+                failed.append(sql)
+        if failed:
+            raise CommandError(
+                '%d queries are not pruned to one partition.' % len(failed)
+            )
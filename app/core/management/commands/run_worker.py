@@ -0,0 +1,117 @@
+"""
+Django command to run background jobs
+"""
+
+import os
+import signal
+import socket
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs, metrics
+
+# Seconds between deletions of old finished jobs
+PRUNE_INTERVAL = 3600
+
+# Seconds between checks for periodic jobs due to be queued
+PERIODIC_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    """Claim due jobs and run up to --concurrency of them at once on
+    threads, until stopped."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queues', nargs='+', default=['default'],
+            help='Queues to take jobs from.',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.JOBS_CONCURRENCY,
+            help='Most jobs to run at once.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once no jobs are due instead of waiting for more.',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=settings.JOBS_POLL_INTERVAL,
+            help='Seconds between looking for jobs while busy or idle.',
+        )
+        parser.add_argument(
+            '--metrics-port', type=int, default=settings.WORKER_METRICS_PORT,
+            help='Port to serve /metrics on, or 0 not to.',
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        if options['metrics_port']:
+            metrics.start_http_server(options['metrics_port'])
+        worker = '%s:%d' % (socket.gethostname(), os.getpid())
+        concurrency = options['concurrency']
+        running = {}
+        outcomes = Counter()
+        renewed_at = pruned_at = periodic_at = 0.0
+
+        with ThreadPoolExecutor(concurrency, 'job') as pool:
+            while True:
+                if time.monotonic() - periodic_at > PERIODIC_INTERVAL:
+                    jobs.enqueue_periodic()
+                    periodic_at = time.monotonic()
+                if not self.stopping and len(running) < concurrency:
+                    jobs.requeue_expired()
+                    for job in jobs.claim(
+                        worker, options['queues'],
+                        concurrency - len(running),
+                    ):
+                        running[pool.submit(self.run, job)] = job
+                if not running:
+                    if self.stopping or options['once']:
+                        break
+                    # Hand the connection back to the pool while idle
+                    close_old_connections()
+                    time.sleep(options['interval'])
+                    continue
+
+                done, _ = wait(
+                    running, options['interval'], FIRST_COMPLETED
+                )
+                for future in done:
+                    job = running.pop(future)
+                    outcome = future.result()
+                    outcomes[outcome] += 1
+                    self.stdout.write('%s: %s' % (job, outcome))
+
+                now = time.monotonic()
+                if running and \
+                        now - renewed_at > settings.JOBS_LEASE_SECONDS / 3:
+                    jobs.renew(worker, [job.pk for job in running.values()])
+                    renewed_at = now
+                if now - pruned_at > PRUNE_INTERVAL:
+                    jobs.prune(settings.JOBS_RETENTION_DAYS)
+                    pruned_at = now
+                metrics.REGISTRY.maybe_flush()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Ran %d jobs: %d succeeded, %d retried, %d failed.' % (
+                sum(outcomes.values()), outcomes['succeeded'],
+                outcomes['retried'], outcomes['failed'],
+            )
+        ))
+
+    def run(self, job):
+        try:
+            return jobs.run(job)
+        finally:
+            close_old_connections()
+
+    def stop(self, signum, frame):
+        """Finish the running jobs, then exit"""
+        self.stopping = True
@@ -0,0 +1,135 @@
+"""
+Django command to run the app on a preforking gunicorn server
+"""
+
+import glob
+import math
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import metrics, warmup
+
+
+def available_cpus(cgroup_root='/sys/fs/cgroup'):
+    """Return the CPUs this process may use, honouring a cgroup quota"""
+    cpus = len(os.sched_getaffinity(0))
+    quota = _cgroup_quota(cgroup_root)
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+
+def _cgroup_quota(root):
+    """Return the cgroup CPU limit in CPUs, or None if unlimited"""
+    try:
+        with open(os.path.join(root, 'cpu.max')) as f:
+            quota, period = f.read().split()
+    except OSError:
+        try:
+            with open(os.path.join(root, 'cpu', 'cpu.cfs_quota_us')) as f:
+                quota = f.read().strip()
+            with open(os.path.join(root, 'cpu', 'cpu.cfs_period_us')) as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if quota in ('max', '-1'):
+        return None
+    return int(quota) / int(period)
+
+
+def child_exit(server, worker):
+    """Archive an exited worker's metrics, so recycled workers' gauges
+    don't add up"""
+    metrics.REGISTRY.mark_process_dead(worker.pid)
+
+
+class Command(BaseCommand):
+    """Serve the app with gunicorn: several worker processes forked from a
+    master that has already imported and warmed up the app."""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bind', default=os.environ.get('BIND', '0.0.0.0:8000'),
+        )
+        parser.add_argument(
+            '--workers', type=int,
+            default=int(os.environ.get('WEB_CONCURRENCY', 0)),
+            help='Worker processes; defaults to 2 per CPU plus one.',
+        )
+        parser.add_argument(
+            '--threads', type=int,
+            default=int(os.environ.get('WEB_THREADS', 2)),
+            help='Threads per worker (WSGI only).',
+        )
+        parser.add_argument(
+            '--asgi', action='store_true',
+            help='Run app.asgi on uvicorn workers instead of app.wsgi.',
+        )
+        parser.add_argument('--timeout', type=int, default=30)
+        parser.add_argument(
+            '--max-requests', type=int, default=10000,
+            help='Recycle workers after this many requests (0 to never).',
+        )
+
+    def get_options(self, options):
+        """Return the gunicorn settings for the command's options"""
+        workers = options['workers'] or available_cpus() * 2 + 1
+        config = {
+            'bind': options['bind'],
+            'workers': workers,
+            'timeout': options['timeout'],
+            'max_requests': options['max_requests'],
+            'max_requests_jitter': options['max_requests'] // 10,
+            'preload_app': True,
+            'post_fork': lambda server, worker: warmup.warm_connections(),
+            'child_exit': child_exit,
+            'accesslog': '-',
+        }
+        if options['asgi']:
+            config['worker_class'] = 'uvicorn.workers.UvicornWorker'
+        elif options['threads'] > 1:
+            config['worker_class'] = 'gthread'
+            config['threads'] = options['threads']
+        return config
+
+    def handle(self, *args, **options):
+        """Entrypoint for command."""
+        from gunicorn.app.base import BaseApplication
+
+        self.prepare_metrics_dir()
+        config = self.get_options(options)
+        asgi = options['asgi']
+
+        class Application(BaseApplication):
+            def load_config(self):
+                for key, value in config.items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                if asgi:
+                    from app.asgi import application
+                else:
+                    from app.wsgi import application
+                warmup.warm_up()
+                return application
+
+        self.stdout.write('Starting %d %s workers%s on %s' % (
+            config['workers'],
+            config.get('worker_class', 'sync'),
+            ' x %d threads' % config['threads'] if 'threads' in config
+            else '',
+            config['bind'],
+        ))
+        Application().run()
+
+    def prepare_metrics_dir(self):
+        """Give the workers a fresh directory to aggregate metrics in"""
+        directory = settings.METRICS_MULTIPROC_DIR
+        if not directory:
+            directory = tempfile.mkdtemp(prefix='metrics-')
+            settings.METRICS_MULTIPROC_DIR = directory
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            os.remove(path)
@@ -0,0 +1,412 @@
+"""
+Process-wide metrics rendered in the Prometheus text format.
+
+Every labelled series keeps one value array per thread, so recording a
+sample never takes a lock; arrays are summed when the registry is
+collected. When METRICS_MULTIPROC_DIR is set, each process periodically
+dumps a snapshot there and the /metrics view merges all of them, so
+forked workers report as one. Processes that don't serve the app, like
+run_worker, can serve /metrics themselves with start_http_server(). When
+a worker exits, its counters and histograms are folded into an archive
+snapshot and its gauges are dropped. Recycled workers then neither reset
+the counters nor leave gauges behind.
+"""
+
+import bisect
+import glob
+import json
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Snapshot of the processes that have exited, merged like the others
+ARCHIVE = 'metrics-archive.json'
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class _Child:
+    """A single labelled series backed by per-thread value arrays"""
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        """Return the value array owned by the calling thread"""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = [0.0] * self._size
+            with self._lock:
+                self._shards.append(values)
+            self._local.values = values
+            return values
+
+    def collect(self):
+        """Sum the value arrays of every thread"""
+        with self._lock:
+            shards = list(self._shards)
+        totals = [0.0] * self._size
+        for shard in shards:
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+    def reset(self):
+        with self._lock:
+            for shard in self._shards:
+                shard[:] = [0.0] * self._size
+
+
+class CounterChild(_Child):
+
+    def __init__(self):
+        super().__init__(1)
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+
+class GaugeChild(_Child):
+
+    def __init__(self):
+        super().__init__(1)
+        self._function = None
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    def dec(self, amount=1):
+        self._shard()[0] -= amount
+
+    def set_function(self, function):
+        """Report the return value of function instead of the counts"""
+        self._function = function
+
+    def collect(self):
+        if self._function is not None:
+            return [float(self._function())]
+        return super().collect()
+
+
+class HistogramChild(_Child):
+
+    def __init__(self, buckets):
+        # One slot per bucket (the last one is +Inf) plus the running sum
+        self._bounds = buckets
+        super().__init__(len(buckets) + 1)
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect.bisect_left(self._bounds, value)] += 1
+        shard[-1] += value
+
+
+class _Metric:
+    """A metric family; use labels() to get a series and keep a reference"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Return the series for values, creating it on first use"""
+        values = tuple(str(value) for value in values)
+        try:
+            return self._children[values]
+        except KeyError:
+            if len(values) != len(self.labelnames):
+                raise ValueError('Incorrect label count for %s' % self.name)
+            with self._lock:
+                return self._children.setdefault(values, self._new_child())
+
+    def collect(self):
+        """Return {label values: value array} for every series"""
+        with self._lock:
+            children = list(self._children.items())
+        return {values: child.collect() for values, child in children}
+
+    def reset(self):
+        with self._lock:
+            for child in self._children.values():
+                child.reset()
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return CounterChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return GaugeChild()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=None,
+                 registry=None):
+        buckets = tuple(float(b) for b in (buckets or DEFAULT_BUCKETS))
+        if buckets[-1] != math.inf:
+            buckets += (math.inf,)
+        self.buckets = buckets
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry:
+    """Holds metric families and renders them"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError('Metric %s already registered' % metric.name)
+            self._metrics[metric.name] = metric
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def reset(self):
+        """Zero every series, e.g. in a freshly forked worker"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.reset()
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of every series"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: [
+                [list(values), totals]
+                for values, totals in metric.collect().items()
+            ]
+            for metric in metrics
+        }
+
+    # Multi-process support
+
+    @staticmethod
+    def _multiproc_dir():
+        return getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+
+    def flush(self):
+        """Write this process' snapshot to the multi-process directory"""
+        directory = self._multiproc_dir()
+        if not directory:
+            return
+        self._last_flush = time.monotonic()
+        _write(
+            os.path.join(directory, 'metrics-%d.json' % os.getpid()),
+            self.snapshot(),
+        )
+
+    def maybe_flush(self):
+        """Flush at most once per METRICS_FLUSH_INTERVAL seconds"""
+        interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0)
+        if time.monotonic() - self._last_flush >= interval:
+            self.flush()
+
+    def mark_process_dead(self, pid):
+        """Fold the exited process' counters and histograms into the
+        archive and drop its gauges, which only described it while it
+        ran; call from the one process, such as gunicorn's master, that
+        sees the others exit"""
+        directory = self._multiproc_dir()
+        if not directory:
+            return
+        path = os.path.join(directory, 'metrics-%d.json' % pid)
+        snapshot = _read(path)
+        if snapshot is None:
+            return
+        archive_path = os.path.join(directory, ARCHIVE)
+        archive = {
+            name: {tuple(values): totals for values, totals in series}
+            for name, series in (_read(archive_path) or {}).items()
+        }
+        for name, series in snapshot.items():
+            metric = self._metrics.get(name)
+            if metric is not None and metric.kind != 'gauge':
+                _add(archive.setdefault(name, {}), series)
+        _write(archive_path, {
+            name: [[list(values), totals] for values, totals in family.items()]
+            for name, family in archive.items()
+        })
+        os.remove(path)
+
+    def _merged(self):
+        """Return {name: {label values: totals}} across all processes"""
+        directory = self._multiproc_dir()
+        if not directory:
+            return {
+                name: {tuple(v): t for v, t in series}
+                for name, series in self.snapshot().items()
+            }
+
+        self.flush()
+        merged = {}
+        for path in glob.glob(os.path.join(directory, 'metrics-*.json')):
+            for name, series in (_read(path) or {}).items():
+                _add(merged.setdefault(name, {}), series)
+        return merged
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        merged = self._merged()
+        lines = []
+        for name in sorted(self._metrics):
+            metric = self._metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.documentation))
+            lines.append('# TYPE %s %s' % (name, metric.kind))
+            for values, totals in sorted(merged.get(name, {}).items()):
+                labels = list(zip(metric.labelnames, values))
+                if metric.kind == 'histogram':
+                    lines.extend(_render_histogram(metric, labels, totals))
+                else:
+                    lines.append('%s%s %s' % (
+                        name, _format_labels(labels), _format_value(totals[0])
+                    ))
+        return '\n'.join(lines) + '\n'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, snapshot):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, path)
+
+
+def _add(family, series):
+    """Add snapshot series to {label values: totals}"""
+    for values, totals in series:
+        key = tuple(values)
+        if key in family:
+            family[key] = [a + b for a, b in zip(family[key], totals)]
+        else:
+            family[key] = totals
+
+
+def _render_histogram(metric, labels, totals):
+    count = 0
+    for bound, value in zip(metric.buckets, totals):
+        count += value
+        le = '+Inf' if bound == math.inf else _format_value(bound)
+        yield '%s_bucket%s %s' % (
+            metric.name, _format_labels(labels + [('le', le)]),
+            _format_value(count),
+        )
+    yield '%s_sum%s %s' % (
+        metric.name, _format_labels(labels), _format_value(totals[-1])
+    )
+    yield '%s_count%s %s' % (
+        metric.name, _format_labels(labels), _format_value(count)
+    )
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (
+            key,
+            value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+        )
+        for key, value in labels
+    )
+
+
+def _format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+REGISTRY = Registry()
+
+# A forked worker must not report the counts it inherited from its parent
+os.register_at_fork(after_in_child=REGISTRY.reset)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port, addr='', registry=None):
+    """Serve /metrics on port from a daemon thread, for processes that
+    don't serve the app"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {
+        'registry': registry or REGISTRY,
+    })
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name='metrics', daemon=True
+    ).start()
+    return server
@@ -0,0 +1,277 @@
+"""
+Middleware for request instrumentation
+"""
+
+import asyncio
+import json
+import logging
+import random
+import threading
+from time import perf_counter
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from core import metrics, timing
+from core.db import instrumentation
+
+timing_logger = logging.getLogger('core.timing')
+
+REQUEST_LATENCY = metrics.Histogram(
+    'http_request_duration_seconds',
+    'Time spent serving the request',
+    ['route', 'method'],
+)
+REQUESTS = metrics.Counter(
+    'http_requests_total',
+    'Requests served',
+    ['route', 'method', 'status'],
+)
+DB_QUERIES = metrics.Histogram(
+    'http_request_db_queries',
+    'Database queries run per request',
+    ['route', 'method'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+DB_TIME = metrics.Histogram(
+    'http_request_db_duration_seconds',
+    'Time spent in the database per request',
+    ['route', 'method'],
+)
+RESPONSE_SIZE = metrics.Histogram(
+    'http_response_size_bytes',
+    'Response body size',
+    ['route', 'method'],
+    buckets=(100, 1000, 10000, 100000, 1000000, 10000000),
+)
+IN_FLIGHT = metrics.Gauge(
+    'http_requests_in_flight',
+    'Requests being served by this process',
+)
+SHED = metrics.Counter(
+    'http_requests_shed_total',
+    'Requests rejected with 503 because the process was at capacity',
+    ['method'],
+)
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+# Label values for request methods; clients may send any token as method
+METHODS = frozenset([
+    'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS', 'TRACE',
+    'CONNECT',
+])
+
+
+def method_label(method):
+    return method if method in METHODS else 'other'
+
+
+class _RouteSeries:
+    """Series of one (route, method) pair, bound once and reused"""
+
+    __slots__ = ('route', 'method', 'latency', 'queries', 'db_time', 'size',
+                 'statuses')
+
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.latency = REQUEST_LATENCY.labels(route, method)
+        self.queries = DB_QUERIES.labels(route, method)
+        self.db_time = DB_TIME.labels(route, method)
+        self.size = RESPONSE_SIZE.labels(route, method)
+        self.statuses = {}
+
+    def requests(self, status):
+        try:
+            return self.statuses[status]
+        except KeyError:
+            child = REQUESTS.labels(self.route, self.method, status)
+            return self.statuses.setdefault(status, child)
+
+
+class AsyncCapableMiddleware:
+    """Base for middleware running natively in both sync and async chains.
+
+    Sync-only middleware would make Django run async views on a thread, so
+    under ASGI subclasses' __call__ returns the coroutine from __acall__.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # Lets Django detect the instance as a coroutine function
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """Record latency, DB work, response size and status per route"""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        # {route: {method: _RouteSeries}}
+        self._series = {}
+        if self.is_async:
+            # Django wraps sync process_view methods in sync_to_async
+            self.process_view = self._process_view_async
+
+    def _route_series(self, request):
+        match = request.resolver_match
+        route = match.route if match is not None else UNMATCHED_ROUTE
+        method = method_label(request.method)
+        try:
+            return self._series[route][method]
+        except KeyError:
+            methods = self._series.setdefault(route, {})
+            return methods.setdefault(method, _RouteSeries(route, method))
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = perf_counter()
+        with instrumentation.track() as stats:
+            response = self.get_response(request)
+        return self.record(request, response, stats, perf_counter() - start)
+
+    async def __acall__(self, request):
+        start = perf_counter()
+        with instrumentation.track() as stats:
+            response = await self.get_response(request)
+        return self.record(request, response, stats, perf_counter() - start)
+
+    def record(self, request, response, stats, elapsed):
+        series = self._route_series(request)
+        series.latency.observe(elapsed)
+        series.queries.observe(stats.queries)
+        series.db_time.observe(stats.db_time)
+        series.requests(response.status_code).inc()
+        if not response.streaming:
+            series.size.observe(len(response.content))
+
+        metrics.REGISTRY.maybe_flush()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = instrumentation.current()
+        if stats is not None:
+            stats.view = request.resolver_match.view_name
+
+    async def _process_view_async(self, *args):
+        MetricsMiddleware.process_view(self, *args)
+
+
+class ServerTimingMiddleware(AsyncCapableMiddleware):
+    """Report request phase durations in a Server-Timing header"""
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = perf_counter()
+        token = timing.start()
+        try:
+            response = self.get_response(request)
+            spans = timing.current()
+        finally:
+            timing.finish(token)
+        return self.report(request, response, spans, start)
+
+    async def __acall__(self, request):
+        start = perf_counter()
+        token = timing.start()
+        try:
+            response = await self.get_response(request)
+            spans = timing.current()
+        finally:
+            timing.finish(token)
+        return self.report(request, response, spans, start)
+
+    def report(self, request, response, spans, start):
+        durations = dict(spans.durations)
+
+        stats = instrumentation.current()
+        if stats is not None and stats.queries:
+            durations['db'] = stats.db_time
+        durations['total'] = perf_counter() - start
+
+        if getattr(settings, 'SERVER_TIMING_HEADER', True):
+            response['Server-Timing'] = ', '.join(
+                '%s;dur=%.2f' % (name, seconds * 1000)
+                for name, seconds in durations.items()
+            )
+
+        rate = getattr(settings, 'SERVER_TIMING_LOG_SAMPLE_RATE', 0.0)
+        if rate and random.random() < rate:
+            match = request.resolver_match
+            timing_logger.info(json.dumps({
+                'method': request.method,
+                'route': match.route if match is not None else None,
+                'status': response.status_code,
+                'queries': stats.queries if stats is not None else None,
+                'ms': {
+                    name: round(seconds * 1000, 3)
+                    for name, seconds in durations.items()
+                },
+            }))
+
+        return response
+
+
+class AdmissionControlMiddleware(AsyncCapableMiddleware):
+    """Serve at most MAX_CONCURRENT_REQUESTS requests at once, shedding
+    the excess with 503 after ADMISSION_QUEUE_TIMEOUT"""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.limit = settings.MAX_CONCURRENT_REQUESTS
+        self.exempt = frozenset(settings.ADMISSION_EXEMPT_PATHS)
+        self._slots = threading.BoundedSemaphore(self.limit or 1)
+        # Created on first use, in the event loop serving the requests
+        self._async_slots = None
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.limit or request.path in self.exempt:
+            return self.get_response(request)
+        if not self._slots.acquire(timeout=settings.ADMISSION_QUEUE_TIMEOUT):
+            return self.shed(request)
+        IN_FLIGHT.inc()
+        try:
+            return self.get_response(request)
+        finally:
+            IN_FLIGHT.dec()
+            self._slots.release()
+
+    async def __acall__(self, request):
+        if not self.limit or request.path in self.exempt:
+            return await self.get_response(request)
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.limit)
+        slots = self._async_slots
+        if slots.locked():
+            try:
+                await asyncio.wait_for(
+                    slots.acquire(), settings.ADMISSION_QUEUE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                return self.shed(request)
+        else:
+            await slots.acquire()
+        IN_FLIGHT.inc()
+        try:
+            return await self.get_response(request)
+        finally:
+            IN_FLIGHT.dec()
+            slots.release()
+
+    def shed(self, request):
+        SHED.labels(method_label(request.method)).inc()
+        response = JsonResponse(
+            {'detail': 'Server is at capacity, retry later.'}, status=503
+        )
+        response['Retry-After'] = str(settings.ADMISSION_RETRY_AFTER)
+        return response
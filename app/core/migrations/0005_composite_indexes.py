@@ -0,0 +1,91 @@
+# Generated by Django 3.2.25 on 2026-10-19 08:34
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def drop_user_index(model_name, table, index_name):
+    """Drop the single column user_id index now covered by a composite one"""
+    return migrations.SeparateDatabaseAndState(
+        state_operations=[
+            migrations.AlterField(
+                model_name=model_name,
+                name='user',
+                field=models.ForeignKey(
+                    db_index=False,
+                    on_delete=django.db.models.deletion.CASCADE,
+                    to=settings.AUTH_USER_MODEL,
+                ),
+            ),
+        ],
+        database_operations=[
+            migrations.RunSQL(
+                sql='DROP INDEX CONCURRENTLY IF EXISTS %s' % index_name,
+                reverse_sql='CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (user_id)' % (
+                    index_name, table,
+                ),
+            ),
+        ],
+    )
+
+
+def drop_through_index(table, index_name, column):
+    """Drop a through table's single column index now covered by a
+    composite one"""
+    return migrations.RunSQL(
+        sql='DROP INDEX CONCURRENTLY IF EXISTS %s' % index_name,
+        reverse_sql='CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (%s)' % (
+            index_name, table, column,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction. It doesn't
+    # block writes, but a failed build leaves an INVALID index behind that
+    # has to be dropped before retrying.
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0004_auto_20220814_2104'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='recipe',
+            index=models.Index(fields=['user', '-id'], name='core_recipe_user_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='tag',
+            index=models.Index(fields=['user', '-name'], name='core_tag_user_name_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ingredient',
+            index=models.Index(fields=['user', '-name'], name='core_ingredient_user_name_idx'),
+        ),
+        # The through tables only have a (recipe_id, <other>_id) unique index
+        # and a single column index on the other side; these serve lookups
+        # from a tag or ingredient to its recipes with index-only scans, and
+        # replace the single column indexes.
+        migrations.RunSQL(
+            sql='CREATE INDEX CONCURRENTLY IF NOT EXISTS core_recipe_tags_tag_recipe_idx '
+                'ON core_recipe_tags (tag_id, recipe_id)',
+            reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS core_recipe_tags_tag_recipe_idx',
+        ),
+        migrations.RunSQL(
+            sql='CREATE INDEX CONCURRENTLY IF NOT EXISTS core_recipe_ingredients_ingredient_recipe_idx '
+                'ON core_recipe_ingredients (ingredient_id, recipe_id)',
+            reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS core_recipe_ingredients_ingredient_recipe_idx',
+        ),
+        drop_through_index('core_recipe_tags', 'core_recipe_tags_tag_id_10c0ffea', 'tag_id'),
+        drop_through_index(
+            'core_recipe_ingredients', 'core_recipe_ingredients_ingredient_id_a8fec9ee', 'ingredient_id',
+        ),
+        drop_user_index('recipe', 'core_recipe', 'core_recipe_user_id_04234149'),
+        drop_user_index('tag', 'core_tag', 'core_tag_user_id_1b670500'),
+        drop_user_index('ingredient', 'core_ingredient', 'core_ingredient_user_id_73e97fe3'),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:21
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Every write inserts into the outbox, so the index is built without
+    # blocking them
+    atomic = False
+
+    dependencies = [
+        ('core', '0007_outbox_event'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='outboxevent',
+            index=models.Index(fields=['user', 'id'], name='core_outbox_user_idx'),
+        ),
+    ]
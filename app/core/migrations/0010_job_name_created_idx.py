@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:28
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Built without blocking workers claiming and finishing jobs
+    atomic = False
+
+    dependencies = [
+        ('core', '0009_job'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='job',
+            index=models.Index(fields=['name', 'created_at'], name='core_job_name_created_idx'),
+        ),
+    ]
@@ -0,0 +1,294 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:32
+
+import json
+import unicodedata
+
+import core.models
+from django.conf import settings
+from django.db import migrations, models, transaction
+
+BATCH_SIZE = 1000
+
+# (model, through table, through column)
+RELATIONS = [
+    ('tag', 'core_recipe_tags', 'tag_id'),
+    ('ingredient', 'core_recipe_ingredients', 'ingredient_id'),
+]
+
+
+def normalize_name(name):
+    # core.models.normalize_name as of this migration
+    return ' '.join(unicodedata.normalize('NFKC', name).split()).casefold()
+
+
+def fill(cursor, table):
+    """Set normalized_name where it is missing, in batches; return the
+    ids of the users whose rows were filled"""
+    users = set()
+    last = 0
+    while True:
+        cursor.execute(
+            'SELECT id, user_id, name FROM {} '
+            'WHERE id > %s AND normalized_name IS NULL '
+            'ORDER BY id LIMIT %s'.format(table), [last, BATCH_SIZE],
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return users
+        cursor.execute(
+            'UPDATE {} AS t SET normalized_name = v.name '
+            'FROM unnest(%s::bigint[], %s::text[]) AS v(id, name) '
+            'WHERE t.id = v.id'.format(table),
+            [[pk for pk, _, _ in rows],
+             [normalize_name(name) for _, _, name in rows]],
+        )
+        users.update(user_id for _, user_id, _ in rows)
+        last = rows[-1][0]
+
+
+def batches(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), BATCH_SIZE):
+        yield ids[i:i + BATCH_SIZE]
+
+
+# Links of a source to a recipe that already has its keeper, or an earlier
+# source merging into the same keeper
+DEDUPE_SQL = '''
+    DELETE FROM {through} AS s
+    USING unnest(%(sources)s::bigint[], %(keepers)s::bigint[])
+        AS m(source, keeper)
+    WHERE s.{column} = m.source AND EXISTS (
+        SELECT 1 FROM {through} AS o
+        LEFT JOIN unnest(%(sources)s::bigint[], %(keepers)s::bigint[])
+            AS om(source, keeper) ON om.source = o.{column}
+        WHERE o.recipe_id = s.recipe_id AND (
+            o.{column} = m.keeper OR (om.keeper = m.keeper AND o.id < s.id)
+        )
+    )
+'''
+
+REPOINT_SQL = '''
+    UPDATE {through} AS t SET {column} = m.keeper
+    FROM unnest(%(sources)s::bigint[], %(keepers)s::bigint[])
+        AS m(source, keeper)
+    WHERE t.{column} = m.source
+'''
+
+# Each keeper with the sources merged into it and the recipes they had
+MERGED_SQL = '''
+    SELECT k.id, k.user_id, k.name, array_agg(DISTINCT m.source),
+        array_remove(array_agg(DISTINCT r.recipe_id), NULL)
+    FROM unnest(%(sources)s::bigint[], %(keepers)s::bigint[])
+        AS m(source, keeper)
+    JOIN {table} AS k ON k.id = m.keeper
+    LEFT JOIN {through} AS r ON r.{column} = m.source
+    GROUP BY k.id, k.user_id, k.name
+'''
+
+# core.outbox.PUBLISH_LOCK as of this migration
+PUBLISH_LOCK = 3_737_004
+
+
+def publish_merged(cursor, model_name, merged):
+    """Write a <model>.merged outbox event for each keeper, as
+    core.outbox.publish_many() does as of this migration"""
+    users = sorted({user_id for _, user_id, _, _, _ in merged})
+    cursor.execute(
+        'SELECT pg_advisory_xact_lock(%s, hashtext(user_id::text)) '
+        'FROM unnest(%s::bigint[]) user_id', [PUBLISH_LOCK, users],
+    )
+    topic = '%s.merged' % model_name
+    for pk, user_id, name, sources, recipes in merged:
+        cursor.execute(
+            'INSERT INTO core_outboxevent '
+            '(user_id, topic, payload, created_at, attempts, last_error) '
+            "VALUES (%s, %s, %s, now(), 0, '') RETURNING id",
+            [user_id, topic, json.dumps({
+                'id': pk, 'name': name, 'sources': sorted(sources),
+                'recipes': sorted(recipes),
+            })],
+        )
+        cursor.execute('SELECT pg_notify(%s, %s)', [
+            settings.EVENTS_CHANNEL, json.dumps({
+                'event': cursor.fetchone()[0], 'user': user_id,
+                'topic': topic, 'id': pk,
+            }),
+        ])
+
+
+def merge_duplicates(cursor, users, model_name, table, through, column,
+                     using):
+    """Merge each of the users' rows with the same normalized name into
+    the oldest, in one transaction, publishing the merges so event stream
+    clients drop the merged ids"""
+    with transaction.atomic(using=using):
+        cursor.execute(
+            'SELECT array_agg(id ORDER BY id) FROM {} '
+            'WHERE user_id = ANY(%s) GROUP BY user_id, normalized_name '
+            'HAVING count(*) > 1'.format(table), [users],
+        )
+        groups = [ids for ids, in cursor.fetchall()]
+        params = {
+            'sources': [pk for ids in groups for pk in ids[1:]],
+            'keepers': [ids[0] for ids in groups for _ in ids[1:]],
+        }
+        if not params['sources']:
+            return
+        names = {'table': table, 'through': through, 'column': column}
+        cursor.execute(MERGED_SQL.format(**names), params)
+        publish_merged(cursor, model_name, cursor.fetchall())
+        # Rebuilt on the next list or check_recipe_cards --repair
+        cursor.execute(
+            'UPDATE core_recipe SET card = NULL WHERE id IN ('
+            'SELECT recipe_id FROM {} WHERE {} = ANY(%(sources)s))'
+            .format(through, column), params,
+        )
+        cursor.execute(DEDUPE_SQL.format(**names), params)
+        cursor.execute(REPOINT_SQL.format(**names), params)
+        cursor.execute(
+            'DELETE FROM {} WHERE id = ANY(%(sources)s)'.format(table),
+            params,
+        )
+
+
+def normalize(apps, schema_editor):
+    users_table = apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        for model_name, through, column in RELATIONS:
+            table = apps.get_model('core', model_name)._meta.db_table
+            fill(cursor, table)
+            last = 0
+            while True:
+                cursor.execute(
+                    'SELECT id FROM {} WHERE id > %s ORDER BY id LIMIT %s'
+                    .format(users_table), [last, BATCH_SIZE],
+                )
+                users = [pk for pk, in cursor.fetchall()]
+                if not users:
+                    break
+                merge_duplicates(
+                    cursor, users, model_name, table, through, column,
+                    schema_editor.connection.alias,
+                )
+                last = users[-1]
+
+
+def set_not_null(apps, schema_editor):
+    """Make normalized_name NOT NULL without scanning the table under an
+    ACCESS EXCLUSIVE lock: a NOT VALID check refuses new NULLs, the rows
+    added since the fill by code that didn't set the column are filled,
+    and merged into any they duplicate, and once the check is validated,
+    which doesn't block writes, SET NOT NULL relies on it instead of
+    scanning"""
+    with schema_editor.connection.cursor() as cursor:
+        for model_name, through, column in RELATIONS:
+            table = apps.get_model('core', model_name)._meta.db_table
+            names = {
+                'table': table, 'check': '%s_normalized_name_not_null' % table,
+            }
+            cursor.execute(
+                'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {check}'
+                .format(**names)
+            )
+            cursor.execute(
+                'ALTER TABLE {table} ADD CONSTRAINT {check} '
+                'CHECK (normalized_name IS NOT NULL) NOT VALID'.format(**names)
+            )
+            # Which may have added duplicates
+            for users in batches(fill(cursor, table)):
+                merge_duplicates(
+                    cursor, users, model_name, table, through, column,
+                    schema_editor.connection.alias,
+                )
+            cursor.execute(
+                'ALTER TABLE {table} VALIDATE CONSTRAINT {check}'
+                .format(**names)
+            )
+            cursor.execute(
+                'ALTER TABLE {table} ALTER COLUMN normalized_name SET NOT NULL'
+                .format(**names)
+            )
+            cursor.execute(
+                'ALTER TABLE {table} DROP CONSTRAINT {check}'.format(**names)
+            )
+
+
+def drop_not_null(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for model_name, _, _ in RELATIONS:
+            cursor.execute(
+                'ALTER TABLE %s ALTER COLUMN normalized_name DROP NOT NULL'
+                % apps.get_model('core', model_name)._meta.db_table
+            )
+
+
+def unique_index(model_name, table):
+    """Add the (user, normalized_name) unique constraint from an index
+    built without blocking writes"""
+    name = '%s_user_normalized_name_uniq' % table
+    return migrations.SeparateDatabaseAndState(
+        state_operations=[
+            migrations.AddConstraint(
+                model_name=model_name,
+                constraint=models.UniqueConstraint(fields=('user', 'normalized_name'), name=name),
+            ),
+        ],
+        database_operations=[
+            migrations.RunSQL(
+                sql='CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s (user_id, normalized_name)' % (
+                    name, table,
+                ),
+                reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS %s' % name,
+            ),
+            migrations.RunSQL(
+                sql='ALTER TABLE %s ADD CONSTRAINT %s UNIQUE USING INDEX %s' % (table, name, name),
+                reverse_sql='ALTER TABLE %s DROP CONSTRAINT %s' % (table, name),
+            ),
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+
+    # The duplicates are merged in a transaction per batch of users, the
+    # column made NOT NULL and the unique indexes built without long locks
+    atomic = False
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0010_job_name_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='normalized_name',
+            field=core.models.NormalizedNameField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='normalized_name',
+            field=core.models.NormalizedNameField(editable=False, null=True),
+        ),
+        migrations.RunPython(normalize, migrations.RunPython.noop),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='tag',
+                    name='normalized_name',
+                    field=core.models.NormalizedNameField(editable=False),
+                ),
+                migrations.AlterField(
+                    model_name='ingredient',
+                    name='normalized_name',
+                    field=core.models.NormalizedNameField(editable=False),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(set_not_null, drop_not_null),
+            ],
+        ),
+        unique_index('tag', 'core_tag'),
+        unique_index('ingredient', 'core_ingredient'),
+    ]
@@ -2,9 +2,12 @@
 Database Models
 """
 
+import unicodedata
+
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.conf import settings
+from django.utils import timezone
 # Create your models here.
 
 class UserManager(BaseUserManager):
@@ -46,7 +49,8 @@ class Recipe(models.Model):
     """Recipe Objects"""
 
     ## Reference AUTH_USER_MODEL as best practice so if User model is changed then changes are cascaded across
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    ## No single column index: core_recipe_user_id_idx starts with user
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
     title = models.CharField(max_length=255)
     description = models.TextField(blank = True)
     time_minutes = models.IntegerField()
@@ -54,16 +58,59 @@ class Recipe(models.Model):
     link = models.CharField(max_length=255, blank = True)
     tags = models.ManyToManyField('Tag')
     ingredients = models.ManyToManyField('Ingredient')
+    ## List representation kept by recipe.cards; null until built
+    card = models.JSONField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ## Matches RecipeViewSet: filter by user, newest first
+        indexes = [
+            models.Index(fields=['user', '-id'], name='core_recipe_user_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
 
+## A B-tree index entry holds at most 2704 bytes
+NORMALIZED_NAME_MAX_BYTES = 2000
+
+
+def normalize_name(name):
+    """Return the form of a tag or ingredient name compared for duplicates"""
+    return ' '.join(unicodedata.normalize('NFKC', name).split()).casefold()
+
+
+class NormalizedNameField(models.TextField):
+    """normalize_name() of the model's name, set whenever it is saved;
+    text, as normalizing can lengthen a name ('ß' becomes 'ss')"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs['editable'] = False
+        super().__init__(*args, **kwargs)
+
+    def pre_save(self, model_instance, add):
+        value = normalize_name(model_instance.name)
+        setattr(model_instance, self.attname, value)
+        return value
+
+
 class Tag(models.Model):
     """TAG for filtering recipes"""
 
     name = models.CharField(max_length=255)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    ## "Vegan" and "vegan " are the same tag
+    normalized_name = NormalizedNameField()
+    ## Indexed by the (user, -name) index below
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        ## Matches TagViewSet: filter by user, ordered by -name
+        indexes = [
+            models.Index(fields=['user', '-name'], name='core_tag_user_name_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'normalized_name'], name='core_tag_user_normalized_name_uniq'),
+        ]
 
     def __str__(self):
         return self.name
@@ -71,15 +118,99 @@ class Tag(models.Model):
 class Ingredient(models.Model):
     """Ingredient for Recipes"""
     name = models.CharField(max_length=255)
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    normalized_name = NormalizedNameField()
+    ## Indexed by the (user, -name) index below
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+
+    class Meta:
+        ## Matches IngredientViewSet: filter by user, ordered by -name
+        indexes = [
+            models.Index(fields=['user', '-name'], name='core_ingredient_user_name_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'normalized_name'], name='core_ingredient_user_normalized_name_uniq'),
+        ]
 
     def __str__(self):
         return self.name
 
+class OutboxEvent(models.Model):
+    """Change event written with the change, delivered by deliver_outbox"""
+
+    ## No index of its own: the indexes below start with user
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, db_index=False)
+    topic = models.CharField(max_length=64)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    ## Given up on after OUTBOX_MAX_ATTEMPTS, so later events can go out
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ## Matches deliver_outbox: a user's pending events in order
+        indexes = [
+            models.Index(
+                fields=['user', 'id'], name='core_outbox_pending_idx',
+                condition=models.Q(delivered_at__isnull=True, failed_at__isnull=True),
+            ),
+            ## Matches the event stream replaying a user's events after one
+            models.Index(fields=['user', 'id'], name='core_outbox_user_idx'),
+        ]
 
+    def __str__(self):
+        return '%s #%s' % (self.topic, self.pk)
+
+
+class Job(models.Model):
+    """Background job run by `manage.py run_worker`"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100)
+    queue = models.CharField(max_length=50, default='default')
+    ## Who may see the job's status, if anyone
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True)
+    args = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    ## The worker running the job, until its lease runs out
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            ## Matches claiming due jobs; finished jobs aren't indexed
+            models.Index(
+                fields=['queue', 'run_after', 'id'], name='core_job_queued_idx',
+                condition=models.Q(status='queued'),
+            ),
+            ## Matches checking when a periodic job was last queued
+            models.Index(fields=['name', 'created_at'], name='core_job_name_created_idx'),
+            ## Matches requeueing jobs whose worker went away
+            models.Index(
+                fields=['locked_until'], name='core_job_running_idx',
+                condition=models.Q(status='running'),
+            ),
+        ]
 
-
-
-
-
-
+    def __str__(self):
+        return '%s #%s' % (self.name, self.pk)
@@ -0,0 +1,228 @@
+"""
+Transactional outbox of change events.
+
+publish() inserts an OutboxEvent in the transaction making the change, so
+an event exists exactly when its change committed. `manage.py
+deliver_outbox` POSTs pending events to OUTBOX_WEBHOOK_URLS in batches of
+one user's events, oldest first. A user's events go out in order: ids
+are taken at insert rather than commit, so publish() holds a per-user
+advisory lock until the transaction ends, making a user's ids follow
+commit order; one worker at a time holds the user's delivery lock; and a
+failed batch holds back that user's later events until it is retried,
+with exponential backoff, or given up on after OUTBOX_MAX_ATTEMPTS.
+Delivery is at least once; receivers deduplicate by event id.
+
+Each event is also announced with NOTIFY on EVENTS_CHANNEL, which
+PostgreSQL only delivers once the transaction commits; core.events streams
+those to the user's clients.
+"""
+
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import random
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from core import metrics
+from core.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Advisory locks take two int4 keys, so a (bigint) user id is passed as
+# hashtext(user_id::text); users sharing a hash just share a lock.
+# pg_advisory_lock(OUTBOX_LOCK, hash) serializes delivery per user
+OUTBOX_LOCK = 3_737_002
+# pg_advisory_xact_lock(PUBLISH_LOCK, hash) serializes publishing per
+# user, from the insert to the commit
+PUBLISH_LOCK = 3_737_004
+
+DELIVERED = metrics.Counter(
+    'outbox_events_delivered_total', 'Outbox events delivered',
+)
+FAILURES = metrics.Counter(
+    'outbox_delivery_failures_total', 'Outbox batches that failed to deliver',
+)
+LAG = metrics.Histogram(
+    'outbox_delivery_lag_seconds',
+    'Time from writing an event to delivering it',
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600),
+)
+
+
+def publish(user_id, topic, payload):
+    """Record an event in the current transaction"""
+    return publish_many([(user_id, topic, payload)])[0]
+
+
+def publish_many(events):
+    """Record (user id, topic, payload) events in the current transaction"""
+    if not events:
+        return []
+    # Sorted, so transactions publishing for several users can't deadlock
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(%s, hashtext(user_id::text)) '
+            'FROM unnest(%s::bigint[]) user_id',
+            [PUBLISH_LOCK, sorted({user_id for user_id, _, _ in events})],
+        )
+    created = OutboxEvent.objects.bulk_create([
+        OutboxEvent(
+            user_id=user_id, topic=topic,
+            # Stored as JSON, so Decimals and dates need encoding first
+            payload=json.loads(json.dumps(payload, cls=DjangoJSONEncoder)),
+        )
+        for user_id, topic, payload in events
+    ])
+    # NOTIFY payloads are limited to 8000 bytes, so listeners get a summary
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_notify(%s, summary) FROM unnest(%s::text[]) summary',
+            [settings.EVENTS_CHANNEL, [
+                json.dumps(summary(event)) for event in created
+            ]],
+        )
+    return created
+
+
+def summary(event):
+    """Return what the event stream sends of an event"""
+    return {
+        'event': event.pk,
+        'user': event.user_id,
+        'topic': event.topic,
+        'id': event.payload.get('id'),
+    }
+
+
+def pending():
+    return OutboxEvent.objects.filter(
+        delivered_at__isnull=True, failed_at__isnull=True
+    )
+
+
+def users_due(limit):
+    """Return ids of users whose oldest pending event is due, those
+    waiting longest first"""
+    heads = pending().order_by('user_id', 'id').distinct('user_id')
+    return list(OutboxEvent.objects.filter(
+        Q(next_attempt_at__isnull=True) |
+        Q(next_attempt_at__lte=timezone.now()),
+        pk__in=heads.values('pk'),
+    ).order_by('pk').values_list('user_id', flat=True)[:limit])
+
+
+def backoff(attempts):
+    """Seconds to wait before the next attempt, with full jitter"""
+    return random.uniform(0, min(
+        settings.OUTBOX_MAX_BACKOFF,
+        settings.OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1),
+    ))
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+    })
+    if settings.OUTBOX_WEBHOOK_SECRET:
+        request.add_header('X-Outbox-Signature', 'sha256=' + hmac.new(
+            settings.OUTBOX_WEBHOOK_SECRET.encode(), body, hashlib.sha256
+        ).hexdigest())
+    with urllib.request.urlopen(
+        request, timeout=settings.OUTBOX_WEBHOOK_TIMEOUT
+    ) as response:
+        response.read()
+
+
+def deliver_user(user_id, batch_size):
+    """Deliver the user's next batch of events, unless another worker is;
+    return the number delivered"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_try_advisory_lock(%s, hashtext(%s::text))',
+            [OUTBOX_LOCK, user_id],
+        )
+        if not cursor.fetchone()[0]:
+            return 0
+    try:
+        events = list(
+            pending().filter(user_id=user_id).order_by('id')[:batch_size]
+        )
+        now = timezone.now()
+        # Rechecked under the lock: another worker may have just failed it
+        if not events or (events[0].next_attempt_at or now) > now:
+            return 0
+        return send(events)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_advisory_unlock(%s, hashtext(%s::text))',
+                [OUTBOX_LOCK, user_id],
+            )
+
+
+def send(events):
+    body = json.dumps({'events': [{
+        'id': event.pk,
+        'topic': event.topic,
+        'user': event.user_id,
+        'created_at': event.created_at,
+        'payload': event.payload,
+    } for event in events]}, cls=DjangoJSONEncoder).encode()
+    try:
+        for url in settings.OUTBOX_WEBHOOK_URLS:
+            post(url, body)
+    except (OSError, http.client.HTTPException) as e:
+        FAILURES.inc()
+        fail(events[0], e)
+        return 0
+
+    now = timezone.now()
+    pending().filter(pk__in=[event.pk for event in events]).update(
+        delivered_at=now
+    )
+    DELIVERED.inc(len(events))
+    for event in events:
+        LAG.observe((now - event.created_at).total_seconds())
+    return len(events)
+
+
+def fail(head, error):
+    """Schedule the batch's first event for a retry, or give up on it"""
+    attempts = head.attempts + 1
+    now = timezone.now()
+    changes = {'attempts': attempts, 'last_error': str(error)[:1000]}
+    if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        changes['failed_at'] = now
+        logger.error(
+            'Giving up on outbox event %s after %d attempts: %s',
+            head.pk, attempts, error,
+        )
+    else:
+        changes['next_attempt_at'] = now + timedelta(seconds=backoff(attempts))
+    OutboxEvent.objects.filter(pk=head.pk).update(**changes)
+
+
+def deliver(batch_size, max_users):
+    """Deliver one batch for each user with due events; return the
+    number of events delivered"""
+    return sum(
+        deliver_user(user_id, batch_size)
+        for user_id in users_due(max_users)
+    )
+
+
+def prune(days):
+    """Delete events delivered or given up on more than days ago"""
+    cutoff = timezone.now() - timedelta(days=days)
+    return OutboxEvent.objects.filter(
+        Q(delivered_at__lt=cutoff) | Q(failed_at__lt=cutoff)
+    ).delete()[0]
@@ -0,0 +1,142 @@
+"""
+Tests for the batch endpoint
+"""
+
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag
+from recipe import views
+
+BATCH_URL = reverse('batch')
+
+
+class BatchApiTests(TestCase):
+    """Test running several requests in one"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass123', name='Test'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token.key)
+        Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=30,
+            price=Decimal('2.50'),
+        )
+        Tag.objects.create(user=self.user, name='Hot')
+
+    def test_launch_requests(self):
+        """Test the app launch reads come back together, in order"""
+        res = self.client.post(BATCH_URL, {'requests': [
+            {'path': '/api/recipe/recipes/'},
+            {'path': '/api/recipe/tags/'},
+            {'path': '/api/recipe/ingredients/'},
+            {'path': '/api/user/me/'},
+        ]}, format='json')
+
+        self.assertEqual(res.status_code, 200)
+        responses = res.json()['responses']
+        self.assertEqual([r['status'] for r in responses], [200] * 4)
+        self.assertEqual(responses[0]['body'][0]['title'], 'Curry')
+        self.assertEqual(responses[1]['body'][0]['name'], 'Hot')
+        self.assertEqual(responses[2]['body'], [])
+        self.assertEqual(responses[3]['body']['email'], 'test@example.com')
+
+    def test_authenticates_once(self):
+        """Test sub-requests reuse the batch's authentication"""
+        with patch(
+            'rest_framework.authentication.TokenAuthentication'
+            '.authenticate_credentials',
+            wraps=lambda key: (self.user, self.token),
+        ) as authenticate:
+            self.client.post(BATCH_URL, {'requests': [
+                {'path': '/api/recipe/tags/'},
+                {'path': '/api/user/me/'},
+            ]}, format='json')
+
+        self.assertEqual(authenticate.call_count, 1)
+
+    def test_writes_and_errors(self):
+        """Test writes go through and errors are reported per request"""
+        res = self.client.post(BATCH_URL, {'requests': [
+            {'method': 'POST', 'path': '/api/recipe/recipes/', 'body': {
+                'title': 'Soup', 'time_minutes': 10, 'price': '1.00',
+            }},
+            {'path': '/api/recipe/recipes/?tags=999'},
+            {'path': '/api/recipe/nothing/'},
+            {'method': 'PATCH', 'path': '/api/user/me/', 'body': {
+                'name': '',
+            }},
+        ]}, format='json')
+
+        statuses = [r['status'] for r in res.json()['responses']]
+        self.assertEqual(statuses, [201, 200, 404, 400])
+        self.assertTrue(Recipe.objects.filter(title='Soup').exists())
+
+    def test_requires_authentication(self):
+        """Test anonymous batches are refused"""
+        res = APIClient().post(
+            BATCH_URL, {'requests': [{'path': '/api/user/me/'}]},
+            format='json',
+        )
+
+        self.assertEqual(res.status_code, 401)
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_invalid_batches(self):
+        """Test limits on what a batch may hold"""
+        too_many = [{'path': '/api/recipe/tags/'}] * 3
+        nested = [{'path': '/api/batch/'}]
+        write = [{'method': 'DELETE', 'path': '/api/recipe/tags/1/'}]
+
+        for requests, snapshot in [
+            (too_many, False), (nested, False), ([], False), (write, True),
+        ]:
+            res = self.client.post(
+                BATCH_URL, {'requests': requests, 'snapshot': snapshot},
+                format='json',
+            )
+            self.assertEqual(res.status_code, 400, requests)
+
+
+class SnapshotBatchTests(TransactionTestCase):
+    """Test snapshot batches run in one read-only transaction"""
+
+    def test_reads_share_a_snapshot(self):
+        """Test every read runs in one repeatable read transaction"""
+        user = get_user_model().objects.create_user(
+            'test@example.com', 'testpass123'
+        )
+        client = APIClient()
+        client.force_authenticate(user)
+        seen = []
+
+        def get_queryset(view):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT current_setting(%s), current_setting(%s), '
+                    'txid_current_if_assigned(), now()',
+                    ['transaction_isolation', 'transaction_read_only'],
+                )
+                seen.append(cursor.fetchone())
+            return Tag.objects.filter(user=view.request.user)
+
+        with patch.object(views.TagViewSet, 'get_queryset', get_queryset):
+            res = client.post(BATCH_URL, {'snapshot': True, 'requests': [
+                {'path': '/api/recipe/tags/'},
+                {'path': '/api/recipe/tags/'},
+            ]}, format='json')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(seen[0][:2], ('repeatable read', 'on'))
+        # now() is the transaction's start time
+        self.assertEqual(seen[0], seen[1])
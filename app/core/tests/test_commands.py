@@ -2,11 +2,20 @@
 Test Custom Django Management Commands
 """
 
+import csv
+import os
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
 from unittest.mock import patch
 from psycopg2 import OperationalError as Psycopg2Error
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase
+from rest_framework.authtoken.models import Token
 
 @patch('core.management.commands.wait_for_db.Command.check')
 class CommandTests(SimpleTestCase):
@@ -30,3 +39,190 @@ class CommandTests(SimpleTestCase):
         patched_check.assert_called_with(databases=['default'])
 
 
+class LoadTestCommandTests(SimpleTestCase):
+    """Test the loadtest command"""
+
+    def test_reports_latency(self):
+        """Test requests are sent and summarised"""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), OkHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        out = StringIO()
+        try:
+            call_command(
+                'loadtest', 'http://127.0.0.1:%d/' % server.server_port,
+                requests=5, concurrency=2, slow=0.01, stdout=out,
+            )
+        finally:
+            server.shutdown()
+
+        self.assertIn('Requests: 5', out.getvalue())
+        self.assertIn('Statuses: 200=5', out.getvalue())
+        self.assertIn('p99', out.getvalue())
+
+
+class ImportBudgetCommandTests(SimpleTestCase):
+    """Test the import_budget command"""
+
+    def test_reports_our_modules(self):
+        """Test startup imports are listed and tkinter is not among them"""
+        out = StringIO()
+
+        call_command('import_budget', budget_ms=60000, stdout=out)
+
+        self.assertIn('recipe.serializers', out.getvalue())
+        self.assertNotIn('tkinter', out.getvalue())
+        self.assertIn('Within budget.', out.getvalue())
+
+    def test_over_budget(self):
+        """Test the command fails when a module is over its budget"""
+        with self.assertRaises(CommandError):
+            call_command(
+                'import_budget', 'app.wsgi', module_budget_ms=0,
+                stdout=StringIO(),
+            )
+
+
+@patch('core.management.commands.boot.call_command')
+class BootCommandTests(TestCase):
+    """Test the boot command"""
+
+    def test_migrations_skipped_when_current(self, patched_call):
+        """Test migrate is not run when every migration is applied"""
+        out = StringIO()
+
+        call_command('boot', stdout=out)
+
+        patched_call.assert_not_called()
+        self.assertIn('Boot: db', out.getvalue())
+
+    @patch('core.management.commands.boot.disk_migrations')
+    def test_migrates_when_pending(self, patched_disk, patched_call):
+        """Test migrate runs when a migration file is not applied"""
+        patched_disk.return_value = {('core', '9999_pending')}
+
+        call_command('boot', stdout=StringIO())
+
+        patched_call.assert_called_once()
+        self.assertEqual(patched_call.call_args[0], ('migrate',))
+
+    @patch('time.sleep')
+    @patch('core.management.commands.boot.Command.probe')
+    def test_backoff(self, patched_probe, patched_sleep, patched_call):
+        """Test failed probes are retried with growing, jittered delays"""
+        patched_probe.side_effect = [Psycopg2Error] * 4 + [None]
+
+        call_command(
+            'boot', initial_delay=1, max_delay=4, stdout=StringIO()
+        )
+
+        self.assertEqual(patched_probe.call_count, 5)
+        delays = [c[0][0] for c in patched_sleep.call_args_list]
+        for delay, cap in zip(delays, [1, 2, 4, 4]):
+            self.assertLessEqual(delay, cap)
+
+    @patch('core.management.commands.boot.Command.probe')
+    def test_timeout(self, patched_probe, patched_call):
+        """Test boot gives up after the overall timeout"""
+        patched_probe.side_effect = Psycopg2Error
+
+        with self.assertRaises(CommandError):
+            call_command('boot', timeout=0, stdout=StringIO())
+
+
+class OkHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+class BenchHashersCommandTests(SimpleTestCase):
+    """Test the bench_hashers command"""
+
+    def test_reports_throughput(self):
+        """Test each profile gets a cost and a throughput"""
+        out = StringIO()
+
+        call_command(
+            'bench_hashers', 'scrypt', 'pbkdf2', threads=[1, 2],
+            seconds=0.1, stdout=out,
+        )
+
+        lines = out.getvalue().splitlines()
+        self.assertIn('2 thr/s', lines[0])
+        self.assertEqual([line.split()[0] for line in lines[1:]],
+                         ['scrypt', 'pbkdf2'])
+
+    def test_unknown_profile(self):
+        """Test profiles must be configured"""
+        with self.assertRaises(CommandError):
+            call_command('bench_hashers', 'md5', stdout=StringIO())
+
+
+class ImportUsersCommandTests(TestCase):
+    """Test the import_users command"""
+
+    def write(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as f:
+            f.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_csv(self):
+        """Test users are created with hashed passwords and tokens"""
+        path = self.write('.csv', (
+            'email,name,password\n'
+            'Ann@EXAMPLE.com ,Ann,annpass123\n'
+            'bob@example.com,Bob,\n'
+            'not-an-email,Nobody,x\n'
+            'Ann@Example.COM,Ann again,other\n'
+        ))
+        tokens = self.write('.csv', '')
+        out, err = StringIO(), StringIO()
+
+        call_command(
+            'import_users', path, workers=2, batch_size=1, tokens=tokens,
+            stdout=out, stderr=err,
+        )
+
+        User = get_user_model()
+        ann = User.objects.get(email='Ann@example.com')
+        self.assertTrue(ann.check_password('annpass123'))
+        self.assertFalse(
+            User.objects.get(email='bob@example.com').has_usable_password()
+        )
+        self.assertEqual(User.objects.count(), 2)
+        self.assertIn('Created 2 users', out.getvalue())
+        self.assertIn('users/s', out.getvalue())
+        self.assertIn("invalid email 'not-an-email'", err.getvalue())
+        with open(tokens) as f:
+            issued = dict(csv.reader(f))
+        self.assertEqual(
+            issued['Ann@example.com'], Token.objects.get(user=ann).key
+        )
+
+    def test_import_ndjson_skips_existing(self):
+        """Test existing users are left alone"""
+        get_user_model().objects.create_user('old@example.com', 'oldpass')
+        path = self.write('.ndjson', (
+            '{"email": "old@example.com", "password": "newpass"}\n'
+            '\n'
+            '{"email": "new@example.com", "name": "New"}\n'
+        ))
+        err = StringIO()
+
+        call_command(
+            'import_users', path, workers=0, stdout=StringIO(), stderr=err,
+        )
+
+        old = get_user_model().objects.get(email='old@example.com')
+        self.assertTrue(old.check_password('oldpass'))
+        self.assertTrue(
+            get_user_model().objects.filter(name='New').exists()
+        )
+        self.assertIn('old@example.com already exists', err.getvalue())
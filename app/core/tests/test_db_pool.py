@@ -0,0 +1,171 @@
+"""
+Tests for the database connection pool
+"""
+
+import threading
+from unittest.mock import patch
+
+import psycopg2
+from psycopg2 import extensions
+from django.db import connections
+from django.test import SimpleTestCase, TestCase
+
+from core.db import pool
+
+
+class FakeConnection:
+    """Stand-in for a psycopg2 connection"""
+
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.healthy = True
+        self.rolled_back = False
+        self.info = type('Info', (), {})()
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def execute(self, sql):
+                if not connection.healthy:
+                    raise psycopg2.OperationalError('server closed')
+
+        return Cursor()
+
+    def rollback(self):
+        self.rolled_back = True
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    """Test pool checkout and return"""
+
+    def make_pool(self, **kwargs):
+        self.opened = []
+
+        def connect():
+            connection = FakeConnection()
+            self.opened.append(connection)
+            return connection
+
+        return pool.ConnectionPool(connect, alias='test', **kwargs)
+
+    def test_connection_reused(self):
+        """Test a returned connection is handed out again"""
+        p = self.make_pool()
+
+        first = p.getconn()
+        p.putconn(first)
+        second = p.getconn()
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_prefill(self):
+        """Test prefill opens min_size connections"""
+        p = self.make_pool(min_size=3)
+
+        p.prefill()
+
+        self.assertEqual(p.size, 3)
+        self.assertEqual(p.idle, 3)
+
+    def test_timeout_when_exhausted(self):
+        """Test checkout gives up when max_size connections are in use"""
+        p = self.make_pool(max_size=1, timeout=0.01)
+        p.getconn()
+
+        with self.assertRaises(pool.PoolTimeout):
+            p.getconn()
+
+    def test_waiter_gets_returned_connection(self):
+        """Test a waiting checkout gets a connection when one is returned"""
+        p = self.make_pool(max_size=1, timeout=5)
+        connection = p.getconn()
+        timer = threading.Timer(0.05, p.putconn, [connection])
+        timer.start()
+
+        self.assertIs(p.getconn(), connection)
+        timer.join()
+
+    def test_open_transaction_rolled_back(self):
+        """Test a connection returned mid-transaction is rolled back"""
+        p = self.make_pool()
+        connection = p.getconn()
+        connection.info.transaction_status = \
+            extensions.TRANSACTION_STATUS_INTRANS
+
+        p.putconn(connection)
+
+        self.assertTrue(connection.rolled_back)
+        self.assertEqual(p.idle, 1)
+
+    def test_closed_connection_discarded(self):
+        """Test a connection closed by the server is not pooled"""
+        p = self.make_pool()
+        connection = p.getconn()
+        connection.closed = 2
+
+        p.putconn(connection)
+
+        self.assertEqual(p.size, 0)
+
+    def test_unhealthy_connection_replaced(self):
+        """Test a connection failing its health check is replaced"""
+        p = self.make_pool(check_interval=0)
+        connection = p.getconn()
+        p.putconn(connection)
+        connection.healthy = False
+
+        replacement = p.getconn()
+
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(p.size, 1)
+
+    @patch('core.db.pool.monotonic')
+    def test_max_lifetime(self, patched_monotonic):
+        """Test connections older than max_lifetime are closed"""
+        patched_monotonic.return_value = 0
+        p = self.make_pool(max_lifetime=60)
+        connection = p.getconn()
+        patched_monotonic.return_value = 61
+
+        p.putconn(connection)
+
+        self.assertTrue(connection.closed)
+        self.assertEqual(p.size, 0)
+
+
+class PooledBackendTests(TestCase):
+    """Test the backend returns connections to the pool on close"""
+
+    def test_close_returns_connection(self):
+        """Test reconnecting reuses the same server connection"""
+        wrapper = connections.create_connection('default')
+        try:
+            wrapper.ensure_connection()
+            first = wrapper.connection
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                pid = cursor.fetchone()[0]
+            wrapper.close()
+
+            wrapper.ensure_connection()
+            with wrapper.cursor() as cursor:
+                cursor.execute('SELECT pg_backend_pid()')
+                self.assertEqual(cursor.fetchone()[0], pid)
+            self.assertIs(wrapper.connection, first)
+        finally:
+            wrapper.close()
@@ -0,0 +1,167 @@
+"""
+Tests for primary/replica routing
+"""
+
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import checks
+from core.db import routers
+from core.models import Recipe
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'])
+class RouterTests(SimpleTestCase):
+    """Test router decisions"""
+
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+
+    def test_reads_use_primary_by_default(self):
+        """Test reads outside replica_reads() use the default database"""
+        self.assertIsNone(self.router.db_for_read(Recipe))
+
+    def test_replica_reads(self):
+        """Test reads inside replica_reads() go to a replica"""
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Recipe), 'replica_0')
+            with routers.primary():
+                self.assertIsNone(self.router.db_for_read(Recipe))
+
+    def test_primary_only_overrides_replica_reads(self):
+        """Test replica reads opened inside primary_only() use the primary"""
+        with routers.primary_only():
+            with routers.replica_reads():
+                self.assertIsNone(self.router.db_for_read(Recipe))
+
+    def test_writes_use_primary(self):
+        """Test writes always go to the primary"""
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_write(Recipe), 'default')
+
+    def test_replicas_not_migrated(self):
+        """Test migrations never run on replicas"""
+        self.assertFalse(self.router.allow_migrate('replica_0', 'core'))
+        self.assertIsNone(self.router.allow_migrate('default', 'core'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], REPLICA_PIN_SECONDS=60)
+@patch(
+    'core.db.routers.PrimaryReplicaRouter.choose_replica',
+    return_value='default',
+)
+class ReplicaViewTests(TestCase):
+    """Test viewsets read from a (simulated) replica"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, client):
+        payload = {
+            'title': 'Curry',
+            'time_minutes': 30,
+            'price': Decimal('2.50'),
+        }
+        res = client.post(RECIPES_URL, payload)
+        self.assertEqual(res.status_code, 201)
+        return res
+
+    def test_list_reads_from_replica(self, patched_choose):
+        """Test a plain GET is routed to the replica"""
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, 200)
+        patched_choose.assert_called()
+
+    def test_write_uses_primary_and_pins(self, patched_choose):
+        """Test a write is not routed to the replica and sets the pin"""
+        res = self.create_recipe(self.client)
+
+        patched_choose.assert_not_called()
+        self.assertIn(routers.PIN_COOKIE, res.cookies)
+
+    def test_read_after_write_pinned_by_cookie(self, patched_choose):
+        """Test the client's next reads stay on the primary"""
+        self.create_recipe(self.client)
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(res.data), 1)
+        patched_choose.assert_not_called()
+
+    def test_read_after_write_pinned_by_cache(self, patched_choose):
+        """Test clients that drop cookies are pinned by user"""
+        self.create_recipe(self.client)
+        other_client = APIClient()
+        other_client.force_authenticate(self.user)
+
+        other_client.get(RECIPES_URL)
+
+        patched_choose.assert_not_called()
+
+    def test_refused_write_does_not_pin(self, patched_choose):
+        """Test a write answered with an error leaves reads on replicas"""
+        res = self.client.post(RECIPES_URL, {'title': 'Curry'})
+
+        self.assertEqual(res.status_code, 400)
+        self.assertNotIn(routers.PIN_COOKIE, res.cookies)
+        self.client.get(RECIPES_URL)
+        patched_choose.assert_called()
+
+    def test_other_users_not_pinned(self, patched_choose):
+        """Test one user's write does not pin everyone"""
+        self.create_recipe(self.client)
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'testpass123',
+        )
+        other_client = APIClient()
+        other_client.force_authenticate(other)
+
+        other_client.get(RECIPES_URL)
+
+        patched_choose.assert_called()
+
+
+class PinCacheCheckTests(SimpleTestCase):
+    """Test replicas are refused without a shared cache for pins"""
+
+    @override_settings(DATABASE_REPLICAS=['replica_0'], CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    })
+    def test_process_local_cache_refused(self):
+        """Test a per-process cache is an error with replicas"""
+        errors = checks.check_replica_pin_cache(None)
+
+        self.assertEqual([error.id for error in errors], ['core.E001'])
+
+    @override_settings(DATABASE_REPLICAS=['replica_0'], CACHES={
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': 'memcached:11211',
+        },
+    })
+    def test_shared_cache_accepted(self):
+        """Test memcached passes"""
+        self.assertEqual(checks.check_replica_pin_cache(None), [])
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        """Test any cache will do without replicas"""
+        self.assertEqual(checks.check_replica_pin_cache(None), [])
@@ -0,0 +1,108 @@
+"""
+Tests for per-view statement and lock timeouts
+"""
+
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, connection
+from django.test import TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.db import timeouts
+from core.models import Recipe, Tag
+from recipe import views
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def show(name):
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW %s' % name)
+        return cursor.fetchone()[0]
+
+
+class LimitsTests(TransactionTestCase):
+    """Test timeouts applied to connections"""
+
+    def test_set_inside_and_reset_after(self):
+        """Test the timeouts only apply inside the block"""
+        with timeouts.limits(1500, 200):
+            inside = show('statement_timeout'), show('lock_timeout')
+        after = show('statement_timeout'), show('lock_timeout')
+
+        self.assertEqual(inside, ('1500ms', '200ms'))
+        self.assertEqual(after, ('0', '0'))
+
+    def test_statement_timeout_translated(self):
+        """Test a cancelled query becomes a 504 error and is counted"""
+        counter = timeouts.TIMEOUTS.labels('test', 'statement')
+        before = counter.collect()[0]
+
+        with self.assertRaises(OperationalError) as cm:
+            with timeouts.limits(50):
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_sleep(1)')
+        exc = timeouts.translate(cm.exception, 'test')
+
+        self.assertIsInstance(exc, timeouts.QueryTimeout)
+        self.assertEqual(exc.status_code, 504)
+        self.assertEqual(counter.collect()[0], before + 1)
+
+    def test_other_errors_untouched(self):
+        """Test errors other than timeouts are returned as they are"""
+        exc = ValueError()
+
+        self.assertIs(timeouts.translate(exc, 'test'), exc)
+
+
+class TimeoutApiTests(TransactionTestCase):
+    """Test timeouts on the API"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com', 'testpass'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @override_settings(
+        DB_VIEW_TIMEOUTS={'RecipeViewSet': {'statement_timeout': 50}}
+    )
+    def test_slow_query_returns_504(self):
+        """Test a view over its statement timeout answers 504"""
+        Recipe.objects.create(
+            user=self.user, title='Slow', time_minutes=1, price=1
+        )
+        slow = Recipe.objects.extra(where=['pg_sleep(0.2) IS NOT NULL'])
+
+        with patch.object(views.RecipeViewSet, 'get_queryset',
+                          lambda view: slow):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, 504)
+        self.assertEqual(show('statement_timeout'), '0')
+
+    @override_settings(DB_LOCK_TIMEOUT_MS=50)
+    def test_locked_row_returns_503(self):
+        """Test a write waiting too long on a row lock answers 503"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        other = connection.Database.connect(
+            **connection.get_connection_params()
+        )
+        try:
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'SELECT id FROM core_tag WHERE id = %s FOR UPDATE',
+                    [tag.id],
+                )
+                res = self.client.patch(
+                    reverse('recipe:tag-detail', args=[tag.id]),
+                    {'name': 'Vegetarian'},
+                )
+        finally:
+            other.close()
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res['Retry-After'], '1')
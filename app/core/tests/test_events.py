@@ -0,0 +1,207 @@
+"""
+Tests for the server-sent event stream
+"""
+
+import asyncio
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+
+from core import aio, events, outbox
+from core.asgi import EVENTS_PATH, ASGIHandler
+
+
+class Stream:
+    """A request to the event stream driven without a server"""
+
+    def __init__(self, token=None, last_event_id=None, send_buffer=0):
+        headers = []
+        if token:
+            headers.append((b'authorization', b'Token ' + token.encode()))
+        if last_event_id is not None:
+            headers.append((b'last-event-id', str(last_event_id).encode()))
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': EVENTS_PATH,
+            'query_string': b'', 'headers': headers, 'root_path': '',
+        }
+        self.incoming = asyncio.Queue()
+        self.sent = asyncio.Queue(send_buffer)
+        self.task = asyncio.ensure_future(
+            ASGIHandler()(scope, self.incoming.get, self.sent.put)
+        )
+
+    async def next(self):
+        return await asyncio.wait_for(self.sent.get(), 5)
+
+    async def body(self):
+        return (await self.next())['body']
+
+    async def start(self):
+        """Return the response start, skipping the retry hint"""
+        start = await self.next()
+        if start['status'] == 200:
+            await self.next()
+        return start
+
+    async def close(self):
+        await self.incoming.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+def message(event):
+    return events.message(outbox.summary(event))
+
+
+# The listener has its own connection, and NOTIFY waits for the commit
+class EventStreamTests(TransactionTestCase):
+    """Test streaming a user's events"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('ann@example.com', 'pass12345')
+        self.token = Token.objects.create(user=self.user).key
+        self.other = User.objects.create_user('bob@example.com', 'pass12345')
+
+    def tearDown(self):
+        if events._listener is not None:
+            events._listener.close()
+            events._listener = None
+
+    def publish(self, user, topic='recipe.updated', recipe_id=1):
+        return aio.run_sync(outbox.publish, user.id, topic, {'id': recipe_id})
+
+    async def test_streams_own_events(self):
+        """Test the stream sends the user's events as they commit"""
+        stream = Stream(self.token)
+        start = await stream.start()
+        await self.publish(self.other)
+        event = await self.publish(self.user, 'recipe.created', 7)
+
+        body = await stream.body()
+        await stream.close()
+
+        self.assertEqual(start['status'], 200)
+        self.assertIn(
+            (b'content-type', b'text/event-stream'), start['headers']
+        )
+        self.assertEqual(body, (
+            'id: %d\nevent: recipe.created\ndata: {"id": 7}\n\n' % event.id
+        ).encode())
+        self.assertEqual(events._listener.queues, {})
+
+    async def test_replays_missed_events(self):
+        """Test a reconnecting client gets what it missed, once"""
+        seen = await self.publish(self.user)
+        missed = await self.publish(self.user)
+
+        stream = Stream(self.token, last_event_id=seen.id)
+        await stream.start()
+        replayed = await stream.body()
+        live = await self.publish(self.user)
+        following = await stream.body()
+        await stream.close()
+
+        self.assertEqual(replayed, message(missed))
+        self.assertEqual(following, message(live))
+
+    async def test_event_replayed_and_announced_sent_once(self):
+        """Test an event committing while the stream subscribes and
+        replays is sent once"""
+        seen = await self.publish(self.user)
+        during = []
+
+        def missed(user_id, last_event_id):
+            during.append(outbox.publish(
+                self.user.id, 'recipe.updated', {'id': 1}
+            ))
+            return replay(user_id, last_event_id)
+        replay = events.missed
+        with patch.object(events, 'missed', missed):
+            stream = Stream(self.token, last_event_id=seen.id)
+            await stream.start()
+            replayed = await stream.body()
+        live = await self.publish(self.user)
+        following = await stream.body()
+        await stream.close()
+
+        self.assertEqual(replayed, message(during[0]))
+        self.assertEqual(following, message(live))
+
+    @override_settings(EVENTS_REPLAY_LIMIT=1)
+    async def test_too_far_behind_resets(self):
+        """Test a client missing too many events is told to reload"""
+        seen = await self.publish(self.user)
+        await self.publish(self.user)
+        await self.publish(self.user)
+
+        stream = Stream(self.token, last_event_id=seen.id)
+        await stream.start()
+        body = await stream.body()
+        await stream.close()
+
+        self.assertEqual(body, b'event: reset\ndata: {}\n\n')
+
+    async def test_streams_share_one_connection(self):
+        """Test every stream of the process is fed by one LISTEN"""
+        first, second = Stream(self.token), Stream(self.token)
+        await first.start()
+        await second.start()
+        event = await self.publish(self.user)
+
+        bodies = [await first.body(), await second.body()]
+        listening = await aio.run_sync(self.count_listeners)
+        await first.close()
+        await second.close()
+
+        self.assertEqual(bodies, [message(event)] * 2)
+        self.assertEqual(listening, 1)
+
+    def count_listeners(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FROM pg_stat_activity "
+                "WHERE query LIKE 'LISTEN %%'"
+            )
+            return cursor.fetchone()[0]
+
+    @override_settings(EVENTS_QUEUE_SIZE=1)
+    async def test_slow_stream_is_ended(self):
+        """Test a stream falling behind is ended for the client to catch
+        up on reconnecting"""
+        # The client reads nothing, so the stream blocks writing
+        stream = Stream(self.token, send_buffer=1)
+        await asyncio.sleep(0.1)
+        for _ in range(3):
+            await self.publish(self.user)
+        await asyncio.sleep(0.1)
+
+        sent = [await stream.next() for _ in range(3)]
+        await asyncio.wait_for(stream.task, 5)
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertTrue(sent[1]['body'].startswith(b'retry:'))
+        self.assertEqual(sent[2], {'type': 'http.response.body', 'body': b''})
+
+    @override_settings(EVENTS_KEEPALIVE_SECONDS=0.05)
+    async def test_keepalive(self):
+        """Test an idle stream sends comments"""
+        stream = Stream(self.token)
+        await stream.start()
+
+        body = await stream.body()
+        await stream.close()
+
+        self.assertEqual(body, b': keepalive\n\n')
+
+    async def test_requires_authentication(self):
+        """Test a request without a token is refused"""
+        stream = Stream()
+
+        start = await stream.next()
+        await stream.next()
+
+        self.assertEqual(start['status'], 401)
+        self.assertIsNone(events._listener)
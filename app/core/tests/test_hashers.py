@@ -0,0 +1,125 @@
+"""
+Tests for the password hashers and rehashing on login
+"""
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import (
+    check_password, identify_hasher, make_password,
+)
+from django.test import (
+    AsyncClient, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.hashers import ScryptPasswordHasher, TunedArgon2PasswordHasher
+
+TOKEN_URL = reverse('user:token')
+CREATE_USER_URL = reverse('user:create')
+
+SMALL_SCRYPT = {'work_factor': 2 ** 10, 'block_size': 8, 'parallelism': 1}
+
+
+class ScryptHasherTests(SimpleTestCase):
+    """Test the scrypt hasher"""
+
+    def test_round_trip(self):
+        """Test a password verifies against its own hash only"""
+        encoded = make_password('lètmein', hasher='scrypt')
+
+        self.assertTrue(encoded.startswith('scrypt$16384$'))
+        self.assertTrue(check_password('lètmein', encoded))
+        self.assertFalse(check_password('letmein', encoded))
+
+    def test_must_update_after_tuning(self):
+        """Test hashes made with other parameters need updating"""
+        hasher = ScryptPasswordHasher()
+        encoded = hasher.encode('secret', hasher.salt())
+
+        self.assertFalse(hasher.must_update(encoded))
+        with override_settings(PASSWORD_SCRYPT=SMALL_SCRYPT):
+            self.assertTrue(hasher.must_update(encoded))
+            # Old hashes still verify with their own parameters
+            self.assertTrue(hasher.verify('secret', encoded))
+
+    def test_safe_summary_masks(self):
+        """Test the summary doesn't reveal the salt or hash"""
+        hasher = ScryptPasswordHasher()
+        summary = hasher.safe_summary(hasher.encode('secret', 'abcdefgh'))
+
+        self.assertEqual(summary['work factor'], 16384)
+        self.assertEqual(summary['salt'], 'abcdef**')
+
+
+class Argon2HasherTests(SimpleTestCase):
+    """Test the tuned Argon2 hasher"""
+
+    @override_settings(PASSWORD_ARGON2={
+        'time_cost': 1, 'memory_cost': 8192, 'parallelism': 1,
+    })
+    def test_uses_settings(self):
+        """Test the parameters come from PASSWORD_ARGON2"""
+        hasher = TunedArgon2PasswordHasher()
+        encoded = hasher.encode('secret', hasher.salt())
+
+        self.assertIn('$m=8192,t=1,p=1$', encoded)
+        self.assertTrue(hasher.verify('secret', encoded))
+
+
+class RehashOnLoginTests(TestCase):
+    """Test hashes made by other hashers are upgraded on login"""
+
+    def test_pbkdf2_user_rehashed(self):
+        """Test logging in rehashes a PBKDF2 password with scrypt"""
+        user = get_user_model().objects.create_user('test@example.com')
+        user.password = make_password('testpass123', hasher='pbkdf2_sha256')
+        user.save()
+
+        res = APIClient().post(
+            TOKEN_URL, {'email': 'test@example.com', 'password': 'testpass123'}
+        )
+
+        self.assertEqual(res.status_code, 200)
+        user.refresh_from_db()
+        self.assertEqual(identify_hasher(user.password).algorithm, 'scrypt')
+        self.assertTrue(user.check_password('testpass123'))
+
+    def test_failed_login_keeps_hash(self):
+        """Test a wrong password doesn't touch the stored hash"""
+        user = get_user_model().objects.create_user('test@example.com')
+        user.password = make_password('testpass123', hasher='pbkdf2_sha256')
+        user.save()
+        before = user.password
+
+        APIClient().post(
+            TOKEN_URL, {'email': 'test@example.com', 'password': 'wrong'}
+        )
+
+        user.refresh_from_db()
+        self.assertEqual(user.password, before)
+
+
+# The views hash on their own thread pool, so data has to be committed
+@override_settings(ROOT_URLCONF='app.asgi_urls')
+class AsyncLoginTests(TransactionTestCase):
+    """Test signing up and logging in under ASGI"""
+
+    async def test_create_user_and_token(self):
+        """Test both hashing views work from the hashing pool"""
+        client = AsyncClient()
+        payload = {'email': 'test@example.com', 'password': 'testpass123'}
+        json = 'application/json'
+
+        created = await client.post(
+            CREATE_USER_URL, {**payload, 'name': 'Test'}, json
+        )
+        token = await client.post(TOKEN_URL, payload, json)
+        wrong = await client.post(
+            TOKEN_URL, {**payload, 'password': 'wrong'}, json
+        )
+
+        self.assertEqual(created.status_code, 201)
+        self.assertEqual(token.status_code, 200)
+        self.assertIn('token', token.json())
+        self.assertEqual(wrong.status_code, 400)
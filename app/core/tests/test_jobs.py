@@ -0,0 +1,260 @@
+"""
+Tests for the background job queue
+"""
+
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import jobs, metrics
+from core.models import Job
+
+calls = []
+
+
+@jobs.job('test.add', max_attempts=2)
+def add(a, b):
+    calls.append((a, b))
+    return a + b
+
+
+@jobs.job('test.fail')
+def always_fail():
+    raise RuntimeError('boom')
+
+
+@jobs.job('test.other', queue='other')
+def other_queue():
+    pass
+
+
+class JobQueueTests(TestCase):
+    """Test queueing, claiming and running jobs"""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue(self):
+        """Test a job is queued with its registered options"""
+        job = jobs.enqueue('test.add', {'a': 1, 'b': 2})
+
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertEqual(job.queue, 'default')
+        self.assertEqual(job.max_attempts, 2)
+        self.assertEqual(
+            jobs.enqueue('test.fail').max_attempts, 3,
+        )
+
+    def test_enqueue_unknown(self):
+        """Test queueing a job nobody registered fails at once"""
+        with self.assertRaises(ValueError):
+            jobs.enqueue('test.missing')
+
+    def test_claim_due_jobs_of_queues(self):
+        """Test claiming takes due jobs of the queues, oldest first"""
+        first = jobs.enqueue('test.add', {'a': 1, 'b': 2})
+        second = jobs.enqueue('test.add', {'a': 3, 'b': 4})
+        jobs.enqueue('test.add', {'a': 0, 'b': 0},
+                     run_after=timezone.now() + timedelta(hours=1))
+        jobs.enqueue('test.other')
+
+        claimed = jobs.claim('w1', ['default'], 10)
+
+        self.assertEqual([job.pk for job in claimed], [first.pk, second.pk])
+        first.refresh_from_db()
+        self.assertEqual(first.status, Job.RUNNING)
+        self.assertEqual(first.attempts, 1)
+        self.assertEqual(first.locked_by, 'w1')
+        self.assertEqual(jobs.claim('w2', ['default'], 10), [])
+
+    def test_run_success(self):
+        """Test a job's return value is kept as its result"""
+        jobs.enqueue('test.add', {'a': 1, 'b': 2})
+        job, = jobs.claim('w1', ['default'], 1)
+
+        self.assertEqual(jobs.run(job), Job.SUCCEEDED)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, 3)
+        self.assertIsNone(job.locked_until)
+        self.assertIsNotNone(job.finished_at)
+
+    @patch.object(jobs.logger, 'exception')
+    def test_run_failure_retries_then_gives_up(self, _):
+        """Test a failing job is retried later until out of attempts"""
+        jobs.enqueue('test.fail')
+        job, = jobs.claim('w1', ['default'], 1)
+
+        self.assertEqual(jobs.run(job), 'retried')
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertGreaterEqual(job.run_after, job.started_at)
+
+        for _ in range(2):
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            job, = jobs.claim('w1', ['default'], 1)
+            outcome = jobs.run(job)
+        self.assertEqual(outcome, Job.FAILED)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 3)
+
+    def test_requeue_expired(self):
+        """Test the job of a worker that went away runs again"""
+        jobs.enqueue('test.add', {'a': 1, 'b': 2})
+        job, = jobs.claim('w1', ['default'], 1)
+        Job.objects.filter(pk=job.pk).update(
+            locked_until=timezone.now() - timedelta(seconds=1)
+        )
+
+        self.assertEqual(jobs.requeue_expired(), 1)
+        retried, = jobs.claim('w2', ['default'], 1)
+        self.assertEqual(retried.pk, job.pk)
+        self.assertEqual(retried.attempts, 2)
+
+        # The first worker finishing late doesn't overwrite the second
+        jobs.run(job)
+        retried.refresh_from_db()
+        self.assertEqual(retried.status, Job.RUNNING)
+
+    def test_renew(self):
+        """Test renewing extends only the worker's own leases"""
+        jobs.enqueue('test.add', {'a': 1, 'b': 2})
+        job, = jobs.claim('w1', ['default'], 1)
+
+        self.assertEqual(jobs.renew('w2', [job.pk]), 0)
+        self.assertEqual(jobs.renew('w1', [job.pk]), 1)
+
+    @override_settings(JOBS_PERIODIC={'test.add': 3600})
+    def test_enqueue_periodic(self):
+        """Test periodic jobs are queued once per interval"""
+        queued = jobs.enqueue_periodic()
+
+        self.assertEqual([job.name for job in queued], ['test.add'])
+        self.assertEqual(jobs.enqueue_periodic(), [])
+        Job.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(len(jobs.enqueue_periodic()), 1)
+
+    def test_prune(self):
+        """Test finished jobs are deleted after the retention period"""
+        jobs.enqueue('test.add', {'a': 1, 'b': 2})
+        job, = jobs.claim('w1', ['default'], 1)
+        jobs.run(job)
+        Job.objects.filter(pk=job.pk).update(
+            finished_at=timezone.now() - timedelta(days=8)
+        )
+        jobs.enqueue('test.add', {'a': 1, 'b': 2})
+
+        self.assertEqual(jobs.prune(7), 1)
+        self.assertEqual(Job.objects.count(), 1)
+
+
+class JobApiTests(TestCase):
+    """Test the job status endpoints"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('ann@example.com', 'pass12345')
+        self.other = User.objects.create_user('bob@example.com', 'pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_and_retrieve_own_jobs(self):
+        """Test users only see their own jobs"""
+        job = jobs.enqueue('test.add', {'a': 1, 'b': 2}, user=self.user)
+        other = jobs.enqueue('test.add', {'a': 1, 'b': 2}, user=self.other)
+
+        res = self.client.get(reverse('job-list'))
+        detail = self.client.get(reverse('job-detail', args=[job.pk]))
+        hidden = self.client.get(reverse('job-detail', args=[other.pk]))
+
+        self.assertEqual([j['id'] for j in res.data], [job.pk])
+        self.assertEqual(detail.data['status'], Job.QUEUED)
+        self.assertEqual(hidden.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_auth_required(self):
+        """Test job status needs authentication"""
+        res = APIClient().get(reverse('job-list'))
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+# Jobs run on the worker's threads, with their own connections
+@override_settings(JOBS_PERIODIC={})
+class RunWorkerCommandTests(TransactionTestCase):
+    """Test the run_worker command"""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_once_runs_due_jobs(self):
+        """Test the worker runs every due job and exits"""
+        for n in range(5):
+            jobs.enqueue('test.add', {'a': n, 'b': 1})
+        jobs.enqueue('test.other')
+        out = StringIO()
+
+        call_command('run_worker', once=True, concurrency=2, stdout=out)
+
+        self.assertEqual(sorted(calls), [(n, 1) for n in range(5)])
+        self.assertIn('Ran 5 jobs: 5 succeeded', out.getvalue())
+        self.assertEqual(
+            Job.objects.filter(status=Job.SUCCEEDED).count(), 5,
+        )
+
+    def test_serves_metrics(self):
+        """Test the worker serves its job metrics on --metrics-port"""
+        jobs.enqueue('test.add', {'a': 1, 'b': 1})
+
+        with patch('core.metrics.start_http_server') as start:
+            call_command(
+                'run_worker', once=True, metrics_port=9100, stdout=StringIO()
+            )
+
+        start.assert_called_once_with(9100)
+        self.assertIn(
+            'jobs_completed_total{name="test.add",outcome="succeeded"}',
+            metrics.REGISTRY.render(),
+        )
+
+    def test_skips_locked_jobs(self):
+        """Test a job locked by another worker's claim is skipped rather
+        than waited for"""
+        locked = jobs.enqueue('test.add', {'a': 1, 'b': 1})
+        jobs.enqueue('test.add', {'a': 2, 'b': 2})
+        other = connection.Database.connect(
+            **connection.get_connection_params()
+        )
+        try:
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'SELECT id FROM core_job WHERE id = %s FOR UPDATE',
+                    [locked.pk],
+                )
+            claimed = jobs.claim('w1', ['default'], 10)
+        finally:
+            other.close()
+
+        self.assertEqual(len(claimed), 1)
+        self.assertNotEqual(claimed[0].pk, locked.pk)
+
+    def test_worker_requeues_expired_jobs(self):
+        """Test the worker picks up jobs whose worker went away"""
+        jobs.enqueue('test.add', {'a': 1, 'b': 1})
+        jobs.claim('dead', ['default'], 1)
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        call_command('run_worker', once=True, stdout=StringIO())
+
+        self.assertEqual(calls, [(1, 1)])
@@ -0,0 +1,187 @@
+"""
+Tests for the metrics registry and endpoint
+"""
+
+import os
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import metrics
+
+METRICS_URL = reverse('metrics')
+
+
+class RegistryTests(SimpleTestCase):
+    """Test metric collection and rendering"""
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_sums_threads(self):
+        """Test counts from several threads are added together"""
+        counter = metrics.Counter(
+            'jobs_total', 'Jobs', ['queue'], registry=self.registry
+        )
+        child = counter.labels('default')
+
+        def work():
+            for _ in range(1000):
+                child.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn('jobs_total{queue="default"} 4000',
+                      self.registry.render())
+
+    def test_histogram_render(self):
+        """Test histogram buckets are cumulative"""
+        histogram = metrics.Histogram(
+            'latency_seconds', 'Latency', buckets=(0.1, 1),
+            registry=self.registry,
+        )
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        text = self.registry.render()
+
+        self.assertIn('# TYPE latency_seconds histogram', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count 3', text)
+        self.assertIn('latency_seconds_sum 5.55', text)
+
+    def test_labels_are_cached(self):
+        """Test the same series is returned for the same label values"""
+        counter = metrics.Counter(
+            'hits_total', 'Hits', ['route'], registry=self.registry
+        )
+
+        self.assertIs(counter.labels('a'), counter.labels('a'))
+        with self.assertRaises(ValueError):
+            counter.labels('a', 'b')
+
+    def test_label_values_escaped(self):
+        """Test quotes in label values are escaped"""
+        counter = metrics.Counter(
+            'hits_total', 'Hits', ['route'], registry=self.registry
+        )
+        counter.labels('say "hi"').inc()
+
+        self.assertIn(r'hits_total{route="say \"hi\""} 1',
+                      self.registry.render())
+
+    def test_multiprocess_aggregation(self):
+        """Test snapshots of other processes are merged in"""
+        counter = metrics.Counter(
+            'hits_total', 'Hits', ['route'], registry=self.registry
+        )
+        counter.labels('a').inc(2)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(directory + '/metrics-1.json', 'w') as f:
+                f.write('{"hits_total": [[["a"], [3.0]], [["b"], [1.0]]]}')
+            with override_settings(METRICS_MULTIPROC_DIR=directory):
+                text = self.registry.render()
+
+        self.assertIn('hits_total{route="a"} 5', text)
+        self.assertIn('hits_total{route="b"} 1', text)
+
+    def test_dead_process_archived(self):
+        """Test an exited process' counts are kept and its gauges
+        dropped"""
+        metrics.Counter('hits_total', 'Hits', registry=self.registry)
+        metrics.Gauge('in_flight', 'In flight', registry=self.registry)
+
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_MULTIPROC_DIR=directory):
+            for pid in (1, 2):
+                with open('%s/metrics-%d.json' % (directory, pid), 'w') as f:
+                    f.write('{"hits_total": [[[], [3.0]]], '
+                            '"in_flight": [[[], [2.0]]]}')
+                self.registry.mark_process_dead(pid)
+            files = os.listdir(directory)
+            text = self.registry.render()
+
+        self.assertEqual(files, [metrics.ARCHIVE])
+        self.assertIn('hits_total 6', text)
+        self.assertNotIn('\nin_flight ', text)
+
+    def test_http_server(self):
+        """Test start_http_server serves the registry on /metrics only"""
+        metrics.Counter(
+            'served_total', 'Served', registry=self.registry
+        ).inc()
+        server = metrics.start_http_server(0, '127.0.0.1', self.registry)
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+        try:
+            with urllib.request.urlopen(url + '/metrics') as response:
+                content_type = response.headers['Content-Type']
+                text = response.read().decode()
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(url + '/')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(content_type, metrics.CONTENT_TYPE)
+        self.assertIn('served_total 1', text)
+        self.assertEqual(cm.exception.code, 404)
+
+
+class MetricsEndpointTests(TestCase):
+    """Test metrics are recorded for API requests"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_request_recorded(self):
+        """Test a recipe list call shows up on /metrics"""
+        self.client.get(reverse('recipe:recipe-list'))
+
+        res = self.client.get(METRICS_URL)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain'))
+        text = res.content.decode()
+        self.assertIn(
+            'http_requests_total{route="api/recipe/recipes/$",'
+            'method="GET",status="200"}',
+            text,
+        )
+        self.assertIn(
+            'http_request_db_queries_bucket{route="api/recipe/recipes/$",'
+            'method="GET",le="1"}',
+            text,
+        )
+
+    def test_unknown_method_label(self):
+        """Test made-up methods share one series"""
+        self.client.generic('FOO1', reverse('recipe:recipe-list'))
+        self.client.generic('FOO2', reverse('recipe:recipe-list'))
+
+        text = self.client.get(METRICS_URL).content.decode()
+
+        self.assertIn(
+            'http_requests_total{route="api/recipe/recipes/$",'
+            'method="other",status="405"} 2',
+            text,
+        )
+        self.assertNotIn('FOO', text)
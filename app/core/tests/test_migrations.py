@@ -0,0 +1,158 @@
+"""
+Tests for data migrations
+"""
+
+import importlib
+
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+from core.models import OutboxEvent
+
+migration = importlib.import_module('core.migrations.0011_normalized_names')
+
+
+class NormalizedNamesMigrationTests(TransactionTestCase):
+    """Test merging duplicate tags and ingredients into one"""
+
+    before = [('core', '0010_job_name_created_idx')]
+    after = [('core', '0011_normalized_names')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.after)
+        return executor.loader.project_state(self.after).apps
+
+    def test_merges_duplicates(self):
+        User = self.apps.get_model('core', 'User')
+        Recipe = self.apps.get_model('core', 'Recipe')
+        Tag = self.apps.get_model('core', 'Tag')
+        ann = User.objects.create(email='ann@example.com')
+        bob = User.objects.create(email='bob@example.com')
+        vegan, lower, spaced, hot = (
+            Tag.objects.create(user=ann, name=name)
+            for name in ('Vegan', 'vegan', ' VEGAN ', 'Hot')
+        )
+        theirs = Tag.objects.create(user=bob, name='vegan')
+
+        def recipe(*tags):
+            recipe = Recipe.objects.create(
+                user=ann, title='Salad', time_minutes=5, price=1,
+                card={'tags': []},
+            )
+            recipe.tags.add(*tags)
+            return recipe.pk
+
+        recipes = [
+            recipe(vegan), recipe(lower, hot), recipe(spaced, vegan, lower),
+            recipe(spaced, lower), recipe(hot),
+        ]
+
+        apps = self.migrate()
+
+        Recipe = apps.get_model('core', 'Recipe')
+        Tag = apps.get_model('core', 'Tag')
+        self.assertEqual(
+            list(Tag.objects.order_by('id').values_list(
+                'id', 'normalized_name'
+            )),
+            [(vegan.pk, 'vegan'), (hot.pk, 'hot'), (theirs.pk, 'vegan')],
+        )
+        tags = {
+            recipe.pk: sorted(recipe.tags.values_list('pk', flat=True))
+            for recipe in Recipe.objects.all()
+        }
+        self.assertEqual(tags, dict(zip(recipes, [
+            [vegan.pk], [vegan.pk, hot.pk], [vegan.pk], [vegan.pk], [hot.pk],
+        ])))
+        cards = dict(Recipe.objects.values_list('pk', 'card'))
+        self.assertEqual(
+            [pk for pk in recipes if cards[pk] is None], recipes[1:4]
+        )
+        events = OutboxEvent.objects.values_list('user_id', 'topic', 'payload')
+        self.assertEqual(list(events), [(ann.pk, 'tag.merged', {
+            'id': vegan.pk, 'name': 'Vegan',
+            'sources': [lower.pk, spaced.pk], 'recipes': recipes[1:4],
+        })])
+
+    def test_merges_bigint_ids(self):
+        """Test ids past the int4 range are filled and merged"""
+        User = self.apps.get_model('core', 'User')
+        Tag = self.apps.get_model('core', 'Tag')
+        ann = User.objects.create(id=2 ** 40, email='ann@example.com')
+        keeper = Tag.objects.create(id=2 ** 40, user=ann, name='Vegan')
+        Tag.objects.create(id=2 ** 40 + 1, user=ann, name='vegan')
+
+        apps = self.migrate()
+
+        Tag = apps.get_model('core', 'Tag')
+        self.assertEqual(
+            list(Tag.objects.values_list('id', 'normalized_name')),
+            [(keeper.pk, 'vegan')],
+        )
+        self.assertEqual(
+            list(OutboxEvent.objects.values_list('user_id', 'topic')),
+            [(ann.pk, 'tag.merged')],
+        )
+
+    def test_set_not_null_fills_and_merges_late_rows(self):
+        """Test rows written without a normalized name since the fill are
+        filled and merged before the column becomes NOT NULL"""
+        apps = self.migrate()
+        User = apps.get_model('core', 'User')
+        Recipe = apps.get_model('core', 'Recipe')
+        Tag = apps.get_model('core', 'Tag')
+        ann = User.objects.create(email='ann@example.com')
+        vegan = Tag.objects.create(user=ann, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=ann, title='Salad', time_minutes=5, price=1,
+        )
+        # As if written by code from before the migration
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'ALTER TABLE core_tag '
+                'DROP CONSTRAINT core_tag_user_normalized_name_uniq, '
+                'ALTER COLUMN normalized_name DROP NOT NULL'
+            )
+            cursor.execute(
+                "INSERT INTO core_tag (user_id, name) VALUES (%s, 'VEGAN ') "
+                'RETURNING id', [ann.pk],
+            )
+            late = cursor.fetchone()[0]
+        recipe.tags.add(late)
+
+        try:
+            with connection.schema_editor(atomic=False) as schema_editor:
+                migration.set_not_null(apps, schema_editor)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'ALTER TABLE core_tag '
+                    'ADD CONSTRAINT core_tag_user_normalized_name_uniq '
+                    'UNIQUE (user_id, normalized_name)'
+                )
+
+        self.assertEqual(list(Tag.objects.all()), [vegan])
+        self.assertEqual(list(recipe.tags.all()), [vegan])
+        self.assertEqual(
+            OutboxEvent.objects.get().payload['sources'], [late]
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT is_nullable FROM information_schema.columns "
+                "WHERE table_name = 'core_tag' "
+                "AND column_name = 'normalized_name'"
+            )
+            self.assertEqual(cursor.fetchone()[0], 'NO')
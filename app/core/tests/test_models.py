@@ -4,6 +4,7 @@ Tests for Models
 
 from multiprocessing.sharedctypes import Value
 from venv import create
+from django.db import IntegrityError
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 from decimal import Decimal
@@ -95,6 +96,40 @@ class ModelTest(TestCase):
 
         self.assertEqual(str(ingredient), 'Ingredient1')
 
+    def test_normalize_name(self):
+        """Test names differing in case, spacing or Unicode form match"""
+
+        self.assertEqual(models.normalize_name('  Sea\u00a0 SALT '), 'sea salt')
+        self.assertEqual(models.normalize_name('Cr\u0065\u0301pes'), 'cr\u00e9pes')
+        self.assertEqual(models.normalize_name('STRASSE'), models.normalize_name('Straße'))
+
+    def test_tag_normalized_name(self):
+        """Test the normalized name is kept up to date on save"""
+
+        user = create_user()
+        tag = models.Tag.objects.create(user=user, name='Vegan ')
+        self.assertEqual(tag.normalized_name, 'vegan')
+
+        tag.name = 'Plant Based'
+        tag.save()
+        tag.refresh_from_db()
+        self.assertEqual(tag.normalized_name, 'plant based')
+
+        ingredient, = models.Ingredient.objects.bulk_create([
+            models.Ingredient(user=user, name='SALT'),
+        ])
+        self.assertEqual(ingredient.normalized_name, 'salt')
+
+    def test_duplicate_normalized_name_refused(self):
+        """Test a user can't have two tags with the same normalized name"""
+
+        user = create_user()
+        models.Tag.objects.create(user=user, name='Salt')
+        models.Tag.objects.create(user=create_user('other@example.com'), name='salt')
+
+        with self.assertRaises(IntegrityError):
+            models.Tag.objects.create(user=user, name=' salt')
+
 
 
 
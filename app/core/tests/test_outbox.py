@@ -0,0 +1,287 @@
+"""
+Tests for the transactional outbox
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core import outbox
+from core.models import OutboxEvent, Recipe, Tag
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class Receiver(BaseHTTPRequestHandler):
+    """Webhook stand-in recording what it is sent"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append((dict(self.headers), body))
+        self.send_response(self.server.status)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class OutboxWriteTests(TestCase):
+    """Test events are written with the changes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'testpass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def topics(self):
+        return list(OutboxEvent.objects.order_by('id').values_list(
+            'topic', flat=True
+        ))
+
+    def test_recipe_events(self):
+        """Test creating, updating and deleting recipes publish events"""
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Curry', 'time_minutes': 30, 'price': '2.50',
+            'tags': [{'name': 'Hot'}],
+        }, format='json')
+        url = reverse('recipe:recipe-detail', args=[res.data['id']])
+        self.client.patch(url, {'title': 'Green curry'})
+        self.client.delete(url)
+
+        self.assertEqual(
+            self.topics(),
+            ['recipe.created', 'recipe.updated', 'recipe.deleted'],
+        )
+        created = OutboxEvent.objects.get(topic='recipe.created')
+        self.assertEqual(created.user, self.user)
+        self.assertEqual(created.payload['price'], '2.50')
+        self.assertEqual(created.payload['tags'][0]['name'], 'Hot')
+        deleted = OutboxEvent.objects.get(topic='recipe.deleted')
+        self.assertEqual(deleted.payload, {'id': res.data['id']})
+
+    def test_tag_events(self):
+        """Test renaming and deleting tags publish the recipes affected"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=30,
+            price=Decimal('2.50'),
+        )
+        tag = Tag.objects.create(user=self.user, name='Hot')
+        recipe.tags.add(tag)
+        url = reverse('recipe:tag-detail', args=[tag.id])
+
+        self.client.patch(url, {'name': 'Spicy'})
+        self.client.delete(url)
+
+        self.assertEqual(self.topics(), ['tag.updated', 'tag.deleted'])
+        self.assertEqual(
+            OutboxEvent.objects.get(topic='tag.updated').payload,
+            {'id': tag.id, 'name': 'Spicy', 'recipes': [recipe.id]},
+        )
+
+    def test_no_event_without_change(self):
+        """Test a write that fails leaves neither change nor event"""
+        with patch('recipe.cards.refresh', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(RECIPES_URL, {
+                    'title': 'Curry', 'time_minutes': 30, 'price': '2.50',
+                }, format='json')
+
+        self.assertFalse(Recipe.objects.exists())
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_publish_for_bigint_user_id(self):
+        """Test publishing for a user id past the int4 range"""
+        user = get_user_model().objects.create_user(
+            'big@example.com', 'testpass123', id=2 ** 40,
+        )
+
+        event = outbox.publish(user.id, 'user.updated', {'id': user.id})
+
+        self.assertEqual(event.user_id, 2 ** 40)
+
+
+class OutboxDeliveryTests(TestCase):
+    """Test delivering events to a webhook"""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Receiver)
+        self.server.received = []
+        self.server.status = 200
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        override = override_settings(
+            OUTBOX_WEBHOOK_URLS=[
+                'http://127.0.0.1:%d/hook' % self.server.server_port
+            ],
+            OUTBOX_WEBHOOK_SECRET='s3cret',
+            OUTBOX_MAX_ATTEMPTS=3,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+
+        User = get_user_model()
+        self.ann = User.objects.create_user('ann@example.com', 'pass12345')
+        self.bob = User.objects.create_user('bob@example.com', 'pass12345')
+        for n in range(3):
+            outbox.publish(self.ann.id, 'recipe.created', {'n': n})
+        outbox.publish(self.bob.id, 'recipe.created', {'n': 0})
+
+    def received_events(self):
+        return [
+            (event['user'], event['payload']['n'])
+            for _, body in self.server.received
+            for event in json.loads(body)['events']
+        ]
+
+    def test_batches_per_user_in_order(self):
+        """Test each user's events go out in one signed batch, in order"""
+        delivered = outbox.deliver(batch_size=10, max_users=10)
+
+        self.assertEqual(delivered, 4)
+        self.assertEqual(len(self.server.received), 2)
+        self.assertEqual(
+            sorted(self.received_events()),
+            [(self.ann.id, 0), (self.ann.id, 1), (self.ann.id, 2),
+             (self.bob.id, 0)],
+        )
+        headers, body = self.server.received[0]
+        signature = hmac.new(b's3cret', body, hashlib.sha256).hexdigest()
+        self.assertEqual(
+            headers['X-Outbox-Signature'], 'sha256=' + signature
+        )
+        self.assertFalse(outbox.pending().exists())
+
+    def test_failure_backs_off_and_holds_later_events(self):
+        """Test a failed batch is retried later, keeping the order"""
+        self.server.status = 500
+
+        self.assertEqual(outbox.deliver(batch_size=2, max_users=10), 0)
+        head = OutboxEvent.objects.filter(user=self.ann).earliest('id')
+        self.assertEqual(head.attempts, 1)
+        self.assertIn('500', head.last_error)
+        self.assertIsNotNone(head.next_attempt_at)
+
+        # Not due yet: nothing is sent for the user, not even later events
+        OutboxEvent.objects.filter(pk=head.pk).update(
+            next_attempt_at=timezone.now() + timedelta(hours=1)
+        )
+        OutboxEvent.objects.filter(user=self.bob).update(next_attempt_at=None)
+        self.server.status = 200
+        self.server.received.clear()
+        outbox.deliver(batch_size=2, max_users=10)
+        self.assertEqual(self.received_events(), [(self.bob.id, 0)])
+
+        OutboxEvent.objects.filter(pk=head.pk).update(next_attempt_at=None)
+        outbox.deliver(batch_size=2, max_users=10)
+        outbox.deliver(batch_size=2, max_users=10)
+        self.assertEqual(
+            self.received_events()[1:],
+            [(self.ann.id, 0), (self.ann.id, 1), (self.ann.id, 2)],
+        )
+
+    def test_gives_up_after_max_attempts(self):
+        """Test an event failing too often is set aside"""
+        head = OutboxEvent.objects.filter(user=self.ann).earliest('id')
+        OutboxEvent.objects.filter(pk=head.pk).update(attempts=2)
+        self.server.status = 400
+
+        outbox.deliver(batch_size=10, max_users=10)
+
+        head.refresh_from_db()
+        self.assertIsNotNone(head.failed_at)
+        self.assertEqual(outbox.pending().filter(user=self.ann).count(), 2)
+
+    def test_skips_user_locked_by_another_worker(self):
+        """Test only one worker delivers a user's events at a time"""
+        other = connection.Database.connect(
+            **connection.get_connection_params()
+        )
+        try:
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'SELECT pg_advisory_lock(%s, hashtext(%s::text))',
+                    [outbox.OUTBOX_LOCK, self.ann.id],
+                )
+            delivered = outbox.deliver(batch_size=10, max_users=10)
+        finally:
+            other.close()
+
+        self.assertEqual(delivered, 1)
+        self.assertEqual(self.received_events(), [(self.bob.id, 0)])
+
+    def test_command_once(self):
+        """Test the worker drains due events and exits with --once"""
+        out = StringIO()
+
+        call_command('deliver_outbox', once=True, stdout=out)
+
+        self.assertIn('Delivered 4 events in total', out.getvalue())
+        self.assertFalse(outbox.pending().exists())
+
+    def test_command_flushes_metrics(self):
+        """Test the worker's delivery metrics reach the shared directory"""
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(METRICS_MULTIPROC_DIR=directory):
+            call_command('deliver_outbox', once=True, stdout=StringIO())
+
+            with open(os.path.join(
+                directory, 'metrics-%d.json' % os.getpid()
+            )) as f:
+                snapshot = f.read()
+
+        self.assertIn('outbox_events_delivered_total', snapshot)
+
+
+class OutboxOrderTests(TransactionTestCase):
+    """Test a user's event ids follow commit order"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'testpass123'
+        )
+
+    def publish(self, started=None, release=None):
+        try:
+            with transaction.atomic():
+                event = outbox.publish(self.user.id, 'recipe.updated', {})
+                if started is not None:
+                    started.set()
+                    release.wait(5)
+            return event
+        finally:
+            connection.close()
+
+    def test_publishing_waits_for_earlier_transaction(self):
+        """Test an event can't take an id below one not yet committed"""
+        started, release = threading.Event(), threading.Event()
+        with ThreadPoolExecutor(2) as pool:
+            first = pool.submit(self.publish, started, release)
+            started.wait(5)
+            second = pool.submit(self.publish)
+            waited = not wait([second], timeout=0.2).done
+            release.set()
+
+            self.assertTrue(waited)
+            self.assertLess(first.result().id, second.result().id)
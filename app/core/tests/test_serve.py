@@ -0,0 +1,91 @@
+"""
+Tests for the serve command and app warm-up
+"""
+
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from core import warmup
+from core.management.commands import serve
+from recipe import serializers
+
+
+class AvailableCpusTests(SimpleTestCase):
+    """Test worker sizing from the CPUs available"""
+
+    def write(self, root, path, content):
+        path = os.path.join(root, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    @patch('os.sched_getaffinity', return_value=set(range(8)))
+    def test_cgroup_v2_quota(self, patched_affinity):
+        """Test a cpu.max quota limits the count"""
+        with tempfile.TemporaryDirectory() as root:
+            self.write(root, 'cpu.max', '150000 100000\n')
+
+            self.assertEqual(serve.available_cpus(root), 2)
+
+    @patch('os.sched_getaffinity', return_value=set(range(8)))
+    def test_cgroup_v1_quota(self, patched_affinity):
+        """Test a CFS quota limits the count"""
+        with tempfile.TemporaryDirectory() as root:
+            self.write(root, 'cpu/cpu.cfs_quota_us', '50000\n')
+            self.write(root, 'cpu/cpu.cfs_period_us', '100000\n')
+
+            self.assertEqual(serve.available_cpus(root), 1)
+
+    @patch('os.sched_getaffinity', return_value=set(range(4)))
+    def test_unlimited(self, patched_affinity):
+        """Test the affinity mask is used without a quota"""
+        with tempfile.TemporaryDirectory() as root:
+            self.write(root, 'cpu.max', 'max 100000\n')
+
+            self.assertEqual(serve.available_cpus(root), 4)
+
+
+class ServeOptionsTests(SimpleTestCase):
+    """Test the gunicorn settings"""
+
+    def options(self, **kwargs):
+        options = {
+            'bind': '0.0.0.0:8000', 'workers': 0, 'threads': 2,
+            'asgi': False, 'timeout': 30, 'max_requests': 1000,
+        }
+        options.update(kwargs)
+        return serve.Command().get_options(options)
+
+    @patch('core.management.commands.serve.available_cpus', return_value=2)
+    def test_defaults(self, patched_cpus):
+        """Test workers scale with CPUs and the app is preloaded"""
+        config = self.options()
+
+        self.assertEqual(config['workers'], 5)
+        self.assertEqual(config['worker_class'], 'gthread')
+        self.assertTrue(config['preload_app'])
+
+    def test_asgi(self):
+        """Test --asgi runs uvicorn workers"""
+        config = self.options(workers=3, asgi=True)
+
+        self.assertEqual(config['workers'], 3)
+        self.assertEqual(
+            config['worker_class'], 'uvicorn.workers.UvicornWorker'
+        )
+        self.assertNotIn('threads', config)
+
+
+class WarmUpTests(SimpleTestCase):
+    """Test the warm-up builds what the first requests need"""
+
+    def test_serializers_warmed(self):
+        """Test the serializers of every viewset action are built"""
+        warmed = warmup.warm_serializers(warmup.warm_resolvers())
+
+        self.assertIn(serializers.RecipeSerializer, warmed)
+        self.assertIn(serializers.RecipeDetailSerializer, warmed)
+        self.assertIn(serializers.TagSerializer, warmed)
@@ -0,0 +1,90 @@
+"""
+Tests for the slow query log
+"""
+
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.db import slow_queries
+
+
+class FingerprintTests(SimpleTestCase):
+    """Test SQL normalization"""
+
+    def test_literals_replaced(self):
+        """Test literals and parameters do not change the fingerprint"""
+        first = slow_queries.fingerprint(
+            "SELECT * FROM core_tag WHERE user_id = 1 AND name = 'a'"
+        )
+        second = slow_queries.fingerprint(
+            "SELECT  *  FROM core_tag WHERE user_id = %s AND name = 'b''c'"
+        )
+
+        self.assertEqual(first, second)
+        self.assertEqual(
+            first[0], 'SELECT * FROM core_tag WHERE user_id = ? AND name = ?'
+        )
+
+    def test_in_lists_collapsed(self):
+        """Test IN lists of any length normalize the same"""
+        normalized, _ = slow_queries.fingerprint(
+            'SELECT * FROM core_recipe WHERE id IN (%s, %s, %s)'
+        )
+
+        self.assertEqual(
+            normalized, 'SELECT * FROM core_recipe WHERE id IN (...)'
+        )
+
+    def test_explainable(self):
+        """Test only plain SELECTs are explained"""
+        self.assertTrue(slow_queries.explainable('SELECT 1'))
+        self.assertFalse(slow_queries.explainable('UPDATE core_tag SET x=1'))
+        self.assertFalse(
+            slow_queries.explainable('SELECT * FROM core_tag FOR UPDATE')
+        )
+
+
+@override_settings(
+    SLOW_QUERY_THRESHOLD_MS=0,
+    SLOW_QUERY_EXPLAIN_SAMPLE_RATE=1.0,
+    SLOW_QUERY_EXPLAIN_INTERVAL=0,
+)
+class SlowQueryLogTests(TestCase):
+    """Test slow API queries are logged with their plans"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_recipe_list_query_logged(self):
+        """Test the recipe list query is logged with view and plan"""
+        with self.assertLogs('core.slow_queries', level='WARNING') as logs:
+            self.client.get(reverse('recipe:recipe-list'))
+            slow_queries.log.join()
+
+        records = [json.loads(r.getMessage()) for r in logs.records]
+        recipe_queries = [
+            r for r in records if 'FROM "core_recipe"' in r['sql']
+        ]
+        self.assertEqual(len(recipe_queries), 1)
+        record = recipe_queries[0]
+        self.assertEqual(record['view'], 'recipe:recipe-list')
+        self.assertIn('"core_recipe"."user_id" = ?', record['sql'])
+        self.assertEqual(len(record['fingerprint']), 16)
+        self.assertIn('Plan', record['plan'][0])
+
+    def test_other_views_ignored(self):
+        """Test queries outside the configured namespaces are skipped"""
+        self.client.force_login(self.user)
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('core.slow_queries', level='WARNING'):
+                self.client.get(reverse('admin:index'))
+                slow_queries.log.join()
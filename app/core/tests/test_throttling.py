@@ -0,0 +1,252 @@
+"""
+Tests for throttling and admission control
+"""
+
+import asyncio
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, \
+    override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import throttling
+from core.middleware import SHED, AdmissionControlMiddleware
+
+RECIPES_URL = reverse('recipe:recipe-list')
+CREATE_USER_URL = reverse('user:create')
+TOKEN_URL = reverse('user:token')
+
+
+class Clock:
+    """Settable time source"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def api_settings(user_rate, ip_rate):
+    rest_framework = {
+        'DEFAULT_THROTTLE_CLASSES': [
+            'core.throttling.UserWindowThrottle',
+            'core.throttling.IPWindowThrottle',
+        ],
+        'DEFAULT_THROTTLE_RATES': {'user': user_rate, 'ip': ip_rate},
+        'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+        'NUM_PROXIES': settings.REST_FRAMEWORK['NUM_PROXIES'],
+    }
+    return override_settings(REST_FRAMEWORK=rest_framework)
+
+
+class WindowThrottleTests(SimpleTestCase):
+    """Test the fixed-window counting"""
+
+    def setUp(self):
+        cache.clear()
+        self.clock = Clock()
+        self.request = RequestFactory().get('/')
+        self.request.user = mock.Mock(is_authenticated=True, pk=7)
+
+    def allow(self):
+        throttle = throttling.UserWindowThrottle()
+        throttle.timer = self.clock
+        return throttle.allow_request(self.request, None), throttle
+
+    def test_parse_rate(self):
+        """Test rates become a request count and a period"""
+        self.assertEqual(throttling.parse_rate('120/min'), (120, 60))
+        self.assertEqual(throttling.parse_rate('5/s'), (5, 1))
+
+    @api_settings('3/min', None)
+    def test_window_limit_then_reset(self):
+        """Test a window allows its requests, then the next one resets"""
+        self.assertEqual([self.allow()[0] for _ in range(3)], [True] * 3)
+        allowed, throttle = self.allow()
+        self.assertFalse(allowed)
+        # The clock is 40s into the window 960-1020
+        self.assertAlmostEqual(throttle.wait(), 20.0)
+
+        self.clock.now += 20
+        self.assertEqual(
+            [self.allow()[0] for _ in range(4)], [True] * 3 + [False]
+        )
+
+    @api_settings('3/min', None)
+    def test_concurrent_requests_share_tokens(self):
+        """Test requests racing for a window are each counted"""
+        start = threading.Barrier(10)
+        results = []
+
+        def request():
+            start.wait(5)
+            results.append(self.allow()[0])
+        threads = [threading.Thread(target=request) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count(True), 3)
+
+    @api_settings('3/min', None)
+    def test_window_opened_concurrently(self):
+        """Test a request losing the race to open a window still counts"""
+        real_add = cache.add
+
+        def add(key, value, timeout):
+            real_add(key, value, timeout)
+            return False
+        with mock.patch.object(cache, 'add', side_effect=add):
+            allowed, throttle = self.allow()
+
+        self.assertTrue(allowed)
+        self.assertEqual(cache.get('throttle:user:7:16'), 2)
+
+    @api_settings(None, None)
+    def test_no_rate_allows_everything(self):
+        """Test a scope without a rate is not throttled"""
+        self.assertTrue(all(self.allow()[0] for _ in range(100)))
+
+
+class ThrottledApiTests(TestCase):
+    """Test throttling on the API"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'test@londonappdev.com', 'testpass'
+        )
+        self.client.force_authenticate(self.user)
+
+    def tearDown(self):
+        cache.clear()
+
+    @api_settings('2/min', '100/min')
+    def test_user_rate_returns_429(self):
+        """Test going over the user rate answers 429 with Retry-After"""
+        statuses = [self.client.get(RECIPES_URL).status_code
+                    for _ in range(2)]
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual(res.status_code, 429)
+        self.assertIn(int(res['Retry-After']), range(1, 61))
+
+    @api_settings('100/min', '1/min')
+    def test_ip_rate_applies_to_anonymous(self):
+        """Test anonymous clients are throttled by address"""
+        self.client.force_authenticate(None)
+        payload = {'email': 'test@londonappdev.com', 'password': 'pw'}
+        self.client.post(CREATE_USER_URL, payload)
+        res = self.client.post(CREATE_USER_URL, payload)
+
+        self.assertEqual(res.status_code, 429)
+
+    @api_settings('100/min', '1/min')
+    def test_forwarded_for_is_not_trusted(self):
+        """Test clients can't pick their address with X-Forwarded-For"""
+        self.client.force_authenticate(None)
+        payload = {'email': 'test@londonappdev.com', 'password': 'pw'}
+        self.client.post(
+            CREATE_USER_URL, payload, HTTP_X_FORWARDED_FOR='10.0.0.1',
+        )
+        res = self.client.post(
+            CREATE_USER_URL, payload, HTTP_X_FORWARDED_FOR='10.0.0.2' * 100,
+        )
+
+        self.assertEqual(res.status_code, 429)
+
+    @api_settings('100/min', '1/min')
+    def test_token_endpoint_is_throttled(self):
+        """Test logging in is throttled by address"""
+        self.client.force_authenticate(None)
+        payload = {'email': 'test@londonappdev.com', 'password': 'wrong'}
+        first = self.client.post(TOKEN_URL, payload)
+        res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(first.status_code, 400)
+        self.assertEqual(res.status_code, 429)
+
+
+@override_settings(
+    MAX_CONCURRENT_REQUESTS=1,
+    ADMISSION_QUEUE_TIMEOUT=0.05,
+    ADMISSION_RETRY_AFTER=2,
+    ADMISSION_EXEMPT_PATHS=['/healthz'],
+)
+class AdmissionControlTests(SimpleTestCase):
+    """Test concurrency limiting and load shedding"""
+
+    def setUp(self):
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.factory = RequestFactory()
+
+    def blocking_view(self, request):
+        self.entered.set()
+        self.release.wait(5)
+        return HttpResponse('ok')
+
+    def test_sheds_over_capacity(self):
+        """Test a request over the limit gets 503 once the wait times out"""
+        middleware = AdmissionControlMiddleware(self.blocking_view)
+        shed = SHED.labels('GET').collect()[0]
+        worker = threading.Thread(
+            target=middleware, args=[self.factory.get('/api/recipe/')]
+        )
+        worker.start()
+        self.entered.wait(5)
+        try:
+            res = middleware(self.factory.get('/api/recipe/'))
+            exempt = middleware(self.factory.get('/healthz'))
+        finally:
+            self.release.set()
+            worker.join()
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res['Retry-After'], '2')
+        self.assertEqual(SHED.labels('GET').collect()[0], shed + 1)
+        self.assertEqual(exempt.status_code, 200)
+        # The slot is free again
+        self.assertEqual(
+            middleware(self.factory.get('/api/recipe/')).status_code, 200
+        )
+
+    @override_settings(MAX_CONCURRENT_REQUESTS=0)
+    def test_no_limit(self):
+        """Test a limit of 0 lets every request through"""
+        middleware = AdmissionControlMiddleware(lambda r: HttpResponse('ok'))
+
+        res = middleware(self.factory.get('/'))
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_async_sheds_over_capacity(self):
+        """Test the async path queues, then sheds"""
+        async def view(request):
+            self.entered.set()
+            await asyncio.sleep(0.2)
+            return HttpResponse('ok')
+        middleware = AdmissionControlMiddleware(view)
+
+        async def run():
+            first = asyncio.ensure_future(
+                middleware(self.factory.get('/api/recipe/'))
+            )
+            await asyncio.sleep(0.01)
+            second = await middleware(self.factory.get('/api/recipe/'))
+            return (await first), second
+
+        first, second = asyncio.run(run())
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 503)
@@ -0,0 +1,111 @@
+"""
+Tests for request phase timing
+"""
+
+import json
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import timing
+from core.models import Recipe
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def server_timing(response):
+    """Return the Server-Timing header as {name: milliseconds}"""
+    phases = {}
+    for entry in response['Server-Timing'].split(', '):
+        name, duration = entry.split(';dur=')
+        phases[name] = float(duration)
+    return phases
+
+
+class SpanTests(SimpleTestCase):
+    """Test span bookkeeping"""
+
+    def test_span_without_request_is_noop(self):
+        """Test spans outside a request do nothing"""
+        with timing.span('auth'):
+            pass
+
+        self.assertIsNone(timing.current())
+
+    def test_nested_span_counted_once(self):
+        """Test a phase nested in itself is not double counted"""
+        token = timing.start()
+        try:
+            with timing.span('serialize'):
+                with timing.span('serialize'):
+                    pass
+            spans = timing.current()
+        finally:
+            timing.finish(token)
+
+        self.assertEqual(list(spans.durations), ['serialize'])
+        self.assertFalse(spans.active)
+
+
+class ServerTimingTests(TestCase):
+    """Test Server-Timing headers on API responses"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.client.force_authenticate(self.user)
+
+    def test_list_phases(self):
+        """Test the recipe list reports each phase"""
+        Recipe.objects.create(
+            user=self.user,
+            title='Sample Recipe',
+            time_minutes=5,
+            price=Decimal('5.50'),
+        )
+
+        res = self.client.get(RECIPES_URL)
+
+        phases = server_timing(res)
+        for name in ['auth', 'serialize', 'render', 'db', 'total']:
+            self.assertIn(name, phases)
+
+    def test_write_phases(self):
+        """Test tag and ingredient handling is timed on create"""
+        payload = {
+            'title': 'Curry',
+            'time_minutes': 30,
+            'price': Decimal('2.50'),
+            'tags': [{'name': 'Thai'}],
+            'ingredients': [{'name': 'Prawns'}],
+        }
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        phases = server_timing(res)
+        self.assertIn('tags', phases)
+        self.assertIn('ingredients', phases)
+
+    @override_settings(SERVER_TIMING_LOG_SAMPLE_RATE=1.0)
+    def test_sampled_log(self):
+        """Test sampled requests are logged as JSON"""
+        with self.assertLogs('core.timing', level='INFO') as logs:
+            self.client.get(RECIPES_URL)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['route'], 'api/recipe/recipes/$')
+        self.assertEqual(record['status'], 200)
+        self.assertIn('auth', record['ms'])
+
+    @override_settings(SERVER_TIMING_HEADER=False)
+    def test_header_disabled(self):
+        """Test the header can be turned off"""
+        res = self.client.get(RECIPES_URL)
+
+        self.assertNotIn('Server-Timing', res)
@@ -0,0 +1,76 @@
+"""
+Tests for the operational views
+"""
+
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from core import health
+
+
+class LazyViewTests(SimpleTestCase):
+    """Test views imported on first use"""
+
+    def test_schema_served(self):
+        """Test the API schema view loads and responds"""
+        res = self.client.get(reverse('api-schema'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn(b'openapi', res.content)
+
+
+class HealthViewTests(TestCase):
+    """Test the liveness and readiness endpoints"""
+
+    def setUp(self):
+        health.readiness.reset()
+
+    def tearDown(self):
+        health.readiness.reset()
+
+    def test_healthz(self):
+        """Test liveness needs no dependencies"""
+        with self.assertNumQueries(0):
+            res = self.client.get(reverse('healthz'))
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_readyz(self):
+        """Test readiness reports each dependency with its latency"""
+        res = self.client.get(reverse('readyz'))
+
+        self.assertEqual(res.status_code, 200)
+        checks = res.json()['checks']
+        self.assertTrue(checks['database']['ok'])
+        self.assertTrue(checks['cache']['ok'])
+        self.assertIn('ms', checks['database'])
+
+    @patch('core.health.check_database', side_effect=RuntimeError('down'))
+    def test_readyz_unavailable(self, patched_check):
+        """Test a failing dependency makes the endpoint return 503"""
+        res = self.client.get(reverse('readyz'))
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.json()['status'], 'unavailable')
+        self.assertIn('down', res.json()['checks']['database']['error'])
+
+    @override_settings(READINESS_CACHE_SECONDS=60)
+    def test_readyz_cached(self):
+        """Test repeated probes reuse the check results"""
+        self.client.get(reverse('readyz'))
+
+        with self.assertNumQueries(0):
+            res = self.client.get(reverse('readyz'))
+
+        self.assertEqual(res.status_code, 200)
+
+    @override_settings(READINESS_CACHE_SECONDS=0)
+    def test_stale_results_served_during_refresh(self):
+        """Test probes don't queue up behind a refresh in progress"""
+        health.readiness.results()
+        stale = health.readiness._results
+
+        with health.readiness._lock:
+            self.assertIs(health.readiness.results(), stale)
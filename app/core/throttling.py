@@ -0,0 +1,95 @@
+"""
+Fixed-window throttles for the API.
+
+A DEFAULT_THROTTLE_RATES entry of 'N/period' allows N requests per
+client in each period-long window. The count lives in the default cache,
+shared by every worker when it's memcached, and is bumped with
+cache.incr, which is atomic, so concurrent requests on different workers
+can't both spend the last request of a window and a request costs one
+cache round trip (two when it opens a window).
+"""
+
+import hashlib
+import math
+import time
+
+from django.core.cache import cache as default_cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """Return (requests, period in seconds) for a rate like '100/min'"""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+class WindowThrottle(BaseThrottle):
+    """Throttle keyed by get_cache_key() with the rate of scope"""
+
+    scope = None
+    cache = default_cache
+    timer = time.time
+
+    def __init__(self):
+        # Read per instance, so rate changes in settings take effect
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        self.limit, self.period = parse_rate(rate) if rate else (0, 0)
+        self._wait = None
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def allow_request(self, request, view):
+        if not self.limit:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        now = self.timer()
+        window = math.floor(now / self.period)
+        count = self.count('%s:%d' % (key, window))
+        if count > self.limit:
+            self._wait = (window + 1) * self.period - now
+            return False
+        return True
+
+    def count(self, key):
+        """Count a request in the window at key and return its total"""
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # First request of the window, unless another worker beat us
+            # to it; kept a little past the window's end
+            if self.cache.add(key, 1, self.period + 1):
+                return 1
+            return self.cache.incr(key)
+
+    def wait(self):
+        return self._wait
+
+
+class UserWindowThrottle(WindowThrottle):
+    """Per authenticated user"""
+
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return 'throttle:user:%s' % request.user.pk
+
+
+class IPWindowThrottle(WindowThrottle):
+    """Per client address, authenticated or not"""
+
+    scope = 'ip'
+
+    def get_cache_key(self, request, view):
+        # Hashed, as with NUM_PROXIES unset the ident is the client's
+        # whole X-Forwarded-For header
+        ident = hashlib.sha1(self.get_ident(request).encode()).hexdigest()
+        return 'throttle:ip:%s' % ident
@@ -0,0 +1,98 @@
+"""
+Lightweight phase timing for requests.
+
+ServerTimingMiddleware opens a Spans collection for every request; code
+marks phases with span() or @timed() and the totals are returned in a
+Server-Timing header and, for a sample of requests, logged. Outside of a
+request both are no-ops.
+"""
+
+import functools
+from contextvars import ContextVar
+from time import perf_counter
+
+_current = ContextVar('core_timing_spans', default=None)
+
+
+class Spans:
+    """Accumulated duration in seconds per phase name"""
+
+    __slots__ = ('durations', 'active')
+
+    def __init__(self):
+        self.durations = {}
+        self.active = set()
+
+    def add(self, name, duration):
+        self.durations[name] = self.durations.get(name, 0.0) + duration
+
+
+def current():
+    """Return the Spans of the request being served, if any"""
+    return _current.get()
+
+
+def start():
+    """Begin collecting spans; returns a token for finish()"""
+    return _current.set(Spans())
+
+
+def finish(token):
+    _current.reset(token)
+
+
+class span:
+    """Context manager adding the time spent in the block to a phase.
+
+    Nested spans of the same name are only counted once, so a phase can be
+    marked both around a list and around each of its items.
+    """
+
+    __slots__ = ('name', '_spans', '_start')
+
+    def __init__(self, name):
+        self.name = name
+        self._spans = None
+
+    def __enter__(self):
+        spans = _current.get()
+        if spans is not None and self.name not in spans.active:
+            spans.active.add(self.name)
+            self._spans = spans
+            self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        spans = self._spans
+        if spans is not None:
+            spans.add(self.name, perf_counter() - self._start)
+            spans.active.discard(self.name)
+            self._spans = None
+
+
+def timed(name):
+    """Decorator recording calls to the function as the phase name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TimedPhasesMixin:
+    """Time authentication and rendering of a DRF view"""
+
+    def perform_authentication(self, request):
+        with span('auth'):
+            super().perform_authentication(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        if hasattr(response, 'render') and not response.is_rendered:
+            with span('render'):
+                response.render()
+        return response
@@ -0,0 +1,51 @@
+"""
+Operational views for the project
+"""
+
+from django.http import HttpResponse, JsonResponse
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+
+from core import health, metrics
+
+
+@require_GET
+def metrics_view(request):
+    """Expose collected metrics in the Prometheus text format"""
+    return HttpResponse(
+        metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE
+    )
+
+
+@require_GET
+def healthz(request):
+    """Liveness: the process is up and serving requests"""
+    return HttpResponse('ok', content_type='text/plain')
+
+
+@require_GET
+def readyz(request):
+    """Readiness: the database and cache answer, with check latencies"""
+    results = health.readiness.results()
+    ready = all(result['ok'] for result in results.values())
+    return JsonResponse(
+        {'status': 'ok' if ready else 'unavailable', 'checks': results},
+        status=200 if ready else 503,
+    )
+
+
+def lazy_view(dotted_path, **initkwargs):
+    """Return a view that only imports the class-based view at dotted_path
+    when it is first requested, keeping rarely used, heavy views off the
+    startup path"""
+    view = None
+
+    @csrf_exempt
+    def wrapper(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(dotted_path).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    return wrapper
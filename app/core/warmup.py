@@ -0,0 +1,87 @@
+"""
+Warm-up run by `manage.py serve` so the first requests aren't slow.
+
+warm_up() runs once in the server's master process before it forks: it
+builds the URL resolvers and every serializer the views use, then closes
+the database connections (a socket must not be shared across a fork) and
+moves everything allocated so far into the GC's permanent generation, so
+collections in the workers don't write to, and un-share, the pages they
+inherited. warm_connections() runs in each worker after the fork and
+fills its connection pools.
+"""
+
+import gc
+import logging
+
+from django.conf import settings
+from django.db import connections
+from django.urls import get_resolver
+
+from core.db import pool
+
+logger = logging.getLogger(__name__)
+
+
+def _callbacks(resolver):
+    """Yield every view callback reachable from resolver"""
+    for pattern in resolver.url_patterns:
+        if hasattr(pattern, 'url_patterns'):
+            yield from _callbacks(pattern)
+        else:
+            yield pattern.callback
+
+
+def warm_resolvers():
+    """Populate the URL resolvers and return them"""
+    urlconfs = {settings.ROOT_URLCONF}
+    if getattr(settings, 'ASGI_URLCONF', None):
+        urlconfs.add(settings.ASGI_URLCONF)
+    resolvers = [get_resolver(urlconf) for urlconf in urlconfs]
+    for resolver in resolvers:
+        # Builds the reverse lookup tables of the resolver and its includes
+        resolver.reverse_dict
+    return resolvers
+
+
+def warm_serializers(resolvers):
+    """Build the fields of every serializer a DRF view uses"""
+    warmed = set()
+    for resolver in resolvers:
+        for callback in _callbacks(resolver):
+            view_class = getattr(callback, 'cls', None)
+            if view_class is None or \
+                    not hasattr(view_class, 'get_serializer_class'):
+                continue
+            actions = getattr(callback, 'actions', None) or {None: None}
+            for action in actions.values():
+                view = view_class(**getattr(callback, 'initkwargs', {}))
+                view.action = action
+                view.request = None
+                view.format_kwarg = None
+                try:
+                    serializer_class = view.get_serializer_class()
+                except AssertionError:
+                    continue
+                if serializer_class not in warmed:
+                    serializer_class().fields
+                    warmed.add(serializer_class)
+    return warmed
+
+
+def warm_up():
+    """Prepare the process to be forked into workers"""
+    warmed = warm_serializers(warm_resolvers())
+    logger.info('Warmed %d serializers', len(warmed))
+    connections.close_all()
+    pool.close_all()
+    gc.collect()
+    gc.freeze()
+
+
+def warm_connections():
+    """Open each database's connection and top up its pool"""
+    for connection in connections.all():
+        connection.ensure_connection()
+        connection.close()
+    for connection_pool in pool.all_pools():
+        connection_pool.prefill()
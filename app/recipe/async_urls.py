@@ -0,0 +1,26 @@
+"""
+Async URL patterns for the recipe API, served first under ASGI
+
+The regular patterns follow, so every name in the namespace reverses.
+"""
+
+from django.urls import re_path
+from recipe import async_views, urls
+
+app_name = "recipe"
+
+urlpatterns = [
+    re_path(r'^recipes/$', async_views.recipe_list, name='recipe-list'),
+    # Numeric only, leaving routes such as recipes/import/ to the viewset
+    re_path(
+        r'^recipes/(?P<pk>[0-9]+)/$',
+        async_views.recipe_detail,
+        name='recipe-detail',
+    ),
+    re_path(r'^tags/$', async_views.tag_list, name='tag-list'),
+    re_path(
+        r'^ingredients/$',
+        async_views.ingredient_list,
+        name='ingredient-list',
+    ),
+] + urls.urlpatterns
@@ -0,0 +1,112 @@
+"""
+Async views for reading recipes, tags and ingredients under ASGI.
+
+Each view authenticates with an async token lookup, then builds the same
+queryset and serializer as the DRF viewset on the database thread pool,
+and renders the JSON on the event loop. Other methods are handed to the
+viewset's regular view.
+"""
+
+import math
+
+from asgiref.sync import sync_to_async
+from django.db import DatabaseError
+from django.http import Http404, HttpResponse
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from core import aio, timing
+from core.db import routers, timeouts
+from recipe import views
+
+LIST_ROUTE = {'get': 'list', 'post': 'create'}
+DETAIL_ROUTE = {
+    'get': 'retrieve',
+    'put': 'update',
+    'patch': 'partial_update',
+    'delete': 'destroy',
+}
+
+authentication = aio.AsyncTokenAuthentication()
+renderer = JSONRenderer()
+
+
+def _error(exc):
+    response = HttpResponse(
+        renderer.render({'detail': exc.detail}),
+        content_type=renderer.media_type,
+        status=exc.status_code,
+    )
+    if isinstance(exc, exceptions.NotAuthenticated):
+        response['WWW-Authenticate'] = authentication.authenticate_header(None)
+    # Throttled and LockTimeout say when to come back
+    if getattr(exc, 'wait', None) is not None:
+        response['Retry-After'] = str(math.ceil(exc.wait))
+    return response
+
+
+def _read(viewset, action, request, user, token, kwargs):
+    """Serialize the viewset's response data for a GET request"""
+    request = Request(request)
+    request.user, request.auth = user, token
+    view = viewset(
+        request=request, format_kwarg=None, action=action, args=(),
+        kwargs=kwargs,
+    )
+    view.check_throttles(request)
+    try:
+        with timeouts.limits(*view.get_timeouts()), \
+                routers.replica_reads(not routers.is_pinned(request)):
+            if action == 'list':
+                queryset = view.filter_queryset(view.get_queryset())
+                if hasattr(view, 'get_list_data'):
+                    return view.get_list_data(queryset)
+                return view.get_serializer(queryset, many=True).data
+            return view.get_serializer(view.get_object()).data
+    except DatabaseError as exc:
+        raise timeouts.translate(exc, viewset.__name__)
+
+
+def async_view(viewset, route):
+    """Return an async view for a router route of viewset, serving GET
+    itself and every other method with the regular DRF view"""
+    action = route['get']
+    fallback = sync_to_async(viewset.as_view({
+        method: name for method, name in route.items()
+        if hasattr(viewset, name)
+    }))
+
+    async def view(request, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return await fallback(request, **kwargs)
+
+        try:
+            with timing.span('auth'):
+                credentials = await authentication.authenticate_async(
+                    request
+                )
+            if credentials is None:
+                raise exceptions.NotAuthenticated()
+            data = await aio.run_sync(
+                _read, viewset, action, request, *credentials, kwargs
+            )
+        except exceptions.APIException as exc:
+            return _error(exc)
+        except Http404:
+            return _error(exceptions.NotFound())
+
+        with timing.span('render'):
+            content = renderer.render(data)
+        return HttpResponse(content, content_type=renderer.media_type)
+
+    view.__name__ = '%s_%s' % (viewset.__name__, action)
+    # csrf_exempt() would wrap the coroutine function in a sync one
+    view.csrf_exempt = True
+    return view
+
+
+recipe_list = async_view(views.RecipeViewSet, LIST_ROUTE)
+recipe_detail = async_view(views.RecipeViewSet, DETAIL_ROUTE)
+tag_list = async_view(views.TagViewSet, LIST_ROUTE)
+ingredient_list = async_view(views.IngredientViewSet, LIST_ROUTE)
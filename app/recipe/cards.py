@@ -0,0 +1,78 @@
+"""
+Recipe card snapshots.
+
+With RECIPE_CARD_SNAPSHOTS on, Recipe.card holds the recipe's list
+representation, so the recipe list reads one table in index order instead
+of joining the tags and ingredients of every recipe. The API writes
+refresh the cards they affect in the same transaction as the change,
+locking the recipes first so concurrent writes can't leave a stale card
+behind. Writes from elsewhere (admin, shell) leave drift for
+`manage.py check_recipe_cards --repair`.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+
+from core.models import Ingredient, Recipe, Tag
+
+
+def enabled():
+    return settings.RECIPE_CARD_SNAPSHOTS
+
+
+def with_relations(queryset):
+    """Prefetch what a card holds, in a stable order"""
+    return queryset.prefetch_related(
+        Prefetch('tags', queryset=Tag.objects.order_by('id')),
+        Prefetch('ingredients', queryset=Ingredient.objects.order_by('id')),
+    )
+
+
+def build(recipes):
+    """Return {recipe id: card} for prefetched recipes"""
+    from recipe.serializers import RecipeSerializer
+
+    return {
+        recipe.pk: RecipeSerializer(recipe).data for recipe in recipes
+    }
+
+
+def refresh(recipe_ids):
+    """Rebuild the cards of recipe_ids inside the current transaction,
+    when snapshots are on"""
+    if enabled():
+        rebuild(recipe_ids)
+
+
+def rebuild(recipe_ids):
+    """Rebuild the cards of recipe_ids"""
+    if not recipe_ids:
+        return
+    with transaction.atomic():
+        recipes = list(with_relations(
+            Recipe.objects.filter(pk__in=recipe_ids)
+            .select_for_update(of=('self',)).order_by('pk')
+        ))
+        cards = build(recipes)
+        for recipe in recipes:
+            recipe.card = cards[recipe.pk]
+        Recipe.objects.bulk_update(recipes, ['card'])
+
+
+def recipes_with(relation, pks):
+    """Return the ids of recipes linked to the tags or ingredients pks"""
+    through = getattr(Recipe, relation).through
+    return list(through.objects.filter(
+        **{'%s_id__in' % relation[:-1]: pks}
+    ).values_list('recipe_id', flat=True).distinct())
+
+
+def list_data(queryset):
+    """Return the list representation of queryset from the cards,
+    serializing only recipes whose card hasn't been built"""
+    rows = list(queryset.values_list('pk', 'card'))
+    missing = [pk for pk, card in rows if card is None]
+    built = build(with_relations(Recipe.objects.filter(pk__in=missing))) \
+        if missing else {}
+    return [card if card is not None else built[pk] for pk, card in rows]
@@ -0,0 +1,35 @@
+"""
+Background jobs for the recipe API, run by `manage.py run_worker`
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from core.jobs import job
+from recipe import orphans, serializers
+
+
+@job('recipe.import')
+def import_recipes(user_id, recipes):
+    """Create the user's recipes, all or none, so a retry can't create
+    them twice"""
+    user = get_user_model().objects.get(pk=user_id)
+    serializer = serializers.RecipeDetailSerializer(data=recipes, many=True)
+    serializer.is_valid(raise_exception=True)
+    with transaction.atomic():
+        created = serializer.save(user=user)
+    return {'recipes': [recipe.pk for recipe in created]}
+
+
+@job('recipe.collect_orphans', max_attempts=1)
+def collect_orphans():
+    """Delete unused tags and ingredients; the next run retries what
+    this one skipped"""
+    return {
+        relation: orphans.collect(
+            relation, settings.ORPHANS_BATCH_SIZE, settings.ORPHANS_PAUSE,
+            settings.ORPHANS_MAX_REPLICA_LAG, settings.ORPHANS_LOCK_TIMEOUT_MS,
+        )[0]
+        for relation in orphans.RELATIONS
+    }
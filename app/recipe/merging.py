@@ -0,0 +1,90 @@
+"""
+Merging tags or ingredients into one.
+
+merge() moves every recipe link of the sources to the target with one
+DELETE and one UPDATE of the through table, whatever the number of
+recipes: links that would repeat one the recipe already has, to the
+target or to another source, are deleted first, then the rest are
+repointed, and the sources deleted. It runs in the caller's transaction,
+with the target and sources locked, so a concurrent rename or delete of
+any of them waits for the merge, and checks the sources exist and the
+new name is free only once they are locked.
+"""
+
+from django.db import IntegrityError, connection, transaction
+from django.http import Http404
+from rest_framework.exceptions import ValidationError
+
+from core import outbox
+from core.models import Recipe, normalize_name
+from recipe import cards
+
+NAME_IN_USE = 'This name is already in use; merge that one too.'
+
+DEDUPE_SQL = '''
+    DELETE FROM {through} AS s
+    WHERE s.{column} = ANY(%(sources)s) AND EXISTS (
+        SELECT 1 FROM {through} AS o
+        WHERE o.{recipe} = s.{recipe} AND (
+            o.{column} = %(target)s
+            OR (o.{column} = ANY(%(sources)s) AND o.id < s.id)
+        )
+    )
+'''
+
+REPOINT_SQL = '''
+    UPDATE {through} SET {column} = %(target)s
+    WHERE {column} = ANY(%(sources)s)
+'''
+
+
+def merge(relation, target, source_ids, name=None):
+    """Merge the target user's tags or ingredients source_ids into target,
+    renaming it to name if given; return the ids of the recipes changed"""
+    field = getattr(Recipe, relation).field
+    model = field.related_model
+    names = {
+        'through': field.remote_field.through._meta.db_table,
+        'column': field.m2m_reverse_name(),
+        'recipe': field.m2m_column_name(),
+    }
+    params = {'target': target.pk, 'sources': list(source_ids)}
+
+    # In primary key order, so concurrent merges can't deadlock
+    locked = set(model.objects.select_for_update().filter(
+        user_id=target.user_id, pk__in=[target.pk, *source_ids],
+    ).order_by('pk').values_list('pk', flat=True))
+    if target.pk not in locked:
+        raise Http404
+    unknown = set(source_ids) - locked
+    if unknown:
+        raise ValidationError({'sources': [
+            'Not found: %s.' % ', '.join(map(str, sorted(unknown)))
+        ]})
+    if name is not None and model.objects.filter(
+        user_id=target.user_id, normalized_name=normalize_name(name),
+    ).exclude(pk__in=locked).exists():
+        raise ValidationError({'name': [NAME_IN_USE]})
+
+    recipe_ids = cards.recipes_with(relation, source_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(DEDUPE_SQL.format(**names), params)
+        cursor.execute(REPOINT_SQL.format(**names), params)
+    model.objects.filter(pk__in=source_ids).delete()
+    if name is not None:
+        # Once the sources, which may hold the name, are gone
+        target.name = name
+        try:
+            with transaction.atomic():
+                target.save(update_fields=['name', 'normalized_name'])
+        except IntegrityError:
+            # Another row was renamed to it since the check
+            raise ValidationError({'name': [NAME_IN_USE]})
+        recipe_ids = cards.recipes_with(relation, [target.pk])
+
+    cards.refresh(recipe_ids)
+    outbox.publish(target.user_id, '%s.merged' % relation[:-1], {
+        'id': target.pk, 'name': target.name, 'sources': list(source_ids),
+        'recipes': recipe_ids,
+    })
+    return recipe_ids
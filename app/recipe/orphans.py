@@ -0,0 +1,124 @@
+"""
+Garbage collection of tags and ingredients no recipe uses.
+
+RecipeSerializer.update replaces a recipe's tags and ingredients and
+nothing deletes the ones left behind. collect() walks a table in windows
+of primary keys, deleting each window's orphans with an anti-join against
+the through table, in a transaction of its own under a short lock_timeout:
+a window whose rows are busy is skipped until the next run rather than
+waited on. Between windows it pauses, and waits while any standby replays
+more than max_lag seconds behind, so the deletes don't pile up WAL faster
+than the replicas apply it. Each deleted row is published to the outbox
+like a delete through the API.
+"""
+
+import logging
+import time
+
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import Max
+from psycopg2 import errors
+
+from core import metrics, outbox
+from core.db import timeouts
+from core.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+RELATIONS = ('tags', 'ingredients')
+
+DELETED = metrics.Counter(
+    'orphans_deleted_total', 'Unused tags and ingredients deleted',
+    ['relation'],
+)
+
+ORPHANS_SQL = '''
+    FROM {table} AS t
+    WHERE t.id > %s AND t.id <= %s AND NOT EXISTS (
+        SELECT 1 FROM {through} AS r WHERE r.{column} = t.id
+    )
+'''
+
+
+def replica_lag():
+    """Return how many seconds the furthest behind standby is replaying,
+    as far as pg_stat_replication shows this role"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT COALESCE(EXTRACT(EPOCH FROM max(replay_lag)), 0) '
+            'FROM pg_stat_replication'
+        )
+        return float(cursor.fetchone()[0])
+
+
+def wait_for_replicas(max_lag):
+    while True:
+        lag = replica_lag()
+        if lag <= max_lag:
+            return
+        logger.info('Waiting for replicas %.1fs behind', lag)
+        time.sleep(min(lag, 5))
+
+
+def windows(model, size):
+    """Yield (after, up to) primary key ranges of about size rows, up to
+    the largest key when the walk starts"""
+    stop = model.objects.aggregate(last=Max('pk'))['last']
+    after = 0
+    while stop is not None and after < stop:
+        ends = list(model.objects.filter(pk__gt=after).order_by('pk')
+                    .values_list('pk', flat=True)[size - 1:size])
+        end = min(ends[0], stop) if ends else stop
+        yield after, end
+        after = end
+
+
+def collect(relation, batch_size, pause, max_lag, lock_timeout,
+            dry_run=False):
+    """Delete the tags or ingredients that no recipe uses; return
+    (found, windows skipped)"""
+    field = getattr(Recipe, relation).field
+    model = field.related_model
+    sql = ORPHANS_SQL.format(
+        table=model._meta.db_table,
+        through=field.remote_field.through._meta.db_table,
+        column=field.m2m_reverse_name(),
+    )
+    found = skipped = 0
+    with timeouts.limits(lock_timeout=lock_timeout):
+        for after, end in windows(model, batch_size):
+            if dry_run:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT count(*) ' + sql, [after, end])
+                    found += cursor.fetchone()[0]
+                continue
+            try:
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(
+                        'DELETE ' + sql + 'RETURNING t.id, t.user_id, t.name',
+                        [after, end],
+                    )
+                    rows = cursor.fetchall()
+                    outbox.publish_many([
+                        (user_id, '%s.deleted' % relation[:-1], {
+                            'id': pk, 'name': name, 'recipes': [],
+                        })
+                        for pk, user_id, name in rows
+                    ])
+            except IntegrityError:
+                # A recipe took up one of the rows while it was deleted
+                skipped += 1
+                continue
+            except DatabaseError as e:
+                if not isinstance(e.__cause__, (
+                    errors.LockNotAvailable, errors.QueryCanceled
+                )):
+                    raise
+                skipped += 1
+                continue
+            found += len(rows)
+            DELETED.labels(relation).inc(len(rows))
+            if rows:
+                time.sleep(pause)
+                wait_for_replicas(max_lag)
+    return found, skipped
@@ -1,10 +1,38 @@
 """Serializers for Recipe API"""
 
-from tkinter import N
+from django.conf import settings
+from django.db import models, transaction
 from rest_framework import serializers
-from core.models import Recipe, Tag, Ingredient
-
-class IngredientSerializer(serializers.ModelSerializer):
+from core.models import (
+    NORMALIZED_NAME_MAX_BYTES, Recipe, Tag, Ingredient, normalize_name,
+)
+from core import outbox, timing
+from recipe import cards
+
+def validate_normalized_length(value):
+    """Refuse names whose normalized form ('ﷺ' becomes 18 characters) is
+    too long for the unique index on it"""
+    if len(normalize_name(value).encode()) > NORMALIZED_NAME_MAX_BYTES:
+        raise serializers.ValidationError(
+            'This name is too long once normalized.'
+        )
+    return value
+
+class NameSerializer(serializers.ModelSerializer):
+    """Serializer for models named per user, such as tags"""
+
+    def validate_name(self, value):
+        """Refuse renaming to the name of another of the user's rows"""
+        validate_normalized_length(value)
+        if self.instance is not None and type(self.instance).objects.filter(
+            user=self.instance.user, normalized_name=normalize_name(value),
+        ).exclude(pk=self.instance.pk).exists():
+            raise serializers.ValidationError(
+                'This name is already in use; merge the two instead.'
+            )
+        return value
+
+class IngredientSerializer(NameSerializer):
     """Serializer for Ingredients"""
 
     class Meta:
@@ -12,7 +40,7 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
         read_only_fields = ['id']
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(NameSerializer):
     """Serializers for Tags"""
 
     class Meta:
@@ -20,31 +48,61 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id','name']
         read_only_fields = ['id']
 
+class ByIdListSerializer(serializers.ListSerializer):
+    """List of a recipe's tags or ingredients in id order, as the recipe
+    cards hold them, whether prefetched or not"""
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        return super().to_representation(sorted(data, key=lambda obj: obj.pk))
+
 class RecipeSerializer(serializers.ModelSerializer):
     """Serializers for Recipes"""
 
-    tags = TagSerializer(many=True, required=False) ## (many=True) --> List of Tags
-    ingredients = IngredientSerializer(many=True, required=False)
+    tags = ByIdListSerializer(child=TagSerializer(), required=False) ## List of Tags
+    ingredients = ByIdListSerializer(
+        child=IngredientSerializer(), required=False,
+    )
 
     class Meta:
         model = Recipe
         fields = ['id', 'title', 'time_minutes', 'price', 'link', 'tags', 'ingredients']
         read_only_fields = ['id']
 
+    def to_representation(self, instance):
+        """Serialize Recipe, timed as the serialize phase"""
+        with timing.span('serialize'):
+            return super().to_representation(instance)
+
+    @timing.timed('tags')
     def _get_or_create_tags(self, tags, recipe):
         """Handle getting or creating tags as needed"""
-        auth_user = self.context['request'].user
+        auth_user = recipe.user
+        ## Locked, so collect_orphans can't delete them before we commit
+        tag_objects = Tag.objects.select_for_update(no_key=True)
         for tag in tags:
-            tag_obj, created = Tag.objects.get_or_create(user=auth_user, **tag) ## **tag used for if any changes in Tags happen then no modifications needed
+            ## "Vegan" reuses an existing "vegan ", keeping its spelling
+            tag_obj, created = tag_objects.get_or_create(
+                user=auth_user, normalized_name=normalize_name(tag['name']),
+                defaults=tag,
+            )
             recipe.tags.add(tag_obj)
 
+    @timing.timed('ingredients')
     def _get_or_create_ingredients(self, ingredients, recipe):
         """Handle getting / creating tags as needed"""
-        auth_user = self.context['request'].user
+        auth_user = recipe.user
+        ing_objects = Ingredient.objects.select_for_update(no_key=True)
         for ingredient in ingredients:
-            ing_obj, created = Ingredient.objects.get_or_create(user=auth_user, **ingredient)
+            ing_obj, created = ing_objects.get_or_create(
+                user=auth_user,
+                normalized_name=normalize_name(ingredient['name']),
+                defaults=ingredient,
+            )
             recipe.ingredients.add(ing_obj)
 
+    @transaction.atomic
     def create(self, validated_data):
         """Create a Recipe"""
         tags = validated_data.pop('tags',[])
@@ -52,9 +110,12 @@ class RecipeSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(**validated_data)
         self._get_or_create_tags(tags, recipe)
         self._get_or_create_ingredients(ingredients, recipe)
+        cards.refresh([recipe.pk])
+        outbox.publish(recipe.user_id, 'recipe.created', RecipeSerializer(recipe).data)
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Update Recipe"""
         tags = validated_data.pop('tags', None)
@@ -75,6 +136,8 @@ class RecipeSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
 
         instance.save()
+        cards.refresh([instance.pk])
+        outbox.publish(instance.user_id, 'recipe.updated', RecipeSerializer(instance).data)
         return instance
 
 # Detail Serializer of original
@@ -84,4 +147,23 @@ class RecipeDetailSerializer(RecipeSerializer):
     class Meta(RecipeSerializer.Meta):
         fields = RecipeSerializer.Meta.fields + ['description']
 
+class RecipeImportSerializer(serializers.Serializer):
+    """Serializer for importing recipes in the background"""
+
+    recipes = RecipeDetailSerializer(many=True, allow_empty=False)
+
+    def validate_recipes(self, value):
+        if len(value) > settings.RECIPE_IMPORT_MAX_RECIPES:
+            raise serializers.ValidationError(
+                'At most %d recipes per import.' % settings.RECIPE_IMPORT_MAX_RECIPES
+            )
+        return value
+
+class MergeSerializer(serializers.Serializer):
+    """Serializer for merging tags or ingredients into one"""
 
+    sources = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    name = serializers.CharField(
+        max_length=255, required=False,
+        validators=[validate_normalized_length],
+    )
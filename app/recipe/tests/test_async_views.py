@@ -0,0 +1,120 @@
+"""
+Tests for the async recipe views served under ASGI
+"""
+
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import AsyncClient, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from core.asgi import ASGIHandler
+from core.models import Recipe, Tag
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+# The views read on their own thread pool, so data has to be committed
+@override_settings(ROOT_URLCONF='app.asgi_urls')
+class AsyncRecipeViewTests(TransactionTestCase):
+    """Test the async list and retrieve views"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com',
+            'testpass123',
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=30,
+            price=Decimal('2.50'),
+        )
+        self.recipe.tags.add(Tag.objects.create(user=self.user, name='Hot'))
+        other = get_user_model().objects.create_user(
+            'other@example.com',
+            'testpass123',
+        )
+        self.other_recipe = Recipe.objects.create(
+            user=other, title='Salad', time_minutes=5, price=Decimal('1'),
+        )
+        self.client = AsyncClient()
+        # Django 3.2's AsyncClient takes headers per request
+        self.auth = {'AUTHORIZATION': 'Token %s' % self.token.key}
+
+    async def test_list_recipes(self):
+        """Test the list only holds the user's recipes"""
+        res = await self.client.get(RECIPES_URL, **self.auth)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'application/json')
+        data = res.json()
+        self.assertEqual([r['title'] for r in data], ['Curry'])
+        self.assertEqual(data[0]['tags'][0]['name'], 'Hot')
+        self.assertIn('Server-Timing', res)
+
+    async def test_retrieve_recipe(self):
+        """Test retrieving a recipe uses the detail serializer"""
+        res = await self.client.get(detail_url(self.recipe.id), **self.auth)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['title'], 'Curry')
+        self.assertIn('description', res.json())
+
+    async def test_other_users_recipe_not_found(self):
+        """Test another user's recipe is a 404"""
+        res = await self.client.get(
+            detail_url(self.other_recipe.id), **self.auth
+        )
+
+        self.assertEqual(res.status_code, 404)
+
+    async def test_list_tags(self):
+        """Test the tag list"""
+        res = await self.client.get(TAGS_URL, **self.auth)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([t['name'] for t in res.json()], ['Hot'])
+
+    async def test_auth_required(self):
+        """Test requests without a valid token are rejected"""
+        res = await self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(res['WWW-Authenticate'], 'Token')
+
+        res = await self.client.get(
+            RECIPES_URL, AUTHORIZATION='Token invalid'
+        )
+        self.assertEqual(res.status_code, 401)
+
+    async def test_create_handled_by_viewset(self):
+        """Test writes fall through to the DRF view"""
+        res = await self.client.post(RECIPES_URL, {
+            'title': 'Soup',
+            'time_minutes': 10,
+            'price': '3.00',
+        }, content_type='application/json', **self.auth)
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json()['title'], 'Soup')
+
+
+class ASGIHandlerTests(TransactionTestCase):
+    """Test the ASGI handler selects the async URLconf"""
+
+    def test_request_urlconf(self):
+        """Test requests resolve against ASGI_URLCONF"""
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': RECIPES_URL,
+            'query_string': b'', 'headers': [],
+        }
+
+        request, error = ASGIHandler().create_request(scope, None)
+
+        self.assertIsNone(error)
+        self.assertEqual(request.urlconf, 'app.asgi_urls')
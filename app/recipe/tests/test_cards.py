@@ -0,0 +1,169 @@
+"""
+Tests for recipe card snapshots
+"""
+
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.models import Prefetch
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, Recipe, Tag
+from recipe import cards
+from recipe.serializers import RecipeSerializer
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def detail_url(recipe_id):
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def tag_url(tag_id):
+    return reverse('recipe:tag-detail', args=[tag_id])
+
+
+def ingredient_url(ingredient_id):
+    return reverse('recipe:ingredient-detail', args=[ingredient_id])
+
+
+@override_settings(RECIPE_CARD_SNAPSHOTS=True)
+class RecipeCardTests(TestCase):
+    """Test cards are kept current by API writes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'testpass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Curry', 'time_minutes': 30, 'price': '2.50',
+            'tags': [{'name': 'Hot'}, {'name': 'Dinner'}],
+            'ingredients': [{'name': 'Rice'}],
+        }, format='json')
+        self.recipe = Recipe.objects.get(pk=res.data['id'])
+
+    def card(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.card
+
+    def test_card_matches_list(self):
+        """Test the card is what the list serializer produces"""
+        with self.settings(RECIPE_CARD_SNAPSHOTS=False):
+            serialized = self.client.get(RECIPES_URL).json()
+
+        self.assertEqual(self.card(), serialized[0])
+        self.assertEqual(self.client.get(RECIPES_URL).json(), serialized)
+
+    def test_relations_in_id_order(self):
+        """Test the live serializer orders relations by id, as cards do"""
+        recipe = Recipe.objects.prefetch_related(
+            Prefetch('tags', queryset=Tag.objects.order_by('-id')),
+        ).get(pk=self.recipe.pk)
+
+        tags = RecipeSerializer(recipe).data['tags']
+
+        self.assertEqual(
+            [t['id'] for t in tags],
+            sorted(self.recipe.tags.values_list('id', flat=True)),
+        )
+        self.assertEqual(tags, self.card()['tags'])
+
+    def test_detail_skips_card(self):
+        """Test reading one recipe doesn't load its card"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(detail_url(self.recipe.id))
+
+        self.assertNotIn('"card"', queries.captured_queries[0]['sql'])
+
+    def test_list_reads_one_table(self):
+        """Test the list is one query with every card built"""
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.json()[0]['title'], 'Curry')
+
+    def test_missing_card_serialized(self):
+        """Test recipes without a card are still listed"""
+        Recipe.objects.create(
+            user=self.user, title='Salad', time_minutes=5,
+            price=Decimal('1.00'),
+        )
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual([r['title'] for r in res.json()], ['Salad', 'Curry'])
+
+    def test_recipe_update(self):
+        """Test updating a recipe refreshes its card"""
+        self.client.patch(detail_url(self.recipe.id), {
+            'title': 'Green curry', 'tags': [{'name': 'Mild'}],
+        }, format='json')
+
+        card = self.card()
+        self.assertEqual(card['title'], 'Green curry')
+        self.assertEqual([t['name'] for t in card['tags']], ['Mild'])
+
+    def test_tag_rename_and_delete(self):
+        """Test renaming or deleting a tag refreshes the recipes using it"""
+        hot = Tag.objects.get(name='Hot')
+
+        self.client.patch(tag_url(hot.id), {'name': 'Spicy'})
+        renamed = [t['name'] for t in self.card()['tags']]
+        self.client.delete(tag_url(hot.id))
+        deleted = [t['name'] for t in self.card()['tags']]
+
+        self.assertEqual(renamed, ['Spicy', 'Dinner'])
+        self.assertEqual(deleted, ['Dinner'])
+
+    def test_ingredient_rename(self):
+        """Test renaming an ingredient refreshes the recipes using it"""
+        rice = Ingredient.objects.get(name='Rice')
+
+        self.client.patch(ingredient_url(rice.id), {'name': 'Basmati'})
+
+        self.assertEqual(self.card()['ingredients'][0]['name'], 'Basmati')
+
+
+class CheckRecipeCardsTests(TestCase):
+    """Test the check_recipe_cards command"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user(
+            'user@example.com', 'testpass123'
+        )
+        self.recipe = Recipe.objects.create(
+            user=user, title='Curry', time_minutes=30, price=Decimal('2.50'),
+        )
+        self.recipe.tags.add(Tag.objects.create(user=user, name='Hot'))
+
+    def test_reports_and_repairs_drift(self):
+        """Test missing and stale cards are found, then rebuilt"""
+        other = Recipe.objects.create(
+            user=self.recipe.user, title='Salad', time_minutes=5,
+            price=Decimal('1.00'),
+        )
+        cards.rebuild([other.pk])
+        Recipe.objects.filter(pk=other.pk).update(title='Green salad')
+
+        with self.assertRaises(CommandError):
+            call_command('check_recipe_cards', stdout=StringIO())
+        out = StringIO()
+        call_command('check_recipe_cards', repair=True, stdout=out)
+
+        self.assertIn('1 missing, 1 stale', out.getvalue())
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.card['tags'][0]['name'], 'Hot')
+        other.refresh_from_db()
+        self.assertEqual(other.card['title'], 'Green salad')
+        out = StringIO()
+        call_command('check_recipe_cards', batch_size=1, stdout=out)
+        self.assertIn('All cards are current', out.getvalue())
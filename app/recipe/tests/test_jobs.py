@@ -0,0 +1,80 @@
+"""
+Tests for the recipe background jobs
+"""
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import resolve, reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import jobs
+from core.models import Job, Recipe, Tag
+
+IMPORT_URL = reverse('recipe:recipe-import-recipes')
+
+
+def recipe(title, **params):
+    return {'title': title, 'time_minutes': 10, 'price': '1.50', **params}
+
+
+class RecipeImportTests(TestCase):
+    """Test importing recipes in the background"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'user@example.com', 'testpass123'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def run_jobs(self):
+        return [jobs.run(job) for job in jobs.claim('test', ['default'], 10)]
+
+    def test_import_queues_job(self):
+        """Test importing answers at once with the job to poll"""
+        res = self.client.post(IMPORT_URL, {'recipes': [
+            recipe('Curry', tags=[{'name': 'Hot'}]), recipe('Soup'),
+        ]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res['Location'], reverse(
+            'job-detail', args=[res.data['id']]
+        ))
+        self.assertEqual(res.data['status'], Job.QUEUED)
+        self.assertFalse(Recipe.objects.exists())
+
+        self.assertEqual(self.run_jobs(), [Job.SUCCEEDED])
+        recipes = Recipe.objects.filter(user=self.user).order_by('id')
+        self.assertEqual([r.title for r in recipes], ['Curry', 'Soup'])
+        self.assertEqual(
+            list(recipes[0].tags.values_list('name', flat=True)), ['Hot']
+        )
+        self.assertEqual(Tag.objects.get().user, self.user)
+        job = self.client.get(res['Location']).data
+        self.assertEqual(job['status'], Job.SUCCEEDED)
+        self.assertEqual(job['result'], {'recipes': [r.id for r in recipes]})
+
+    def test_import_invalid(self):
+        """Test invalid recipes are refused before queueing"""
+        res = self.client.post(IMPORT_URL, {'recipes': [
+            recipe('Curry'), {'title': 'No time'},
+        ]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(RECIPE_IMPORT_MAX_RECIPES=1)
+    def test_import_limit(self):
+        """Test an import can't hold too many recipes"""
+        res = self.client.post(IMPORT_URL, {'recipes': [
+            recipe('Curry'), recipe('Soup'),
+        ]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_import_route_under_asgi(self):
+        """Test the async recipe detail view doesn't take the route"""
+        match = resolve(IMPORT_URL, urlconf='app.asgi_urls')
+
+        self.assertEqual(match.url_name, 'recipe-import-recipes')
@@ -0,0 +1,226 @@
+"""
+Tests for merging tags and ingredients
+"""
+
+import threading
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient, OutboxEvent, Recipe, Tag
+
+
+def merge_url(relation, pk):
+    return reverse('recipe:%s-merge' % relation, args=[pk])
+
+
+class MergeTests(TestCase):
+    """Test merging tags and ingredients into one"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('ann@example.com', 'pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.target = Tag.objects.create(user=self.user, name='Vegan')
+        self.sources = [
+            Tag.objects.create(user=self.user, name='Plant based'),
+            Tag.objects.create(user=self.user, name='Veggie'),
+        ]
+
+    def create_recipe(self, *tags):
+        recipe = Recipe.objects.create(
+            user=self.user, title='Salad', time_minutes=5,
+            price=Decimal('1.00'),
+        )
+        recipe.tags.add(*tags)
+        return recipe
+
+    def merge(self, **data):
+        data.setdefault('sources', [tag.id for tag in self.sources])
+        return self.client.post(
+            merge_url('tag', self.target.id), data, format='json'
+        )
+
+    def test_merge_tags(self):
+        """Test every recipe ends up with the target, once"""
+        hot = Tag.objects.create(user=self.user, name='Hot')
+        recipes = [
+            self.create_recipe(self.target),
+            self.create_recipe(self.sources[0], hot),
+            self.create_recipe(self.target, *self.sources),
+            self.create_recipe(*self.sources),
+        ]
+
+        res = self.merge()
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, {'id': self.target.id, 'name': 'Vegan'})
+        self.assertEqual(
+            list(Tag.objects.order_by('id')), [self.target, hot]
+        )
+        for recipe in recipes:
+            self.assertEqual(
+                list(recipe.tags.filter(name='Vegan')), [self.target]
+            )
+        self.assertEqual(list(recipes[1].tags.order_by('id')),
+                         [self.target, hot])
+        self.assertEqual(Recipe.tags.through.objects.count(), 5)
+
+        event = OutboxEvent.objects.get(topic='tag.merged')
+        self.assertEqual(event.payload['sources'],
+                         [tag.id for tag in self.sources])
+        self.assertEqual(sorted(event.payload['recipes']),
+                         [r.id for r in recipes[1:]])
+
+    def test_merge_and_rename(self):
+        """Test the target can be renamed in the same request"""
+        res = self.merge(name='vegan')
+
+        self.assertEqual(res.data['name'], 'vegan')
+        self.target.refresh_from_db()
+        self.assertEqual(self.target.name, 'vegan')
+
+    def test_merge_and_rename_to_source_name(self):
+        """Test the target can take the name of one of its sources"""
+        res = self.merge(name='veggie')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(Tag.objects.get().name, 'veggie')
+
+    def test_merge_and_rename_to_other_name_refused(self):
+        """Test the target can't take the name of a tag left over"""
+        Tag.objects.create(user=self.user, name='Hot')
+
+        res = self.merge(name='HOT')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.count(), 4)
+
+    def test_queries_independent_of_recipes(self):
+        """Test a merge costs the same whatever the number of recipes"""
+        def count(recipes):
+            for _ in range(recipes):
+                self.create_recipe(*self.sources)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.merge().status_code, 200)
+            self.sources = [
+                Tag.objects.create(user=self.user, name=name)
+                for name in ('Plant based', 'Veggie')
+            ]
+            return len(queries)
+
+        self.assertEqual(count(2), count(20))
+
+    @override_settings(RECIPE_CARD_SNAPSHOTS=True)
+    def test_merge_refreshes_cards(self):
+        """Test the cards of the recipes changed are rebuilt"""
+        recipe = self.create_recipe(self.sources[1])
+
+        self.merge()
+
+        recipe.refresh_from_db()
+        self.assertEqual(
+            recipe.card['tags'], [{'id': self.target.id, 'name': 'Vegan'}]
+        )
+
+    def test_merge_other_users_source_refused(self):
+        """Test only the user's own tags can be merged"""
+        other = get_user_model().objects.create_user(
+            'bob@example.com', 'pass12345'
+        )
+        theirs = Tag.objects.create(user=other, name='Veggie')
+
+        res = self.merge(sources=[self.sources[0].id, theirs.id])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Tag.objects.count(), 4)
+
+    def test_merge_into_source_refused(self):
+        """Test the target can't be one of the sources"""
+        res = self.merge(sources=[self.target.id, self.sources[0].id])
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_merge_into_other_users_tag(self):
+        """Test another user's target is not found"""
+        other = get_user_model().objects.create_user(
+            'bob@example.com', 'pass12345'
+        )
+        self.target = Tag.objects.create(user=other, name='Vegan')
+
+        res = self.merge()
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_merge_ingredients(self):
+        """Test merging ingredients"""
+        salt, sea_salt = (
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('Salt', 'Sea salt')
+        )
+        recipe = self.create_recipe()
+        recipe.ingredients.add(salt, sea_salt)
+
+        res = self.client.post(
+            merge_url('ingredient', salt.id), {'sources': [sea_salt.id]},
+            format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(recipe.ingredients.all()), [salt])
+        self.assertFalse(Ingredient.objects.filter(pk=sea_salt.pk).exists())
+
+
+# The delete is made by another connection, which the merge must wait for
+class MergeRaceTests(TransactionTestCase):
+    """Test merges check their sources once they hold them locked"""
+
+    def merge(self, url, data, results):
+        try:
+            client = APIClient()
+            client.force_authenticate(self.user)
+            results.append(client.post(url, data, format='json'))
+        finally:
+            connection.close()
+
+    def test_source_deleted_during_merge(self):
+        self.user = get_user_model().objects.create_user(
+            'ann@example.com', 'pass12345'
+        )
+        target = Tag.objects.create(user=self.user, name='Vegan')
+        source = Tag.objects.create(user=self.user, name='Veggie')
+        other = connection.Database.connect(
+            **connection.get_connection_params()
+        )
+        results = []
+        try:
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM core_tag WHERE id = %s', [source.pk]
+                )
+            thread = threading.Thread(target=self.merge, args=[
+                merge_url('tag', target.id), {'sources': [source.id]},
+                results,
+            ])
+            thread.start()
+            # The merge waits on the deleted row's lock
+            thread.join(0.2)
+            other.commit()
+            thread.join()
+        finally:
+            other.close()
+
+        self.assertEqual(results[0].status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            results[0].data, {'sources': ['Not found: %d.' % source.pk]}
+        )
+        self.assertFalse(OutboxEvent.objects.filter(
+            topic='tag.merged'
+        ).exists())
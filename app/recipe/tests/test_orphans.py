@@ -0,0 +1,190 @@
+"""
+Tests for collecting unused tags and ingredients
+"""
+
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import jobs
+from core.models import Ingredient, Job, OutboxEvent, Recipe, Tag
+from recipe import cards, orphans
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def collect(relation, batch_size=1000, dry_run=False):
+    return orphans.collect(relation, batch_size, 0, 5.0, 100, dry_run)
+
+
+class CollectOrphansTests(TestCase):
+    """Test deleting tags and ingredients no recipe uses"""
+
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user('ann@example.com', 'pass12345')
+        other = User.objects.create_user('bob@example.com', 'pass12345')
+        self.recipe = Recipe.objects.create(
+            user=self.user, title='Curry', time_minutes=30,
+            price=Decimal('2.50'),
+        )
+        self.used = Tag.objects.create(user=self.user, name='Hot')
+        self.recipe.tags.add(self.used)
+        self.unused = [
+            Tag.objects.create(user=self.user, name='Cold'),
+            Tag.objects.create(user=other, name='Mild'),
+            Tag.objects.create(user=self.user, name='Sweet'),
+        ]
+        self.recipe.ingredients.add(
+            Ingredient.objects.create(user=self.user, name='Rice')
+        )
+        Ingredient.objects.create(user=self.user, name='Salt')
+
+    def test_deletes_unused_only(self):
+        """Test unused rows go, in windows smaller than the table"""
+        found, skipped = collect('tags', batch_size=2)
+
+        self.assertEqual((found, skipped), (3, 0))
+        self.assertEqual(list(Tag.objects.all()), [self.used])
+        self.assertEqual(collect('ingredients'), (1, 0))
+        self.assertEqual(
+            list(Ingredient.objects.values_list('name', flat=True)), ['Rice']
+        )
+
+    def test_publishes_deletes(self):
+        """Test each deleted row is published like an API delete"""
+        collect('tags')
+
+        events = OutboxEvent.objects.order_by('payload__id')
+        self.assertEqual(
+            [(e.topic, e.user_id, e.payload) for e in events],
+            [('tag.deleted', tag.user_id, {
+                'id': tag.id, 'name': tag.name, 'recipes': [],
+            }) for tag in self.unused],
+        )
+
+    def test_dry_run(self):
+        """Test a dry run only counts"""
+        self.assertEqual(collect('tags', dry_run=True), (3, 0))
+        self.assertEqual(Tag.objects.count(), 4)
+
+    def test_collects_tags_left_by_update(self):
+        """Test tags replaced on a recipe are collected"""
+        Tag.objects.filter(pk__in=[t.pk for t in self.unused]).delete()
+        self.recipe.tags.set([
+            Tag.objects.create(user=self.user, name='Spicy')
+        ])
+
+        collect('tags')
+
+        self.assertEqual(
+            list(Tag.objects.values_list('name', flat=True)), ['Spicy']
+        )
+
+    @patch('recipe.orphans.time.sleep')
+    @patch('recipe.orphans.replica_lag', side_effect=[12.0, 3.0])
+    def test_waits_for_replicas(self, replica_lag, sleep):
+        """Test deleting waits while replicas lag too far behind"""
+        collect('tags')
+
+        self.assertEqual(replica_lag.call_count, 2)
+        sleep.assert_any_call(5)
+
+    def test_replica_lag_without_replicas(self):
+        """Test no replicas means no lag"""
+        self.assertEqual(orphans.replica_lag(), 0)
+
+    def test_command(self):
+        """Test the command collects both tables"""
+        out = StringIO()
+
+        call_command('collect_orphans', pause=0, stdout=out)
+
+        self.assertIn('Deleted 3 unused tags.', out.getvalue())
+        self.assertIn('Deleted 1 unused ingredients.', out.getvalue())
+
+    def test_job(self):
+        """Test the periodic job collects both tables"""
+        jobs.enqueue('recipe.collect_orphans')
+        job, = jobs.claim('test', ['default'], 1)
+
+        jobs.run(job)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.result, {'tags': 3, 'ingredients': 1})
+
+
+# The lock is held by another connection, which must see the rows
+class CollectOrphansLockTests(TransactionTestCase):
+    """Test rows locked elsewhere are skipped, not waited for"""
+
+    def test_skips_locked_window(self):
+        user = get_user_model().objects.create_user(
+            'ann@example.com', 'pass12345'
+        )
+        locked = Tag.objects.create(user=user, name='Cold')
+        free = Tag.objects.create(user=user, name='Mild')
+        other = connection.Database.connect(
+            **connection.get_connection_params()
+        )
+        try:
+            with other.cursor() as cursor:
+                cursor.execute(
+                    'SELECT id FROM core_tag WHERE id = %s FOR UPDATE',
+                    [locked.pk],
+                )
+            found, skipped = collect('tags', batch_size=1)
+        finally:
+            other.close()
+
+        self.assertEqual((found, skipped), (1, 1))
+        self.assertEqual(list(Tag.objects.all()), [locked])
+        self.assertFalse(Tag.objects.filter(pk=free.pk).exists())
+
+
+class CollectOrphansRaceTests(TransactionTestCase):
+    """Test a recipe taking up an orphan while it is being collected"""
+
+    def collect_elsewhere(self, results):
+        try:
+            results.append(collect('tags'))
+        finally:
+            connection.close()
+
+    def test_recipe_keeps_orphan_it_takes_up(self):
+        user = get_user_model().objects.create_user(
+            'ann@example.com', 'pass12345'
+        )
+        tag = Tag.objects.create(user=user, name='Cold')
+        client = APIClient()
+        client.force_authenticate(user)
+        results = []
+        refresh = cards.refresh
+
+        def collect_then_refresh(recipe_ids):
+            # Between the recipe taking up the tag and committing
+            thread = threading.Thread(
+                target=self.collect_elsewhere, args=[results]
+            )
+            thread.start()
+            thread.join()
+            return refresh(recipe_ids)
+
+        with patch.object(cards, 'refresh', collect_then_refresh):
+            res = client.post(RECIPES_URL, {
+                'title': 'Gazpacho', 'time_minutes': 20, 'price': '3.00',
+                'tags': [{'name': 'cold'}],
+            }, format='json')
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(results, [(0, 1)])
+        self.assertEqual(list(Recipe.objects.get().tags.all()), [tag])
@@ -0,0 +1,207 @@
+"""
+Query plan regression tests for the critical endpoints.
+
+A sizeable dataset is seeded and analyzed, the endpoints are called with
+token authentication, and every SELECT they run is EXPLAINed with
+sequential scans discouraged, so a Seq Scan only shows up when no index
+can serve the query. A plan that reads all of a watched table (a
+sequential scan, or an index scan without an index condition such as a
+nested loop over a whole through table) fails the test.
+"""
+
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.db import explain, partitioning
+from core.db.slow_queries import fingerprint
+from core.models import Recipe, Tag, Ingredient
+
+USERS = 200
+RECIPES_PER_USER = 50
+TAGS_PER_USER = 10
+TAGS_PER_RECIPE = 3
+
+WATCHED_TABLES = {
+    'core_user',
+    'core_recipe',
+    'core_tag',
+    'core_ingredient',
+    'core_recipe_tags',
+    'core_recipe_ingredients',
+    'authtoken_token',
+}
+
+
+def seed():
+    """Create USERS users with recipes, tags and ingredients"""
+    users = get_user_model().objects.bulk_create(
+        get_user_model()(email='user%d@example.com' % i, name='User')
+        for i in range(USERS)
+    )
+    Token.objects.bulk_create(
+        Token(key=Token.generate_key(), user=user) for user in users
+    )
+    tags = Tag.objects.bulk_create(
+        Tag(user=user, name='Tag %d' % i)
+        for user in users for i in range(TAGS_PER_USER)
+    )
+    ingredients = Ingredient.objects.bulk_create(
+        Ingredient(user=user, name='Ingredient %d' % i)
+        for user in users for i in range(TAGS_PER_USER)
+    )
+    recipes = Recipe.objects.bulk_create(
+        Recipe(
+            user=user,
+            title='Recipe %d' % i,
+            time_minutes=10,
+            price=Decimal('5.00'),
+        )
+        for user in users for i in range(RECIPES_PER_USER)
+    )
+
+    tag_links = []
+    ingredient_links = []
+    for n, recipe in enumerate(recipes):
+        first = (n // RECIPES_PER_USER) * TAGS_PER_USER
+        for i in range(TAGS_PER_RECIPE):
+            offset = first + (n + i) % TAGS_PER_USER
+            tag_links.append(Recipe.tags.through(
+                recipe_id=recipe.id, tag_id=tags[offset].id,
+            ))
+            ingredient_links.append(Recipe.ingredients.through(
+                recipe_id=recipe.id, ingredient_id=ingredients[offset].id,
+            ))
+    Recipe.tags.through.objects.bulk_create(tag_links)
+    Recipe.ingredients.through.objects.bulk_create(ingredient_links)
+
+    with connection.cursor() as cursor:
+        for table in sorted(WATCHED_TABLES):
+            cursor.execute('ANALYZE %s' % table)
+
+    return users[USERS // 2]
+
+
+class QueryPlanTests(TestCase):
+    """Test endpoint queries keep using indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = seed()
+        cls.recipe = Recipe.objects.filter(user=cls.user).first()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION='Token ' + self.user.auth_token.key
+        )
+
+    def assertIndexedPlans(self, method, url, data=None, expected=200):
+        """Call url and check the plan of every distinct SELECT it ran"""
+        with CaptureQueriesContext(connection) as queries:
+            res = getattr(self.client, method)(url, data, format='json')
+        self.assertEqual(res.status_code, expected)
+
+        plans = {}
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            normalized, digest = fingerprint(sql)
+            if digest in plans:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                plans[digest] = explain.explain(cursor, sql)
+            full = explain.full_scans(plans[digest], WATCHED_TABLES)
+            self.assertEqual(
+                full, [],
+                'Full scan of %s in plan for %s' % (
+                    ', '.join(explain.relation(n) for n in full), normalized,
+                ),
+            )
+        self.assertTrue(plans)
+        return plans
+
+    def assertOrderedByIndex(self, plans, table):
+        """Check the list query on table reads rows in order, unsorted"""
+        for plan in plans.values():
+            scanned = {explain.relation(n) for n in explain.nodes(plan)}
+            scanned.discard(None)
+            if scanned == {table}:
+                node_types = [n['Node Type'] for n in explain.nodes(plan)]
+                self.assertNotIn('Sort', node_types)
+                return
+        self.fail('No query on %s' % table)
+
+    def test_token_auth(self):
+        """Test looking up the token and its user is indexed"""
+        self.assertIndexedPlans('get', reverse('user:me'))
+
+    def test_recipe_list(self):
+        """Test listing a user's recipes and their relations is indexed"""
+        plans = self.assertIndexedPlans('get', reverse('recipe:recipe-list'))
+
+        self.assertOrderedByIndex(plans, 'core_recipe')
+
+    def test_recipe_detail(self):
+        """Test fetching one recipe is indexed"""
+        self.assertIndexedPlans(
+            'get', reverse('recipe:recipe-detail', args=[self.recipe.id])
+        )
+
+    def test_recipe_create_lookups(self):
+        """Test the tag and ingredient lookups on create are indexed"""
+        payload = {
+            'title': 'Curry',
+            'time_minutes': 30,
+            'price': Decimal('2.50'),
+            'tags': [{'name': 'Tag 1'}, {'name': 'New tag'}],
+            'ingredients': [{'name': 'Ingredient 1'}],
+        }
+
+        self.assertIndexedPlans(
+            'post', reverse('recipe:recipe-list'), payload, expected=201
+        )
+
+    def test_tag_list(self):
+        """Test listing tags is indexed"""
+        self.assertIndexedPlans('get', reverse('recipe:tag-list'))
+
+    def test_ingredient_list(self):
+        """Test listing ingredients is indexed"""
+        self.assertIndexedPlans('get', reverse('recipe:ingredient-list'))
+
+    def test_pk_writes_after_partitioning(self):
+        """Test updates and deletes by id alone use an index per partition"""
+        call_command(
+            'partition_tables', partitions=4, batch_size=5000, sleep=0,
+            user=self.user.id, recipe=self.recipe.id, stdout=StringIO(),
+        )
+
+        with connection.cursor() as cursor:
+            for spec in partitioning.TABLES:
+                cursor.execute('ANALYZE %s' % spec.table)
+                parts = partitioning.partitions(cursor, spec.table)
+                for sql in (
+                    'UPDATE %s SET id = id WHERE id = %%s' % spec.table,
+                    'DELETE FROM %s WHERE id = %%s' % spec.table,
+                ):
+                    plan = explain.explain(cursor, sql, [self.recipe.id])
+                    scanned = [
+                        explain.relation(node)
+                        for node in explain.nodes(plan)
+                        if node['Node Type'] == 'Seq Scan'
+                    ]
+                    self.assertFalse(
+                        set(scanned) & parts,
+                        'Seq Scan of %s for %s' % (', '.join(scanned), sql),
+                    )
@@ -251,6 +251,48 @@ class PrivateRecipeAPITest(TestCase):
         for tag in payload['tags']:
             self.assertTrue(recipe.tags.filter(name=tag['name'], user=self.user).exists())
 
+    def test_create_recipe_reuses_tags_differing_in_case(self):
+        """Test tags differing only in case or spacing are not repeated"""
+
+        tag = Tag.objects.create(user=self.user, name='Indian')
+        payload = {
+            'title': 'Dosa',
+            'time_minutes': 30,
+            'price': Decimal('2.50'),
+            'tags': [{'name': ' indian'}],
+            'ingredients': [{'name': 'Rice'}, {'name': 'RICE'}],
+        }
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertEqual(list(recipe.tags.all()), [tag])
+        self.assertEqual(Tag.objects.get().name, 'Indian')
+        self.assertEqual(list(recipe.ingredients.values_list('name', flat=True)), ['Rice'])
+
+    def test_create_recipe_with_tag_lengthened_by_normalizing(self):
+        """Test a 255 character name longer once normalized is accepted,
+        unless too long to index"""
+
+        payload = {
+            'title': 'Strudel',
+            'time_minutes': 60,
+            'price': Decimal('4.00'),
+            'tags': [{'name': '\u00df' * 255}],
+        }
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tag.objects.get().normalized_name, 'ss' * 255)
+
+        payload['tags'] = [{'name': '\ufdfa' * 255}]
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Recipe.objects.count(), 1)
+
     def test_create_tag_on_update(self):
         """Test creating tag when updating the recipe"""
 
@@ -85,6 +85,27 @@ class PrivateTagsAPITests(TestCase):
         tag.refresh_from_db()
         self.assertEqual(tag.name, payload['name'])
 
+    def test_updating_tag_to_existing_name(self):
+        """Test renaming a tag to another tag's name is refused"""
+
+        Tag.objects.create(user=self.user, name='Vegan')
+        tag = Tag.objects.create(user=self.user, name='New Tag')
+
+        res = self.client.patch(get_tag_detail(tag.id), {'name': 'vegan '})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_updating_tag_case(self):
+        """Test a tag can be renamed to another case of its name"""
+
+        tag = Tag.objects.create(user=self.user, name='vegan')
+
+        res = self.client.patch(get_tag_detail(tag.id), {'name': 'Vegan'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'Vegan')
+
     def test_delete_tag(self):
         """Test Deleting a Tag"""
         tag = Tag.objects.create(user=self.user, name='New Tag')
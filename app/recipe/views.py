@@ -1,13 +1,23 @@
 """Views for Recipe API"""
 
-from rest_framework import viewsets, mixins
+from django.db import transaction
+from django.urls import reverse
+from rest_framework import viewsets, mixins, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 
+from core.db.routers import ReplicaReadsMixin
+from core import jobs, outbox
+from core.db.timeouts import StatementTimeoutMixin
 from core.models import Recipe, Tag, Ingredient
-from recipe import serializers
+from core.timing import TimedPhasesMixin
+from recipe import cards, merging, serializers
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(StatementTimeoutMixin, TimedPhasesMixin,
+                    ReplicaReadsMixin, viewsets.ModelViewSet):
     """View for manage recipe APIs"""
 
     serializer_class = serializers.RecipeDetailSerializer
@@ -16,12 +26,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user).order_by('-id')
+        queryset = self.queryset.filter(user=self.request.user).order_by('-id')
+        if self.action != 'list':
+            ## Only the list reads the card snapshot
+            queryset = queryset.defer('card')
+        return queryset
 
     def get_serializer_class(self):
         """Return Serailizer Class for Request"""
         if self.action == 'list': ## If HTTP GET is taken from the Root of the APP.
             return serializers.RecipeSerializer
+        if self.action == 'import_recipes':
+            return serializers.RecipeImportSerializer
 
         return self.serializer_class
 
@@ -29,22 +45,114 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Create a new recipe"""
         serializer.save(user=self.request.user)
 
-class TagViewSet(mixins.ListModelMixin, viewsets.GenericViewSet, mixins.UpdateModelMixin, mixins.DestroyModelMixin):
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        outbox.publish(instance.user_id, 'recipe.deleted', {'id': instance.pk})
+        super().perform_destroy(instance)
+
+    def get_list_data(self, queryset):
+        """Return the list representation, from the card snapshots when
+        they are on"""
+        if cards.enabled():
+            return cards.list_data(queryset)
+        return self.get_serializer(queryset, many=True).data
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(self.get_list_data(queryset))
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def import_recipes(self, request):
+        """Queue creating many recipes, answering with the job to poll"""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = jobs.enqueue('recipe.import', {
+            'user_id': request.user.pk, 'recipes': request.data['recipes'],
+        }, user=request.user)
+        return Response(
+            jobs.JobSerializer(job).data, status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('job-detail', args=[job.pk])},
+        )
+
+class RecipeRelationMixin:
+    """Keep the recipes using a tag or ingredient in step when it is
+    renamed or deleted: refresh their cards and publish the change, in the
+    same transaction"""
+
+    relation = None
+
+    def publish(self, instance, action, recipe_ids):
+        topic = '%s.%s' % (self.relation[:-1], action)
+        outbox.publish(instance.user_id, topic, {
+            'id': instance.pk, 'name': instance.name, 'recipes': recipe_ids,
+        })
+
+    def get_serializer_class(self):
+        if self.action == 'merge':
+            return serializers.MergeSerializer
+        return self.serializer_class
+
+    @action(detail=True, methods=['post'])
+    def merge(self, request, pk=None):
+        """Merge the sources into this one, optionally renaming it, in one
+        transaction whatever the number of recipes"""
+        target = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        sources = set(serializer.validated_data['sources'])
+        if target.pk in sources:
+            raise ValidationError(
+                {'sources': ['Cannot merge into one of the sources.']}
+            )
+
+        # The sources and name are checked once merge() has locked them
+        with transaction.atomic():
+            merging.merge(
+                self.relation, target, sorted(sources),
+                serializer.validated_data.get('name'),
+            )
+        return Response(self.serializer_class(target).data)
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        recipe_ids = cards.recipes_with(
+            self.relation, [serializer.instance.pk]
+        )
+        cards.refresh(recipe_ids)
+        self.publish(serializer.instance, 'updated', recipe_ids)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        recipe_ids = cards.recipes_with(self.relation, [instance.pk])
+        self.publish(instance, 'deleted', recipe_ids)
+        super().perform_destroy(instance)
+        cards.refresh(recipe_ids)
+
+class TagViewSet(StatementTimeoutMixin, RecipeRelationMixin, TimedPhasesMixin,
+                 ReplicaReadsMixin, mixins.ListModelMixin,
+                 viewsets.GenericViewSet, mixins.UpdateModelMixin,
+                 mixins.DestroyModelMixin):
     """View for Manage Tags APIs"""
 
     serializer_class = serializers.TagSerializer
     queryset = Tag.objects.all()
+    relation = 'tags'
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         return self.queryset.filter(user=self.request.user).order_by('-name')
 
-class IngredientViewSet(mixins.ListModelMixin, viewsets.GenericViewSet, mixins.UpdateModelMixin, mixins.DestroyModelMixin):
+class IngredientViewSet(StatementTimeoutMixin, RecipeRelationMixin,
+                        TimedPhasesMixin, ReplicaReadsMixin,
+                        mixins.ListModelMixin, viewsets.GenericViewSet,
+                        mixins.UpdateModelMixin, mixins.DestroyModelMixin):
     """View for Manage Ingredients API"""
 
     serializer_class = serializers.IngredientSerializer
     queryset = Ingredient.objects.all()
+    relation = 'ingredients'
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
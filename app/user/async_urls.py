@@ -0,0 +1,15 @@
+"""
+Async URL patterns for the user API, served first under ASGI
+
+The regular patterns follow, so every name in the namespace reverses.
+"""
+
+from django.urls import path
+from user import async_views, urls
+
+app_name = "user"
+
+urlpatterns = [
+    path('create/', async_views.create_user, name='create'),
+    path('token/', async_views.create_token, name='token'),
+] + urls.urlpatterns
@@ -6,18 +6,22 @@ from rest_framework import generics # akin to generic views for APIs
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 from rest_framework import authentication, permissions
+from core.db.timeouts import StatementTimeoutMixin
+from core.timing import TimedPhasesMixin
 from user.serializers import UserSerializer, AuthTokenSerializer
 
-class CreateUserView(generics.CreateAPIView):
+class CreateUserView(StatementTimeoutMixin, generics.CreateAPIView):
     """Create a new user in the system"""
     serializer_class = UserSerializer # Set serializer for generic API View
 
-class CreateTokenView(ObtainAuthToken):
+class CreateTokenView(StatementTimeoutMixin, ObtainAuthToken):
     """Create a new auth token for user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES # Shows the user interface for token
+    ## ObtainAuthToken turns throttling off; guessing passwords needs it most
+    throttle_classes = api_settings.DEFAULT_THROTTLE_CLASSES
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+class ManageUserView(StatementTimeoutMixin, TimedPhasesMixin, generics.RetrieveUpdateAPIView):
     """Manage the authenticated user"""
     # Retrieve = HTTP GET, Update = HTTP PUT or PATCH
 